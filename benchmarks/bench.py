@@ -0,0 +1,250 @@
+"""
+Benchmarks for the model queries and the hot views.
+
+    python -m benchmarks.bench --groups 8 --offices 10 --candidates 5 --tokens 5000 --ballots 3000
+    python -m benchmarks.bench --out new.json --compare baseline.json
+
+A synthetic election (election1/synthetic.py) is seeded into a fresh SQLite file, then
+every case runs --repeat times.  The timings (min, median, mean, p95 in milliseconds)
+and the database queries per run are written to --out as JSON together with the
+election size and the versions, so two runs can be compared.  With --compare the run
+fails when a case's median is more than --threshold slower than in the baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--groups', type=int, default=4)
+    parser.add_argument('--offices', type=int, default=6)
+    parser.add_argument('--candidates', type=int, default=4, help='candidates per group and office')
+    parser.add_argument('--tokens', type=int, default=2000)
+    parser.add_argument('--ballots', type=int, default=1000, help='tokens that have already voted')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=30, help='runs per case')
+    parser.add_argument('--only', action='append', help='run only the cases whose name contains this text')
+    parser.add_argument('--out', default='benchmark-results.json')
+    parser.add_argument('--compare', help='a previous result file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed median slow down, 0.25 is 25%%')
+    args = parser.parse_args(argv)
+    token_cases = [name for name in TOKEN_CASES if selected(args, name)]
+    needed = args.repeat * len(token_cases)
+    if args.tokens - args.ballots < needed:
+        parser.error(f'{", ".join(token_cases)} use {args.repeat} unused tokens each (--repeat), the election has'
+                     f' {args.tokens - args.ballots} (--tokens minus --ballots), at least {needed} are needed')
+    return args
+
+
+def selected(args, name):
+    return not args.only or any(text in name for text in args.only)
+
+
+def configure_environment(database_path):
+    """
+    Point the app at the benchmark database, must run before election1 is imported.
+    """
+    os.environ.update({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database_path}',
+        'DB_AUTO_BOOTSTRAP': 'true',
+        'RATELIMIT_ENABLED': 'false',
+        'SQL_PROFILER': 'false',
+        'LOG_PROFILE': 'production',
+        'LOG_LEVEL': 'WARNING',
+        'VOTE_EVENT_LOG': '',
+    })
+
+
+class QueryCounter:
+    """
+    Counts the statements sent to any engine while active.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.remove(Engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def measure(run, repeat):
+    """
+    Call run() repeat times.
+    :return: the timing summary of the runs.
+    """
+    timings, queries = [], []
+    for i in range(repeat):
+        with QueryCounter() as counter:
+            start = time.perf_counter()
+            run(i)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+    timings.sort()
+    return {
+        'runs': repeat,
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'queries': round(statistics.fmean(queries), 2),
+    }
+
+
+def model_cases(election):
+    from election1.models import Candidate, Office, Tokenlist
+    group = election.groups[0]
+    token = election.unused_tokens[0][1] if election.unused_tokens else election.voted_tokens[0][1]
+    return {
+        'model.get_summary_results': lambda i: Candidate.get_summary_results(),
+        'model.candidate_search': lambda i: Candidate.candidate_search(1, limit=50).all(),
+        'model.candidate_search_prefix': lambda i: Candidate.candidate_search(1, name_prefix='a', limit=50).all(),
+        'model.query_offices_for_classgroup': lambda i: Office.query_offices_for_classgroup_with_details_as_list(group),
+        'model.get_tokenlist_record': lambda i: Tokenlist.get_tokenlist_record(token),
+    }
+
+
+# the view cases that use one unused token per run, each gets its own
+TOKEN_CASES = ('view.cast', 'view.post_ballot')
+
+
+def view_cases(app, election, repeat):
+    unused = list(election.unused_tokens)
+    cast_tokens, ballot_tokens = unused[:repeat], unused[repeat:2 * repeat]
+
+    def cast(i):
+        grp_list, token = cast_tokens[i]
+        response = app.test_client().get(f'/cast/{grp_list}/{token}')
+        assert response.status_code == 200, response.status_code
+
+    def post_ballot(i):
+        grp_list, token = ballot_tokens[i]
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['token_list_record'] = {'token': token, 'grp_list': grp_list}
+            session['office_dict'] = {grp_list: [
+                [title, sortkey, vote_for,
+                 [[str(id_candidate), name] for id_candidate, name in
+                  election.candidates[(grp_list, id_office)][:vote_for]], [None] * vote_for]
+                for id_office, title, sortkey, vote_for in election.offices[grp_list]]}
+        response = client.post('/post_ballot')
+        assert response.status_code == 200, response.status_code
+
+    client = app.test_client()
+
+    def vote_results(i):
+        response = client.get('/vote_results')
+        assert response.status_code == 200, response.status_code
+
+    def single_token(i):
+        response = client.get('/single_token/1')
+        assert response.status_code == 200, response.status_code
+
+    return {
+        'view.cast': cast,
+        'view.post_ballot': post_ballot,
+        'view.vote_results': vote_results,
+        'view.single_token': single_token,
+    }
+
+
+def versions():
+    from importlib.metadata import version
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'flask': version('flask'),
+            'sqlalchemy': version('sqlalchemy')}
+
+
+def compare(results, baseline_path, threshold):
+    """
+    :return: the names of the cases whose median regressed past threshold.
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)['results']
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or not before['median_ms']:
+            continue
+        change = result['median_ms'] / before['median_ms'] - 1
+        result['median_change'] = round(change, 3)
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='election-bench-')
+    configure_environment(os.path.join(workdir, 'bench.db'))
+
+    from election1 import create_app
+    from election1.synthetic import seed_election, election_size
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        start = time.perf_counter()
+        election = seed_election(args.groups, args.offices, args.candidates, args.tokens, args.ballots, args.seed)
+        seed_seconds = time.perf_counter() - start
+        size = election_size()
+
+    results = {}
+    with app.app_context():
+        cases = model_cases(election)
+        cases.update(view_cases(app, election, args.repeat))
+        for name, run in cases.items():
+            if not selected(args, name):
+                continue
+            results[name] = measure(run, args.repeat)
+            print(f"{name:40} median {results[name]['median_ms']:9.3f} ms  p95 {results[name]['p95_ms']:9.3f} ms"
+                  f"  queries {results[name]['queries']}")
+
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'versions': versions(),
+        'parameters': {key: getattr(args, key) for key in
+                       ('groups', 'offices', 'candidates', 'tokens', 'ballots', 'seed', 'repeat')},
+        'database': {'backend': 'sqlite', 'rows': size, 'seed_seconds': round(seed_seconds, 3)},
+        'results': results,
+        'regressions': regressions,
+    }
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'wrote {args.out}')
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if regressions:
+        print(f"slower than {args.compare} by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
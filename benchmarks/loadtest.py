@@ -0,0 +1,460 @@
+"""
+Load test: concurrent voters going through the whole ballot.
+
+    python -m benchmarks.loadtest --voters 500 --concurrency 25
+    python -m benchmarks.loadtest --server gunicorn --workers 4 --worker-class sync --db-profile production
+    python -m benchmarks.loadtest --server none --url http://127.0.0.1:8000 --database sqlite:////srv/election.db
+
+Every voter opens /cast/<grp_list>/<token>, posts a valid VoteForOne or VoteForMany form
+(with its CSRF token and now and then a write-in) for each office, reaches the review
+page (cast3.html), with --edit-rate goes back once through edit_choice, and posts the
+ballot to /post_ballot.  With --revote some voters come back afterwards and must be
+turned away.
+
+The harness seeds a synthetic election (election1/synthetic.py) into --database unless
+it already has one, starts the app with the chosen server, worker model and DB_PROFILE,
+and reports the throughput, the p50/p95/p99 latency per step, the errors by kind and,
+from /metrics, the database queries per request and the ballot commits that failed
+(a locked SQLite database).  The report is also written to --out as JSON.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = ('open', 'office', 'review', 'submit', 'revote')
+
+_CSRF = re.compile(r'name="csrf_token" value="([^"]+)"')
+_FORM_NAME = re.compile(r'name="form_name" value="(\w+)"')
+_RADIO = re.compile(r'name="candidate"[^>]*?value="([^"]+)"', re.S)
+_CHECKBOX = re.compile(r'name="candidates"[^>]*?value="([^"]+)"', re.S)
+_MAX_VOTES = re.compile(r'data-max-selections="(\d+)"')
+_EDIT_LINK = re.compile(r'href="(/edit_choice/[^"]+)"')
+_METRIC = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--voters', type=int, default=200, help='ballots to cast')
+    parser.add_argument('--concurrency', type=int, default=20, help='voters at the same time')
+    parser.add_argument('--think-time', type=float, default=0.0, help='most seconds a voter waits between steps')
+    parser.add_argument('--edit-rate', type=float, default=0.1, help='share of the voters that change a choice')
+    parser.add_argument('--revote', type=float, default=0.05, help='share of the voters that try to vote again')
+    add_app_arguments(parser)
+    parser.add_argument('--out', default='loadtest-results.json')
+    return parser.parse_args(argv)
+
+
+def add_app_arguments(parser):
+    """
+    The options for the app under test and its election, shared with replay.py.
+    """
+    parser.add_argument('--writein-rate', type=float, default=0.05, help='share of the offices voted by write-in')
+    parser.add_argument('--server', choices=('gunicorn', 'flask', 'none'), default='gunicorn',
+                        help="'none' tests the app already running at --url")
+    parser.add_argument('--url', help='the app to test with --server none')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--worker-class', default='gthread', help='gunicorn worker class, gthread or sync')
+    parser.add_argument('--app-profile', default='voter', help='APP_PROFILE of the started app')
+    parser.add_argument('--db-profile', default='production', help='DB_PROFILE of the started app')
+    parser.add_argument('--database', help='SQLALCHEMY_DATABASE_URI, default a new SQLite file')
+    parser.add_argument('--ratelimit', action='store_true', help='keep the admission control of the app on')
+    parser.add_argument('--groups', type=int, default=4)
+    parser.add_argument('--offices', type=int, default=6)
+    parser.add_argument('--candidates', type=int, default=4)
+    parser.add_argument('--multi-group', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request counts as failed')
+
+
+class Recorder:
+    """
+    Latencies per step and error counts, shared by the voter threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.outcomes = defaultdict(int)
+
+    def latency(self, step, seconds):
+        with self.lock:
+            self.latencies[step].append(seconds)
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def outcome(self, kind):
+        with self.lock:
+            self.outcomes[kind] += 1
+
+
+class VoterError(Exception):
+    """
+    A voter could not go on, kind is the error count it is reported under.
+    """
+
+    def __init__(self, kind):
+        super().__init__(kind)
+        self.kind = kind
+
+
+class Voter:
+    """
+    One browser session: a cookie jar and the steps of the ballot.
+    """
+
+    def __init__(self, base_url, grp_list, token, recorder, rng, args):
+        self.base_url = base_url.rstrip('/')
+        self.grp_list = grp_list
+        self.token = token
+        self.recorder = recorder
+        self.rng = rng
+        self.args = args
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    @property
+    def cast_path(self):
+        return f'/cast/{urllib.parse.quote(self.grp_list)}/{self.token}'
+
+    def request(self, step, path, form=None, retries=3):
+        """
+        GET path, or POST form to it, timed as step.  A 429 please wait page is retried
+        after its Retry-After like the page itself does.
+        :return: the html of the response.
+        """
+        data = urllib.parse.urlencode(form, doseq=True).encode() if form is not None else None
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                with self.opener.open(self.base_url + path, data=data, timeout=self.args.timeout) as response:
+                    body = response.read().decode()
+                self.recorder.latency(step, time.perf_counter() - start)
+                return body
+            except urllib.error.HTTPError as e:
+                self.recorder.latency(step, time.perf_counter() - start)
+                if e.code == 429 and attempt < retries:
+                    self.recorder.error('retried_429')
+                    time.sleep(float(e.headers.get('Retry-After', 1)))
+                    continue
+                raise VoterError(f'http_{e.code}')
+            except (urllib.error.URLError, OSError) as e:
+                raise VoterError('timeout' if 'timed out' in str(e) else 'connection')
+
+    def think(self):
+        if self.args.think_time:
+            time.sleep(self.rng.random() * self.args.think_time)
+
+    def wants_edit(self):
+        return self.rng.random() < self.args.edit_rate
+
+    def wants_submit(self):
+        return True
+
+    def wants_revote(self):
+        return self.rng.random() < self.args.revote
+
+    def choose(self, page):
+        """
+        :return: the form that votes on the office page.
+        """
+        csrf = _CSRF.search(page)
+        form_name = _FORM_NAME.search(page)
+        if csrf is None or form_name is None:
+            raise VoterError('unexpected_page')
+        form = {'csrf_token': csrf.group(1), 'form_name': form_name.group(1)}
+        if form_name.group(1) == 'VoteForOne':
+            choices = _RADIO.findall(page)
+            writein = [value for value in choices if value.endswith('$Write In')]
+            names = [value for value in choices if value not in writein and not value.startswith('99$')]
+            if writein and self.rng.random() < self.args.writein_rate:
+                form['candidate'] = writein[0]
+                form['writein_name'] = f'Load Test {self.rng.randrange(1000)}'
+            else:
+                form['candidate'] = self.rng.choice(names or choices)
+        else:
+            choices = [value for value in _CHECKBOX.findall(page) if not value.startswith('99$')]
+            max_votes = int(_MAX_VOTES.search(page).group(1)) if _MAX_VOTES.search(page) else 1
+            form['candidates'] = self.rng.sample(choices, self.rng.randint(1, min(max_votes, len(choices))))
+        return form
+
+    def vote_offices(self, page):
+        """
+        Vote every office until the review page.
+        """
+        for _ in range(200):
+            if 'Ballot Review' in page:
+                return page
+            if 'Opps!' in page:
+                raise VoterError('token_rejected')
+            self.think()
+            page = self.request('office', self.cast_path, self.choose(page))
+        raise VoterError('no_review_page')
+
+    def vote(self):
+        page = self.request('open', self.cast_path)
+        if 'Opps!' in page:
+            raise VoterError('token_rejected')
+        page = self.vote_offices(page)
+
+        edit_links = _EDIT_LINK.findall(page)
+        if edit_links and self.wants_edit():
+            # change one choice: edit_choice redirects back to the office page
+            self.think()
+            page = self.request('review', self.rng.choice(edit_links))
+            page = self.request('review', self.cast_path, self.choose(page))
+            page = self.vote_offices(page)
+
+        if not self.wants_submit():
+            self.recorder.outcome('abandoned')
+            return
+        csrf = _CSRF.search(page)
+        if csrf is None:
+            raise VoterError('unexpected_page')
+        self.think()
+        page = self.request('submit', '/post_ballot', {'csrf_token': csrf.group(1)})
+        if 'Thank you for voting' not in page:
+            raise VoterError('not_thanked')
+        self.recorder.outcome('ballots_cast')
+
+        if self.wants_revote():
+            # a new browser session with the used token must be turned away
+            self.opener = urllib.request.build_opener(
+                urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            page = self.request('revote', self.cast_path)
+            if 'Opps!' in page:
+                self.recorder.outcome('double_votes_rejected')
+            else:
+                raise VoterError('double_vote_accepted')
+
+
+def run_voter(base_url, grp_list, token, recorder, seed, args):
+    try:
+        Voter(base_url, grp_list, token, recorder, random.Random(seed), args).vote()
+    except VoterError as e:
+        recorder.error(e.kind)
+    except Exception as e:
+        recorder.error(type(e).__name__)
+
+
+def percentiles(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {}
+
+    def nearest_rank(p):
+        return round(values[min(len(values) - 1, max(0, int(len(values) * p + 0.5) - 1))] * 1000, 2)
+
+    return {'requests': len(values), 'p50_ms': nearest_rank(0.50), 'p95_ms': nearest_rank(0.95),
+            'p99_ms': nearest_rank(0.99), 'max_ms': round(values[-1] * 1000, 2)}
+
+
+def read_metrics(base_url):
+    """
+    :return: {(name, labels): value} of the /metrics page, {} if the app has no metrics.
+    A remote app (--url) is read with the METRICS_TOKEN of the environment.
+    """
+    metrics_request = urllib.request.Request(base_url.rstrip('/') + '/metrics')
+    if os.getenv('METRICS_TOKEN'):
+        metrics_request.add_header('Authorization', f"Bearer {os.getenv('METRICS_TOKEN')}")
+    try:
+        with urllib.request.urlopen(metrics_request, timeout=10) as response:
+            text = response.read().decode()
+    except (urllib.error.URLError, OSError):
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        match = _METRIC.match(line)
+        if match:
+            samples[(match.group(1), match.group(2))] = float(match.group(3))
+    return samples
+
+
+def metrics_delta(before, after):
+    """
+    :return: the queries per request by endpoint and the ballot commits by outcome run between the two reads.
+    """
+    def delta(key):
+        return after.get(key, 0) - before.get(key, 0)
+
+    queries = {}
+    for name, labels in after:
+        if name == 'election_db_queries_per_request_count':
+            requests = delta((name, labels))
+            total = delta(('election_db_queries_per_request_sum', labels))
+            if requests:
+                endpoint = re.search(r'endpoint="([^"]*)"', labels).group(1)
+                queries[endpoint] = {'requests': int(requests), 'queries_per_request': round(total / requests, 2)}
+    commits = {re.search(r'outcome="([^"]*)"', labels).group(1): int(delta((name, labels)))
+               for name, labels in after if name == 'election_ballot_commits_total'}
+    return queries, commits
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, env, workdir):
+    """
+    Start the app under test.
+    :return: (process, base url).
+    """
+    port = free_port()
+    if args.server == 'gunicorn':
+        env['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(workdir, 'metrics')
+        os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}',
+                   '-w', str(args.workers), '-k', args.worker_class, '--threads', str(args.threads),
+                   '--access-logfile', os.path.join(workdir, 'access.log'), 'wsgi:app']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'run', 'run', '--with-threads', '--no-reload',
+                   '-p', str(port)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=open(os.path.join(workdir, 'server.log'), 'w'),
+                               stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'the server exited, see {workdir}/server.log')
+        try:
+            urllib.request.urlopen(base_url + '/metrics', timeout=1).close()
+            return process, base_url
+        except urllib.error.HTTPError:
+            return process, base_url  # up, without metrics
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('the server did not start within 30s')
+
+
+def app_environment(args, workdir):
+    """
+    :return: the environment of the app under test.
+    """
+    env = dict(os.environ)
+    env.update({
+        'SQLALCHEMY_DATABASE_URI': args.database or f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        'DB_PROFILE': args.db_profile,
+        'APP_PROFILE': args.app_profile,
+        'DB_AUTO_BOOTSTRAP': 'false',
+        'RATELIMIT_ENABLED': str(args.ratelimit),
+        'ENFORCE_VOTING_WINDOW': 'false',
+        'SQL_PROFILER': 'false',
+        'LOG_PROFILE': 'production',
+        'LOG_LEVEL': 'WARNING',
+        'VOTE_EVENT_LOG': '',
+        'TRAFFIC_CAPTURE': '',
+    })
+    return env
+
+
+def prepare_election(args, env, voters):
+    """
+    Seed the synthetic election for voters unless the database has one.
+    :return: (grp_list, token) pairs that have not voted yet.
+    """
+    os.environ.update(env)
+    os.environ['DB_AUTO_BOOTSTRAP'] = 'true'
+    from election1 import create_app
+    from election1.models import Classgrp
+    from election1.synthetic import build_election, load_election
+
+    app = create_app('full')
+    with app.app_context():
+        if Classgrp.query.first() is None:
+            tokens = int(voters * 1.1) + 10
+            election = build_election(args.groups, args.offices, args.candidates, tokens, args.seed,
+                                      args.multi_group, writeins=0.3)
+        else:
+            election = load_election()
+    return election.unused_tokens
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.server == 'none' and not (args.url and args.database):
+        raise SystemExit('--server none needs --url and the --database of that app')
+
+    workdir = tempfile.mkdtemp(prefix='election-load-')
+    env = app_environment(args, workdir)
+    voters = prepare_election(args, dict(env), args.voters)
+    if len(voters) < args.voters:
+        print(f'only {len(voters)} unused tokens, testing with them')
+    voters = voters[:args.voters]
+
+    process = None
+    try:
+        if args.server == 'none':
+            base_url = args.url
+        else:
+            process, base_url = start_server(args, env, workdir)
+        before = read_metrics(base_url)
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for n, (grp_list, token) in enumerate(voters):
+                pool.submit(run_voter, base_url, grp_list, token, recorder, args.seed * 100003 + n, args)
+        seconds = time.perf_counter() - start
+
+        queries, commits = metrics_delta(before, read_metrics(base_url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    requests = sum(len(latencies) for latencies in recorder.latencies.values())
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'out'},
+        'seconds': round(seconds, 2),
+        'ballots_per_second': round(recorder.outcomes['ballots_cast'] / seconds, 2),
+        'requests_per_second': round(requests / seconds, 2),
+        'outcomes': dict(recorder.outcomes),
+        'errors': dict(recorder.errors),
+        'error_rate': round(sum(count for kind, count in recorder.errors.items() if kind != 'retried_429')
+                            / max(1, len(voters)), 4),
+        'steps': {step: percentiles(recorder.latencies[step]) for step in STEPS if recorder.latencies[step]},
+        'db_queries': queries,
+        'ballot_commits': commits,
+    }
+
+    print(f"{len(voters)} voters, {args.concurrency} at a time: {recorder.outcomes['ballots_cast']} ballots in "
+          f"{report['seconds']}s, {report['ballots_per_second']} ballots/s, {report['requests_per_second']} requests/s")
+    for step, summary in report['steps'].items():
+        print(f"  {step:8} {summary['requests']:6} requests  p50 {summary['p50_ms']:8.2f} ms  "
+              f"p95 {summary['p95_ms']:8.2f} ms  p99 {summary['p99_ms']:8.2f} ms")
+    for endpoint, summary in queries.items():
+        print(f"  {endpoint:20} {summary['queries_per_request']} queries/request")
+    print(f"  outcomes {report['outcomes']}  errors {report['errors'] or 'none'}  ballot commits {commits}")
+
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'wrote {args.out}')
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if report['error_rate'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
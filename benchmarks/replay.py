@@ -0,0 +1,250 @@
+"""
+Replay captured election traffic against a test instance.
+
+    TRAFFIC_CAPTURE=traffic.jsonl gunicorn -c gunicorn.conf.py wsgi:app      # election day
+    python -m benchmarks.replay traffic.jsonl --speed 5
+
+The capture (election1/capture.py) has one anonymized line per request.  The lines of
+one voter make a session: when it started, how many groups and offices its ballot
+had, the gaps between its requests, whether it changed a choice and whether it posted
+the ballot.  Each session is played again by a load test voter (loadtest.py) with a
+token of the synthetic election that has the same number of groups, starting at the
+captured time and waiting the captured gaps, all divided by --speed.  So the bursts
+of class-by-class voting come back as they were, 5 or 10 times faster if asked.
+
+Requests without a voter (admin pages, results) are sent again as plain GETs when
+their route has no parameters and skipped otherwise.  The report is the one of
+loadtest.py plus how late the sessions started against the schedule.
+"""
+import argparse
+import json
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from benchmarks.loadtest import (Recorder, Voter, VoterError, STEPS, add_app_arguments, app_environment,
+                                 prepare_election, start_server, read_metrics, metrics_delta, percentiles)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('capture', help='a TRAFFIC_CAPTURE file')
+    parser.add_argument('--speed', type=float, default=1.0, help='1, 5 or 10 times the captured pace')
+    parser.add_argument('--limit', type=int, help='replay only the first sessions')
+    parser.add_argument('--max-concurrency', type=int, default=200, help='voter threads, sessions beyond wait')
+    add_app_arguments(parser)
+    # by default the synthetic ballot gets the size of the captured ones
+    parser.set_defaults(offices=None, multi_group=None)
+    parser.add_argument('--out', default='replay-results.json')
+    return parser.parse_args(argv)
+
+
+@dataclass
+class Session:
+    """
+    The requests of one voter in the capture.
+    """
+    start: float
+    groups: int = 1
+    offices: int = 0
+    gaps: list = field(default_factory=list)  # seconds between its requests
+    edit: bool = False
+    submit: bool = False
+
+
+def load_capture(path, limit=None):
+    """
+    :return: (the voter sessions by start time, the other requests as (t, route), the capture start time).
+    """
+    with open(path) as file:
+        records = sorted((json.loads(line) for line in file if line.strip()), key=lambda record: record['t'])
+    if not records:
+        raise SystemExit(f'{path} has no requests')
+
+    sessions, last_seen, others = {}, {}, []
+    for record in records:
+        voter = record.get('voter')
+        if voter is None:
+            others.append((record['t'], record.get('route')))
+            continue
+        session = sessions.get(voter)
+        if session is None:
+            session = sessions[voter] = Session(start=record['t'])
+        else:
+            session.gaps.append(record['t'] - last_seen[voter])
+        last_seen[voter] = record['t']
+        session.groups = max(session.groups, record.get('groups') or 1)
+        session.offices = max(session.offices, record.get('offices') or 0)
+        session.edit |= record.get('endpoint') == 'vote.edit_choice'
+        session.submit |= record.get('endpoint') == 'vote.post_ballot'
+    sessions = sorted(sessions.values(), key=lambda session: session.start)[:limit]
+    return sessions, others, records[0]['t']
+
+
+class ReplayVoter(Voter):
+    """
+    A voter that waits the captured gaps and makes the captured choices.
+    """
+
+    def __init__(self, session, speed, *args):
+        super().__init__(*args)
+        self.gaps = iter(session.gaps)
+        self.session = session
+        self.speed = speed
+
+    def think(self):
+        time.sleep(next(self.gaps, 0) / self.speed)
+
+    def wants_edit(self):
+        return self.session.edit
+
+    def wants_submit(self):
+        return self.session.submit
+
+    def wants_revote(self):
+        return False
+
+
+def assign_tokens(sessions, unused_tokens):
+    """
+    :return: a (grp_list, token) per session, multi group ballots get multi group tokens when there are any.
+    """
+    pools = defaultdict(list)
+    for grp_list, token in unused_tokens:
+        pools[grp_list.count('$') > 0].append((grp_list, token))
+    assigned = []
+    for session in sessions:
+        pool = pools[session.groups > 1] or pools[session.groups <= 1]
+        if not pool:
+            raise SystemExit(f'not enough unused tokens for {len(sessions)} sessions')
+        assigned.append(pool.pop())
+    return assigned
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.server == 'none' and not (args.url and args.database):
+        raise SystemExit('--server none needs --url and the --database of that app')
+    if args.speed <= 0:
+        raise SystemExit('--speed must be above 0')
+
+    sessions, others, capture_start = load_capture(args.capture, args.limit)
+    if args.multi_group is None:
+        args.multi_group = sum(session.groups > 1 for session in sessions) / len(sessions)
+    if args.offices is None:
+        args.offices = max(1, round(statistics.median(session.offices / session.groups for session in sessions)))
+
+    workdir = tempfile.mkdtemp(prefix='election-replay-')
+    env = app_environment(args, workdir)
+    voters = assign_tokens(sessions, prepare_election(args, dict(env), len(sessions)))
+
+    process = None
+    recorder = Recorder()
+    lags, lock = [], threading.Lock()
+    try:
+        if args.server == 'none':
+            base_url = args.url
+        else:
+            process, base_url = start_server(args, env, workdir)
+        before = read_metrics(base_url)
+
+        def play(at, run):
+            lag = time.perf_counter() - at
+            if lag < 0:
+                time.sleep(-lag)
+                lag = 0
+            with lock:
+                lags.append(lag)
+            run()
+
+        def replay_session(session, grp_list, token, seed):
+            try:
+                ReplayVoter(session, args.speed, base_url, grp_list, token, recorder, random.Random(seed), args).vote()
+            except VoterError as e:
+                recorder.error(e.kind)
+            except Exception as e:
+                recorder.error(type(e).__name__)
+
+        def replay_other(route):
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(base_url + route, timeout=args.timeout).close()
+                recorder.latency('other', time.perf_counter() - start)
+            except urllib.error.HTTPError as e:
+                recorder.latency('other', time.perf_counter() - start)
+                recorder.error(f'http_{e.code}')
+            except OSError:
+                recorder.error('connection')
+
+        # one schedule of sessions and other requests, in captured order
+        schedule = [(session.start, 'session', (session, grp_list, token, args.seed * 100003 + n))
+                    for n, (session, (grp_list, token)) in enumerate(zip(sessions, voters))]
+        for t, route in others:
+            if route and '<' not in route:
+                schedule.append((t, 'other', (route,)))
+            else:
+                recorder.outcome('skipped_requests')
+        schedule.sort(key=lambda item: item[0])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.max_concurrency) as pool:
+            for t, kind, arguments in schedule:
+                at = start + (t - capture_start) / args.speed
+                run = replay_session if kind == 'session' else replay_other
+                pool.submit(play, at, lambda run=run, arguments=arguments: run(*arguments))
+        seconds = time.perf_counter() - start
+
+        queries, commits = metrics_delta(before, read_metrics(base_url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    captured_seconds = max(session.start + sum(session.gaps) for session in sessions) - capture_start
+    lags.sort()
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'out'},
+        'capture': {'sessions': len(sessions), 'submitted': sum(session.submit for session in sessions),
+                    'other_requests': len(others), 'seconds': round(captured_seconds, 2)},
+        'seconds': round(seconds, 2),
+        'ballots_per_second': round(recorder.outcomes['ballots_cast'] / seconds, 2),
+        'outcomes': dict(recorder.outcomes),
+        'errors': dict(recorder.errors),
+        'schedule_lag_ms': {'p50': round(lags[len(lags) // 2] * 1000, 1) if lags else 0,
+                            'p95': round(lags[int(len(lags) * 0.95)] * 1000, 1) if lags else 0,
+                            'max': round(lags[-1] * 1000, 1) if lags else 0},
+        'steps': {step: percentiles(recorder.latencies[step]) for step in STEPS + ('other',)
+                  if recorder.latencies[step]},
+        'db_queries': queries,
+        'ballot_commits': commits,
+    }
+
+    print(f"replayed {len(sessions)} sessions captured over {report['capture']['seconds']}s at {args.speed}x "
+          f"in {report['seconds']}s, {report['ballots_per_second']} ballots/s")
+    for step, summary in report['steps'].items():
+        print(f"  {step:8} {summary['requests']:6} requests  p50 {summary['p50_ms']:8.2f} ms  "
+              f"p95 {summary['p95_ms']:8.2f} ms  p99 {summary['p99_ms']:8.2f} ms")
+    print(f"  sessions started late by p95 {report['schedule_lag_ms']['p95']} ms, "
+          f"max {report['schedule_lag_ms']['max']} ms")
+    print(f"  outcomes {report['outcomes']}  errors {report['errors'] or 'none'}  ballot commits {commits}")
+
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'wrote {args.out}')
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
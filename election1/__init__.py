@@ -1,25 +1,65 @@
 import os
+from importlib import import_module
 from .config import Config  # Import the Config class
-import logging.config
-from flask import Flask, session
+import logging
+from flask import Flask
+from sqlalchemy.engine import make_url
 from .models import User, Party, BallotType
-from .utils import hash_password
-# from werkzeug.security import generate_password_hash
-from sqlalchemy_utils import database_exists, create_database
-from sqlalchemy import exc, create_engine
-
-logging.config.fileConfig('logging.conf')
 
 # create logger
 logger = logging.getLogger(__name__)
-logger.info('logging is initialized')
 
+# blueprint name -> module, in registration order
+BLUEPRINTS = {
+    'candidate': 'election1.candidate.view',
+    'office': 'election1.office.view',
+    'admins': 'election1.admins.view',
+    'mains': 'election1.mains.view',
+    'vote': 'election1.vote.view',
+    'classgrp': 'election1.classgrp.view',
+    'dates': 'election1.dates.view',
+    'misc': 'election1.misc.view',
+    'results': 'election1.results.view',
+    'ballot': 'election1.ballot.view',
+    'bulkimport': 'election1.bulkimport.view',
+    'job': 'election1.job.view',
+}
+
+# the blueprints each app profile serves, a voter worker only imports the vote pages
+PROFILES = {
+    'full': tuple(BLUEPRINTS),
+    'voter': ('vote',),
+    'admin': tuple(name for name in BLUEPRINTS if name != 'vote'),
+}
+
+_logging_configured = False
+
+
+def create_app(profile=None):
+    """
+    Build the application.
+    :param profile: 'voter', 'admin' or 'full' (the default), or the APP_PROFILE environment variable.
+    """
+    profile = profile or os.getenv('APP_PROFILE', 'full')
+    if profile not in PROFILES:
+        raise ValueError(f"unknown app profile {profile!r}, use one of {', '.join(PROFILES)}")
+
+    config_logging()
 
-def create_app():
     app = Flask(__name__, instance_relative_config=True)
 
     # application configuration.
     app.config.from_object(Config)  # Load the configuration from config.py
+    app.config['APP_PROFILE'] = profile
+    logger.info('SQLALCHEMY_DATABASE_URI: %s, profile: %s',
+                make_url(app.config['SQLALCHEMY_DATABASE_URI']).render_as_string(hide_password=True), profile)
+
+    # configure the template bytecode cache, before the extensions touch app.jinja_env.
+    from .templatecache import init_template_cache
+    init_template_cache(app)
+
+    # configure the trusted proxy headers, before anything reads request.remote_addr.
+    config_proxy(app)
 
     # configure application extension.
     config_extention(app)
@@ -27,33 +67,89 @@ def create_app():
     # configure application blueprints.
     config_blueprint(app)
 
+    # configure flask cli commands.
+    config_commands(app)
+
+    # configure error handlers.
+    config_errorhandlers(app)
+
+    # configure response compression, first so its after_request handler runs last.
+    from .compression import init_compression
+    init_compression(app)
+
+    # configure request and database metrics (/metrics).
+    from .metrics import init_metrics
+    init_metrics(app)
+
+    # configure the development sql profiler.
+    from .sqlprofiler import init_sqlprofiler
+    init_sqlprofiler(app)
+
+    # configure the anonymized traffic capture.
+    from .capture import init_capture
+    init_capture(app)
+
+    # configure the scheduled election transitions.
+    from .scheduler import init_scheduler
+    init_scheduler(app)
+
     return app
 
 
+def config_logging():
+    """
+    Set up the queue backed logging of LOG_PROFILE once per process, see logsetup.py.
+    """
+    global _logging_configured
+    if not _logging_configured:
+        from .logsetup import configure_logging
+        configure_logging(Config.LOG_PROFILE, Config.LOG_LEVEL, Config.VOTE_EVENT_LOG, Config.LOG_CONFIG,
+                          Config.TRAFFIC_CAPTURE)
+        logger.info('logging is initialized')
+        _logging_configured = True
+
+
 def config_blueprint(app):
     """
-    Configure and register blueprints with the Flask application.
-    """
-    from election1.classgrp.view import classgrp
-    from election1.admins.view import admins
-    from election1.mains.view import mains
-    from election1.vote.view import vote
-    from election1.dates.view import dates
-    from election1.office.view import office
-    from election1.candidate.view import candidate
-    from election1.misc.view import misc
-    from election1.results.view import results
-    from election1.ballot.view import ballot
-    app.register_blueprint(candidate)
-    app.register_blueprint(office)
-    app.register_blueprint(admins)
-    app.register_blueprint(mains)
-    app.register_blueprint(vote)
-    app.register_blueprint(classgrp)
-    app.register_blueprint(dates)
-    app.register_blueprint(misc)
-    app.register_blueprint(results)
-    app.register_blueprint(ballot)
+    Configure and register the blueprints of the app profile with the Flask application.
+    The view modules are imported here so a voter app never loads the admin pages.
+    """
+    for name in PROFILES[app.config['APP_PROFILE']]:
+        app.register_blueprint(getattr(import_module(BLUEPRINTS[name]), name))
+
+
+def config_proxy(app):
+    """
+    Take the client address (and scheme) from the X-Forwarded-* headers of the
+    PROXY_FIX_X_FOR trusted proxies, the rate limits of ratelimit.py are per client address.
+    """
+    if app.config.get('PROXY_FIX_X_FOR') or app.config.get('PROXY_FIX_X_PROTO'):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'],
+                                x_proto=app.config['PROXY_FIX_X_PROTO'])
+
+
+def config_errorhandlers(app):
+    """
+    Send an expired or missing csrf token back to the home page (the login page).
+    """
+    from flask import redirect, url_for
+    from flask_wtf.csrf import CSRFError
+
+    @app.errorhandler(CSRFError)
+    def handle_csrf_error(e):
+        if 'mains' in app.blueprints:
+            return redirect(url_for('mains.homepage'))
+        return redirect(app.config['HOME'])
+
+
+def config_commands(app):
+    """
+    Register the flask cli commands.
+    """
+    from election1.commands import register_commands
+    register_commands(app)
+
 
 def config_extention(app):
     """
@@ -61,155 +157,27 @@ def config_extention(app):
     """
     from .extensions import login_manager
     from .extensions import db
-    from .extensions import bootstrap
     from .extensions import csrf
+    from .extensions import limiter
 
     db.init_app(app)
     csrf.init_app(app)
+    limiter.init_app(app)
+
+    from .sqlite_profile import init_sqlite
+    init_sqlite(app)
+
+    if app.config['APP_PROFILE'] == 'voter':
+        # voters have no login, and the database is set up by an admin app or flask init-db
+        return
 
     login_manager.init_app(app)
     config_manager(login_manager)
 
-    # Automatically create the MySQL database if it doesn't exist
-    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
-    if not database_exists(engine.url):
-        create_database(engine.url)
-        logger.info("Database created successfully.")
+    if app.config.get('DB_AUTO_BOOTSTRAP'):
+        from .bootstrap import bootstrap_database
         with app.app_context():
-            try:
-                db.create_all()
-                logger.info("Tables created successfully.")
-
-                id_admin_role = 1
-                admin_role_name = "Super Admin"
-                new_admin_role = models.Admin_roles(id_admin_role=id_admin_role,
-                                                    admin_role_name=admin_role_name)
-                db.session.add(new_admin_role)
-
-                id_admin_role = 2
-                admin_role_name = "Election Admin"
-                new_admin_role = models.Admin_roles(id_admin_role=id_admin_role,
-                                                    admin_role_name=admin_role_name)
-                db.session.add(new_admin_role)
-
-                user_firstname = "admin"
-                user_lastname = "admin"
-                user_so_name = "admin"
-                user_pass = "adminpassword"
-                id_admin_role = 1
-                user_email = "no@email.com"
-                user_status = 1
-                user_pw_change = 'N'
-
-                salt, password_hash = hash_password(user_pass)
-
-                new_user = models.User(user_firstname=user_firstname,
-                                user_lastname=user_lastname,
-                                user_so_name=user_so_name,
-                                # user_pass=generate_password_hash(user_pass, method='scrypt', salt_length=16),
-                                user_pass=password_hash,
-                                user_salt = salt,
-                                id_admin_role=id_admin_role,
-                                user_email=user_email,
-                                user_status=user_status,
-                                user_pw_change=user_pw_change)
-
-                db.session.add(new_user)
-                db.session.commit()
-
-                party_name = "Democratic"
-                party_abbreviation = "D"
-                new_party = models.Party(party_name=party_name,
-                                         party_abbreviation=party_abbreviation)
-                db.session.add(new_party)
-
-                party_name = "Republican"
-                party_abbreviation = "R"
-                new_party = models.Party(party_name=party_name,
-                                         party_abbreviation=party_abbreviation)
-                db.session.add(new_party)
-
-                party_name = "Independent"
-                party_abbreviation = "I"
-                new_party = models.Party(party_name=party_name,
-                                         party_abbreviation=party_abbreviation)
-                db.session.add(new_party)
-
-                ballot_type_name = "Normal"
-                new_ballot = BallotType(ballot_type_name=ballot_type_name)
-                db.session.add(new_ballot)
-
-                ballot_type_name = "Measure"
-                new_ballot = BallotType(ballot_type_name=ballot_type_name)
-                db.session.add(new_ballot)
-
-                ballot_type_name = "Single Name"
-                new_ballot = BallotType(ballot_type_name=ballot_type_name)
-                db.session.add(new_ballot)
-
-                ballot_type_name = "Rank Choice"
-                new_ballot = BallotType(ballot_type_name=ballot_type_name)
-                db.session.add(new_ballot)
-
-                db.session.commit()
-
-            except Exception as e:
-                logger.error(f"Error creating tables: {e}")
-    else:
-        logger.info("Database already exists.")
-
-    # if not os.path.exists("instance/election.db"):
-    #     logger.info("database is  not here will be created")
-
-    # db_name = "election.db"
-    # with app.app_context():
-    #     # if database_exists('sqlite:///instance/' + db_name):
-    #     if database_exists(app.config['SQLALCHEMY_DATABASE_URI']):
-    #         logger.info(db_name + " already exists")
-    #
-    #     else:
-    #         logger.info(db_name + " does not exist, will create " + db_name)
-    #         try:
-    #             db.create_all()
-    #             id_admin_role = 1
-    #             admin_role_name = "Super Admin"
-    #             new_admin_role = models.Admin_roles(id_admin_role=id_admin_role,
-    #                                                 admin_role_name=admin_role_name)
-    #             db.session.add(new_admin_role)
-    #
-    #             id_admin_role = 2
-    #             admin_role_name = "Election Admin"
-    #             new_admin_role = models.Admin_roles(id_admin_role=id_admin_role,
-    #                                                 admin_role_name=admin_role_name)
-    #             db.session.add(new_admin_role)
-    #
-    #             user_firstname = "admin"
-    #             user_lastname = "admin"
-    #             user_so_name = "admin"
-    #             user_pass = "adminpassword"
-    #             id_admin_role = 1
-    #             user_email = "no@email.com"
-    #             user_status = 1
-    #             user_pw_change = 'N'
-    #             new_user = User(user_firstname=user_firstname,
-    #                             user_lastname=user_lastname,
-    #                             user_so_name=user_so_name,
-    #                             user_pass=generate_password_hash(user_pass, method='scrypt', salt_length=16),
-    #                             id_admin_role=id_admin_role,
-    #                             user_email=user_email,
-    #                             user_status=user_status,
-    #                             user_pw_change=user_pw_change)
-    #
-    #             db.session.add(new_user)
-    #             db.session.commit()
-    #
-    #         except exc.SQLAlchemyError as sqlalchemyerror:
-    #             db.session.rollback()
-    #             logger.info("got the following SQLAlchemyError: " + str(sqlalchemyerror))
-    #         except Exception as exception:
-    #             logger.info("got the following Exception: " + str(exception))
-    #         finally:
-    #             logger.info("db.create_all() in __init__.py was successfull - no exceptions were raised")
+            bootstrap_database()
 
 
 def config_manager(manager):
@@ -224,7 +192,6 @@ def config_manager(manager):
 
     @manager.user_loader
     def user_loader(xid):
-        user = User.query.get(int(xid))
-        if user is None:
-            return None
-        return user
+        # a cached AdminIdentity, see usercache.py
+        from .usercache import load_user
+        return load_user(int(xid))
@@ -8,6 +8,7 @@ import logging
 from election1.utils import hash_password
 from flask_login import current_user
 from election1.utils import session_check
+from election1.usercache import invalidate_user
 
 admins = Blueprint('admins', __name__)
 logger = logging.getLogger(__name__)
@@ -19,7 +20,7 @@ def check_session_timeout():
         error = 'idle timeout '
         return render_template('session_timeout.html', error=error, home=home)
     else:
-        logger.info(f'Session check passed for user {current_user.user_so_name} in admin view')
+        logger.info('Session check passed for user %s in admin view', current_user.user_so_name)
         return None
 
 
@@ -63,8 +64,10 @@ def user_admin():
             try:
                 db.session.add(new_user)
                 db.session.commit()
+                # sqlite can hand out the id of a deleted user again
+                invalidate_user(new_user.id_user)
                 flash('Admin added successfully', category='success')
-                logger.info(f'User {current_user.user_so_name} has created {user_firstname} {user_lastname}')
+                logger.info('User %s has created %s %s', current_user.user_so_name, user_firstname, user_lastname)
                 return redirect(url_for('admins.user_admin'))
             except IntegrityError as e:
                 db.session.rollback()
@@ -87,12 +90,13 @@ def deleteuser(xid):
     """
     user_to_delete = User.query.get(xid)
     try:
-        logger.info(f'User {current_user.user_so_name} is deleting user {user_to_delete.user_firstname} {user_to_delete.user_lastname}')
+        logger.info('User %s is deleting user %s %s', current_user.user_so_name, user_to_delete.user_firstname, user_to_delete.user_lastname)
         db.session.delete(user_to_delete)
         db.session.commit()
+        invalidate_user(xid)
         flash('Successfully deleted record', category='success')
     except IntegrityError as e:
-        logger.error(f'Error deleting user {user_to_delete}: {e}')
+        logger.error('Error deleting user %s: %s', user_to_delete, e)
         db.session.rollback()
         flash(f'There was a problem deleting the record: {e}', category='danger')
 
@@ -2,6 +2,7 @@ from flask import (render_template, url_for, flash, redirect, request, Blueprint
 from election1.ballot.form import (BallotTypeForm)
 from election1.models import Dates, BallotType
 from election1.extensions import db
+from election1 import refdata
 import logging
 from election1.utils import session_check
 from flask_login import current_user
@@ -41,10 +42,11 @@ def ballot_view():
         try:
             db.session.add(new_ballot)
             db.session.commit()
+            refdata.invalidate_ballot_types()
             logger.info(
                 'user ' + str(current_user.user_so_name) + ' has created the ballot type named ' + ballot_type_name)
             ballot_form.ballot_type_name.data = ''
-            ballot_types = BallotType.get_all_ballot_types_sorted_by_name()
+            ballot_types = refdata.ballot_type_choices()
             flash('successfully inserted record', category='success')
             return render_template('ballot.html', form=ballot_form, ballot_types=ballot_types)
         except Exception as e:
@@ -52,17 +54,17 @@ def ballot_view():
             logger.info('There is an error ' + str(e) + ' while creating the ballot_type titled ' + ballot_type_name)
             flash('There was a problem inserting record ' + str(e), category='danger')
             ballot_form.ballot_type_name.data = ''
-            ballot_types = BallotType.get_all_ballot_types_sorted_by_name
-            return render_template('ballot.html', form=ballot_form, offices=ballot_types)
+            ballot_types = refdata.ballot_type_choices()
+            return render_template('ballot.html', form=ballot_form, ballot_types=ballot_types)
     else:
         for err_msg in ballot_form.errors.values():
             flash(f'there is an error creating office: {err_msg}', category='danger')
-            ballot_types = BallotType.get_all_ballot_types_sorted_by_name
+            ballot_types = refdata.ballot_type_choices()
             return render_template('ballot.html', form=ballot_form, ballot_types=ballot_types)
 
     ballot_form.ballot_type_name.data = ''
-    ballot_types = BallotType.get_all_ballot_types_sorted_by_name()
-    print("bt" + str(BallotType.get_all_ballot_types_sorted_by_name()))
+    ballot_types = refdata.ballot_type_choices()
+    logger.debug("bt %s", ballot_types)
     return render_template('ballot.html', form=ballot_form, ballot_types=ballot_types)
 
 
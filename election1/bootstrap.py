@@ -0,0 +1,79 @@
+"""
+Create, seed and migrate the election database.
+
+Run it with `flask init-db`.  create_app only calls it by itself when DB_AUTO_BOOTSTRAP
+is set (the default for the development DB_PROFILE) and never for the voter profile,
+so voter workers start without DDL or an extra engine for the existence check.
+"""
+import logging
+
+from sqlalchemy import inspect
+from election1.extensions import db
+from election1.models import Admin_roles, User, Party, BallotType
+from election1.utils import hash_password
+from election1 import migrations
+
+logger = logging.getLogger(__name__)
+
+ADMIN_ROLES = ((1, "Super Admin"), (2, "Election Admin"))
+PARTIES = (("Democratic", "D"), ("Republican", "R"), ("Independent", "I"))
+BALLOT_TYPES = ("Normal", "Measure", "Single Name", "Rank Choice")
+
+
+def bootstrap_database():
+    """
+    Create the database if it does not exist, build and seed the tables of a new
+    database, then apply the pending migrations.  Must run in an app context.
+    :return: True if the database was new.
+    """
+    # sqlalchemy_utils is only needed here, not in every worker
+    from sqlalchemy_utils import database_exists, create_database
+
+    url = db.engine.url
+    if not database_exists(url):
+        create_database(url)
+        logger.info("Database created successfully.")
+
+    fresh = not inspect(db.engine).has_table(User.__tablename__)
+    if fresh:
+        try:
+            db.create_all()
+            logger.info("Tables created successfully.")
+            seed_database()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error creating tables: %s", e)
+            raise
+    else:
+        logger.info("Database already exists.")
+
+    applied = migrations.upgrade(db.engine)
+    if applied:
+        logger.info("Applied schema migrations %s", applied)
+    return fresh
+
+
+def seed_database():
+    """
+    Add the admin roles, the default admin user, the parties and the ballot types.
+    """
+    for id_admin_role, admin_role_name in ADMIN_ROLES:
+        db.session.add(Admin_roles(id_admin_role=id_admin_role, admin_role_name=admin_role_name))
+
+    salt, password_hash = hash_password("adminpassword")
+    db.session.add(User(user_firstname="admin",
+                        user_lastname="admin",
+                        user_so_name="admin",
+                        user_pass=password_hash,
+                        user_salt=salt,
+                        id_admin_role=1,
+                        user_email="no@email.com",
+                        user_status=1,
+                        user_pw_change='N'))
+    db.session.commit()
+
+    for party_name, party_abbreviation in PARTIES:
+        db.session.add(Party(party_name=party_name, party_abbreviation=party_abbreviation))
+    for ballot_type_name in BALLOT_TYPES:
+        db.session.add(BallotType(ballot_type_name=ballot_type_name))
+    db.session.commit()
@@ -0,0 +1,11 @@
+from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed
+from wtforms import SubmitField, BooleanField
+
+
+class BulkImportForm(FlaskForm):
+    classgrp_file = FileField(label='Class or Group file', validators=[FileAllowed(['csv', 'xlsx'], 'csv or xlsx only')])
+    office_file = FileField(label='Office file', validators=[FileAllowed(['csv', 'xlsx'], 'csv or xlsx only')])
+    candidate_file = FileField(label='Candidate file', validators=[FileAllowed(['csv', 'xlsx'], 'csv or xlsx only')])
+    dry_run = BooleanField(label='Dry run (validate only)', default=True)
+    submit = SubmitField(label='submit')
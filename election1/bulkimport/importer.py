@@ -0,0 +1,238 @@
+"""
+Bulk import of class groups, offices and candidates.
+
+Each kind of record comes from its own CSV or XLSX file (first worksheet) with a header row:
+
+    classgrp:  name, sortkey
+    office:    office_title, sortkey, vote_for, ballot_type
+    candidate: firstname, lastname, group, office, party
+
+The whole upload is validated in memory against sets loaded with one query per table, so
+candidates may refer to groups and offices created by the same upload.  Nothing is written
+unless every row is valid, and then everything is inserted in a single transaction.
+"""
+import csv
+import io
+from dataclasses import dataclass, field
+
+from election1.extensions import db
+from election1.models import Classgrp, Office, Candidate, Party, BallotType
+
+
+CLASSGRP_COLUMNS = ('name', 'sortkey')
+OFFICE_COLUMNS = ('office_title', 'sortkey', 'vote_for', 'ballot_type')
+CANDIDATE_COLUMNS = ('firstname', 'lastname', 'group', 'office', 'party')
+
+
+@dataclass
+class RowError:
+    kind: str
+    row: int
+    message: str
+
+
+@dataclass
+class ImportReport:
+    classgrps: list = field(default_factory=list)
+    offices: list = field(default_factory=list)
+    candidates: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+    committed: bool = False
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def error(self, kind, row, message):
+        self.errors.append(RowError(kind, row, message))
+
+
+def read_rows(file_storage):
+    """
+    Read an uploaded CSV or XLSX file into a list of dicts keyed by the lower case header.
+    :param file_storage: a werkzeug FileStorage from the upload form.
+    :return: a list of (row number, dict) where row number is the line in the file.
+    """
+    filename = (file_storage.filename or '').lower()
+    if filename.endswith('.xlsx'):
+        # openpyxl is only needed for spreadsheet uploads
+        from openpyxl import load_workbook
+        workbook = load_workbook(io.BytesIO(file_storage.read()), read_only=True, data_only=True)
+        rows = [['' if cell is None else str(cell) for cell in row]
+                for row in workbook.worksheets[0].iter_rows(values_only=True)]
+        workbook.close()
+    elif filename.endswith('.csv'):
+        text = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig')
+        rows = list(csv.reader(text))
+    else:
+        raise ValueError(f'{file_storage.filename} is not a .csv or .xlsx file')
+
+    if not rows:
+        return []
+    header = [h.strip().lower() for h in rows[0]]
+    records = []
+    for line, row in enumerate(rows[1:], start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        records.append((line, {h: (row[i].strip() if i < len(row) else '') for i, h in enumerate(header)}))
+    return records
+
+
+def _check_columns(report, kind, rows, columns):
+    if rows:
+        missing = [c for c in columns if c not in rows[0][1]]
+        if missing:
+            report.error(kind, 1, 'missing column(s): ' + ', '.join(missing))
+            return False
+    return True
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def validate(classgrp_rows=(), office_rows=(), candidate_rows=()):
+    """
+    Validate the rows of an upload and build the model objects without touching the session.
+    :return: an ImportReport holding the new objects and any row errors.
+    """
+    report = ImportReport()
+
+    if not (_check_columns(report, 'classgrp', classgrp_rows, CLASSGRP_COLUMNS)
+            and _check_columns(report, 'office', office_rows, OFFICE_COLUMNS)
+            and _check_columns(report, 'candidate', candidate_rows, CANDIDATE_COLUMNS)):
+        return report
+
+    # one query per table, every existence check below is a set or dict lookup
+    group_names = {name: id_classgrp for id_classgrp, name in db.session.query(Classgrp.id_classgrp, Classgrp.name)}
+    group_sortkeys = {s for (s,) in db.session.query(Classgrp.sortkey)}
+    offices = {title: (id_office, ballot_type_name) for id_office, title, ballot_type_name in Office.office_query()}
+    office_sortkeys = {s for (s,) in db.session.query(Office.sortkey)}
+    ballot_types = {name.lower(): (id_ballot_type, name)
+                    for id_ballot_type, name in BallotType.get_all_ballot_types_sorted_by_name()}
+    parties = {}
+    for id_party, party_name, abbreviation in db.session.query(Party.id_party, Party.party_name,
+                                                               Party.party_abbreviation):
+        parties[party_name.lower()] = id_party
+        parties[abbreviation.lower()] = id_party
+
+    new_groups = {}
+    for line, row in classgrp_rows:
+        name = row['name']
+        sortkey = _to_int(row['sortkey'])
+        if not 2 <= len(name) <= 30:
+            report.error('classgrp', line, f'name "{name}" must be 2 to 30 characters')
+        elif name in group_names or name in new_groups:
+            report.error('classgrp', line, f'class or group "{name}" already exists')
+        elif sortkey is None:
+            report.error('classgrp', line, f'sortkey "{row["sortkey"]}" is not an integer')
+        elif sortkey in group_sortkeys:
+            report.error('classgrp', line, f'sortkey {sortkey} is already used by another class or group')
+        else:
+            group_sortkeys.add(sortkey)
+            new_groups[name] = Classgrp(name=name, sortkey=sortkey)
+    report.classgrps = list(new_groups.values())
+
+    new_offices = {}
+    for line, row in office_rows:
+        title = row['office_title']
+        sortkey = _to_int(row['sortkey'])
+        vote_for = _to_int(row['vote_for'] or 1)
+        ballot_type = ballot_types.get(row['ballot_type'].lower())
+        if not 2 <= len(title) <= 30:
+            report.error('office', line, f'office title "{title}" must be 2 to 30 characters')
+        elif title in offices or title in new_offices:
+            report.error('office', line, f'office "{title}" already exists')
+        elif sortkey is None:
+            report.error('office', line, f'sortkey "{row["sortkey"]}" is not an integer')
+        elif sortkey in office_sortkeys:
+            report.error('office', line, f'sortkey {sortkey} is already used by another office')
+        elif vote_for is None or vote_for < 1:
+            report.error('office', line, f'vote_for "{row["vote_for"]}" must be a positive integer')
+        elif ballot_type is None:
+            report.error('office', line, f'unknown ballot type "{row["ballot_type"]}"')
+        else:
+            office_sortkeys.add(sortkey)
+            new_offices[title] = (Office(office_title=title, sortkey=sortkey, office_vote_for=vote_for,
+                                         id_ballot_type=ballot_type[0]), ballot_type[1])
+    report.offices = [o for o, _ in new_offices.values()]
+
+    # existing (firstname, lastname, id_classgrp) for the groups named in the file
+    wanted_ids = {group_names[row['group']] for _, row in candidate_rows if row['group'] in group_names}
+    existing_candidates = set()
+    if wanted_ids:
+        existing_candidates = {(f, l or '', g) for f, l, g in db.session.query(
+            Candidate.firstname, Candidate.lastname, Candidate.id_classgrp).filter(
+            Candidate.id_classgrp.in_(wanted_ids))}
+
+    seen = set()
+    for line, row in candidate_rows:
+        firstname, lastname = row['firstname'], row['lastname']
+        group, office_title, party = row['group'], row['office'], row['party']
+        if group in group_names:
+            group_key = group_names[group]
+        elif group in new_groups:
+            group_key = group
+        else:
+            report.error('candidate', line, f'unknown class or group "{group}"')
+            continue
+        if office_title in offices:
+            id_office, ballot_type_name = offices[office_title]
+        elif office_title in new_offices:
+            id_office, ballot_type_name = None, new_offices[office_title][1]
+        else:
+            report.error('candidate', line, f'unknown office "{office_title}"')
+            continue
+
+        key = (firstname, lastname, group_key)
+        if not 2 <= len(firstname) <= 30:
+            report.error('candidate', line, f'first name "{firstname}" must be 2 to 30 characters')
+        elif lastname == '' and ballot_type_name != 'Single Name':
+            report.error('candidate', line, "last name is required unless the ballot type is 'Single Name'")
+        elif lastname and not 2 <= len(lastname) <= 30:
+            report.error('candidate', line, f'last name "{lastname}" must be 2 to 30 characters')
+        elif key in existing_candidates or key in seen:
+            report.error('candidate', line, f'candidate {firstname} {lastname} already exists for {group}')
+        elif party and party.lower() not in parties:
+            report.error('candidate', line, f'unknown party "{party}"')
+        else:
+            seen.add(key)
+            new_candidate = Candidate(firstname=firstname, lastname=lastname,
+                                      id_party=parties[party.lower()] if party else None)
+            # groups and offices from this upload are attached through the relationship so
+            # the ids are filled in when the session flushes
+            if isinstance(group_key, int):
+                new_candidate.id_classgrp = group_key
+            else:
+                new_candidate.classgrp = new_groups[group_key]
+            if id_office is not None:
+                new_candidate.id_office = id_office
+            else:
+                new_candidate.office = new_offices[office_title][0]
+            report.candidates.append(new_candidate)
+
+    return report
+
+
+def run_import(classgrp_rows=(), office_rows=(), candidate_rows=(), dry_run=True):
+    """
+    Validate an upload and, unless dry_run is set or a row failed, insert it in one transaction.
+    :return: the ImportReport; report.committed tells if the rows were written.
+    """
+    report = validate(classgrp_rows, office_rows, candidate_rows)
+    if dry_run or not report.ok:
+        return report
+
+    try:
+        db.session.add_all(report.classgrps)
+        db.session.add_all(report.offices)
+        db.session.add_all(report.candidates)
+        db.session.commit()
+        report.committed = True
+    except Exception:
+        db.session.rollback()
+        raise
+    return report
@@ -0,0 +1,74 @@
+from flask import (render_template, url_for, flash, redirect, Blueprint, current_app)
+from election1.bulkimport.form import BulkImportForm
+from election1.bulkimport.importer import read_rows, run_import
+from election1.models import Dates
+from election1 import refdata
+from sqlalchemy.exc import SQLAlchemyError
+import logging
+from flask_login import current_user
+from election1.utils import session_check
+
+bulkimport = Blueprint('bulkimport', __name__)
+logger = logging.getLogger(__name__)
+
+
+@bulkimport.before_request
+def check_session_timeout():
+    if not current_user.is_authenticated:
+        return redirect(url_for('admins.login'))
+    if not session_check():
+        home = current_app.config['HOME']
+        error = 'idle timeout '
+        return render_template('session_timeout.html', error=error, home=home)
+    return None
+
+
+@bulkimport.route('/bulk_import', methods=['GET', 'POST'])
+def bulk_import():
+    logger.info('user ' + str(current_user.user_so_name) + " has entered bulk import page")
+
+    if Dates.check_dates() is False:
+        flash('Please set the Election Dates before importing', category='danger')
+        return redirect(url_for('mains.homepage'))
+
+    if Dates.after_start_date():
+        flash('You cannot import after the voting start time', category='danger')
+        return redirect(url_for('mains.homepage'))
+
+    form = BulkImportForm()
+    report = None
+
+    if form.validate_on_submit():
+        try:
+            rows = {name: read_rows(getattr(form, name + '_file').data)
+                    if getattr(form, name + '_file').data else []
+                    for name in ('classgrp', 'office', 'candidate')}
+        except (ValueError, UnicodeDecodeError) as e:
+            flash('The file could not be read: ' + str(e), category='danger')
+            return render_template('bulk_import.html', form=form, report=report)
+
+        try:
+            report = run_import(rows['classgrp'], rows['office'], rows['candidate'], dry_run=form.dry_run.data)
+        except SQLAlchemyError as e:
+            flash('problem importing records ' + str(e), category='danger')
+            return render_template('bulk_import.html', form=form, report=report)
+
+        if report.committed:
+            refdata.invalidate_classgrps()
+            refdata.invalidate_offices()
+            refdata.invalidate_candidates()
+            logger.info('user ' + str(current_user.user_so_name) + ' has imported '
+                        f'{len(report.classgrps)} groups, {len(report.offices)} offices and '
+                        f'{len(report.candidates)} candidates')
+            flash(f'imported {len(report.classgrps)} groups, {len(report.offices)} offices and '
+                  f'{len(report.candidates)} candidates', category='success')
+        elif report.ok:
+            flash(f'dry run ok: {len(report.classgrps)} groups, {len(report.offices)} offices and '
+                  f'{len(report.candidates)} candidates would be imported', category='success')
+        else:
+            flash(f'{len(report.errors)} row(s) have errors, nothing was imported', category='danger')
+    else:
+        for err_msg in form.errors.values():
+            flash(f'there is an error with the upload: {err_msg}', category='danger')
+
+    return render_template('bulk_import.html', form=form, report=report)
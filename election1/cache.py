@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class TTLCache:
+    """
+    A small thread safe in-process cache.
+    Keys are tuples whose first element is a namespace (for example ('classgrp',) or
+    ('candidate_search', 3, 'ab', 0)) so that a whole namespace, or the part of it that
+    starts with a given prefix, can be invalidated after a write.
+    """
+
+    def __init__(self, default_ttl=60, max_entries=1024):
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for key or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                # drop the entry closest to expiring to make room
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest]
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Return the cached value for key, calling loader() and caching the result on a miss.
+        :param key: a tuple starting with the namespace.
+        :param loader: a callable that produces the value from the database.
+        :param ttl: seconds to keep the value, defaults to the cache default_ttl.
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, namespace, *prefix):
+        """
+        Remove every key in namespace, or only the keys that start with (namespace, *prefix).
+        """
+        match = (namespace,) + prefix
+        with self._lock:
+            for key in [k for k in self._entries if k[:len(match)] == match]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# reference data (class groups, offices, parties, ballot types) used by the admin pages
+reference_cache = TTLCache()
+
+# rendered HTML fragments such as the HTMX candidate search results
+fragment_cache = TTLCache(default_ttl=30)
+
+# logged in admin identities loaded by the Flask-Login user_loader
+user_cache = TTLCache(default_ttl=300, max_entries=256)
@@ -4,6 +4,9 @@ from flask_login import current_user
 from election1.candidate.form import CandidateForm, Candidate_reportForm,  WriteinCandidateForm
 from election1.models import Classgrp, Office, Candidate, WriteinCandidate, Dates, Party, BallotType
 from election1.extensions import db
+from election1 import refdata, suggest
+from election1.conditional import conditional_response
+from election1.cache import fragment_cache
 from sqlalchemy.exc import SQLAlchemyError
 from election1.utils import is_user_authenticated, session_check
 import logging
@@ -46,15 +49,15 @@ def writein_candidate():
         # Check if a valid option is selected
         if choices_classgrp == "Please select":
             flash('Please select a valid option for class', category='danger')
-            form.choices_classgrp.choices = Classgrp.classgrp_query()
-            form.choices_office.choices = Office.office_query()
+            form.choices_classgrp.choices = refdata.classgrp_choices()
+            form.choices_office.choices = refdata.office_choices()
             candidates = WriteinCandidate.get_writein_candidates_sorted()
             return render_template('writein_candidate.html', form=form , candidates=candidates)
 
         if choices_office == "Please select":
             flash('Please select a valid option for office', category='danger')
-            form.choices_office.choices = Office.office_query()
-            form.choices_classgrp.choices = Classgrp.classgrp_query()
+            form.choices_office.choices = refdata.office_choices()
+            form.choices_classgrp.choices = refdata.classgrp_choices()
             candidates = WriteinCandidate.get_writein_candidates_sorted()
             return render_template('writein_candidate.html', form=form, candidates=candidates)
 
@@ -71,14 +74,15 @@ def writein_candidate():
             db.session.add(new_writein_candidate)
 
             db.session.commit()
+            refdata.add_writein_candidate(choices_classgrp, choices_office, writein_candidate_name)
             return redirect(url_for('candidate.writein_candidate'))
         except SQLAlchemyError as e:
             db.session.rollback()
             flash('problem adding write-in candidate registration' + str(e), category='danger')
             return redirect(url_for('candidate.writein_candidate'))
 
-    form.choices_classgrp.choices = Classgrp.classgrp_query()
-    form.choices_office.choices = Office.office_query()
+    form.choices_classgrp.choices = refdata.classgrp_choices()
+    form.choices_office.choices = refdata.office_choices()
     candidates = WriteinCandidate.get_writein_candidates_sorted()
     return render_template('writein_candidate.html', form=form, candidates=candidates)
 
@@ -95,7 +99,7 @@ def candidate_report():
         return redirect(url_for('admins.login'))
 
     form = Candidate_reportForm()
-    list_of_offices = db.session.query(Office).all()
+    list_of_offices = refdata.office_choices()
     if request.method == 'POST':
         choices_classgrp = request.form['choices_classgrp']
         choices_office = request.form['choices_office']
@@ -114,8 +118,10 @@ def candidate_report():
                                    form=form, candidates=candidates, list_of_offices=list_of_offices)
 
     else:
-        form.choices_classgrp.choices = Classgrp.classgrp_query()
-        return render_template("candidate_report.html", form=form, list_of_offices=list_of_offices)
+        def render():
+            form.choices_classgrp.choices = refdata.classgrp_choices()
+            return render_template("candidate_report.html", form=form, list_of_offices=list_of_offices)
+        return conditional_response(render, ('classgrp', 'office'))
 
 
 @candidate.route('/candidate', methods=['GET', 'POST'])
@@ -145,9 +151,7 @@ def candidate_view():
         # this is a little weird because of the validation use of htmx and the choice fields are not tuples
         if 'csrf_token' in form.errors:
             flash('CSRF token validation failed. Please try again.', category='danger')
-            form.choices_classgrp.choices = Classgrp.classgrp_query()
-            form.choices_office.choices = Office.office_query()
-            form.choices_party.choices = Party.get_all_parties_ordered_by_name()
+            set_candidate_choices(form)
             return render_template('candidate.html', form=form)
 
 
@@ -173,29 +177,23 @@ def candidate_view():
         # Check if a valid option is selected
         if choices_classgrp == "Please select":
             flash('Please select a valid option for class', category='danger')
-            form.choices_classgrp.choices = Classgrp.classgrp_query()
-            form.choices_office.choices = Office.office_query()
-            form.choices_party.choices = Party.get_all_parties_ordered_by_name()
+            set_candidate_choices(form)
             return render_template('candidate.html', form=form)
 
         if choices_office == "Please select":
             flash('Please select a valid option for office', category='danger')
-            form.choices_office.choices = Office.office_query()
-            form.choices_classgrp.choices = Classgrp.classgrp_query()
-            form.choices_party.choices = Party.get_all_parties_ordered_by_name()
+            set_candidate_choices(form)
             return render_template('candidate.html', form=form)
 
-        print("lastname is ", lastname)
-        print(Office.get_ballot_type_name(choices_office))
+        logger.debug("lastname is %s", lastname)
+        logger.debug('%s', refdata.office_ballot_type_name(choices_office))
 
         if lastname == "":
-            print("lastname is None")
-            if Office.get_ballot_type_name(choices_office) != "Single Name":
-                print("Ballot type is not Single Name")
+            logger.debug("lastname is None")
+            if refdata.office_ballot_type_name(choices_office) != "Single Name":
+                logger.debug("Ballot type is not Single Name")
                 flash("Error: Last name is required unless the ballot type is 'Single Name'.", category="danger")
-                form.choices_office.choices = Office.office_query()
-                form.choices_classgrp.choices = Classgrp.classgrp_query()
-                form.choices_party.choices = Party.get_all_parties_ordered_by_name()
+                set_candidate_choices(form)
                 return render_template("candidate.html", form=form)
 
         if choices_party == "If candidate associated Please select":
@@ -203,9 +201,7 @@ def candidate_view():
 
         if Candidate.check_existing_candidate(firstname, lastname, choices_classgrp) is True:
             flash('Candidate already exists for this class or group', category='danger')
-            form.choices_office.choices = Office.office_query()
-            form.choices_classgrp.choices = Classgrp.classgrp_query()
-            form.choices_party.choices = Party.get_all_parties_ordered_by_name()
+            set_candidate_choices(form)
             return render_template('candidate.html', form=form)
 
         new_candidate = Candidate(firstname=firstname,
@@ -217,6 +213,7 @@ def candidate_view():
         try:
             db.session.add(new_candidate)
             db.session.commit()
+            refdata.invalidate_candidates(choices_classgrp)
             logger.info('user ' + str(current_user.user_so_name) + " has created " + firstname + ' ' + lastname)
             flash('successfully  adding candidate ', category='danger')
             return redirect(url_for('candidate.candidate_view'))
@@ -226,19 +223,42 @@ def candidate_view():
             return redirect('/candidate')
     else:
 
-        form.choices_classgrp.choices = Classgrp.classgrp_query()
-        form.choices_office.choices = Office.office_query()
-        form.choices_party.choices = Party.get_all_parties_ordered_by_name()
+        set_candidate_choices(form)
         return render_template('candidate.html', form=form)
 
 
+def set_candidate_choices(form):
+    """
+    Fill the select fields of the CandidateForm from the reference data cache.
+    """
+    form.choices_classgrp.choices = refdata.classgrp_choices()
+    form.choices_office.choices = refdata.office_choices()
+    form.choices_party.choices = refdata.party_choices()
+
+
+@candidate.route('/candidate/writein_names')
+def writein_names():
+    """
+    HTMX suggestions for the write-in registration name, the known names of the selected
+    group and office (see suggest.py).
+    """
+    if not session_check() or not is_user_authenticated():
+        return ''
+    group = refdata.classgrp_name(request.args.get('choices_classgrp'))
+    office = refdata.office_title(request.args.get('choices_office'))
+    if group is None or office is None:
+        return ''
+    names = suggest.suggestions(group, office, request.args.get('writein_candidate_name', ''))
+    return render_template('writein_suggestions.html', names=names)
+
+
 @candidate.route('/candidate/get-name-fields')
 def get_name_fields():
-    print("get_name_fields called with office_id:")
+    logger.debug("get_name_fields called with office_id:")
     office_id = request.args.get('choices_office')
-    print(office_id)
-    ballot_type_name = Office.get_ballot_type_name(office_id)
-    print("ballot_type_name is ", ballot_type_name)
+    logger.debug('%s', office_id)
+    ballot_type_name = refdata.office_ballot_type_name(office_id)
+    logger.debug("ballot_type_name is %s", ballot_type_name)
     if ballot_type_name in ["Normal", "Rank Choice"]:
         return render_template('first_last_name.html')
     elif ballot_type_name in ["Single Name", "Measure"]:
@@ -248,10 +268,36 @@ def get_name_fields():
 
 @candidate.route('/candidate/search')
 def candidate_search():
-
+    """
+    HTMX search of the candidates of a group, one keyset page at a time.
+    The rendered page is cached per (group, name prefix, cursor) until a candidate of the
+    group changes or CANDIDATE_SEARCH_CACHE_TTL runs out.
+    """
     group = request.args.get('choices_classgrp', type=int)
-    candidates = Candidate.candidate_search(group)
-    return render_template('candidate_search_results.html',  candidates=candidates)
+    if group is None:
+        return ''
+    # the search ignores case, every spelling of a prefix shares one cached page
+    name_prefix = request.args.get('name_prefix', '').strip().lower()
+    after_sortkey = request.args.get('after_sortkey', type=int)
+    after_id = request.args.get('after_id', type=int)
+    after = (after_sortkey, after_id) if after_sortkey is not None and after_id is not None else None
+
+    key = ('candidate_search', group, name_prefix, after)
+    return fragment_cache.get_or_load(key, lambda: render_candidate_search(group, name_prefix, after),
+                                      current_app.config.get('CANDIDATE_SEARCH_CACHE_TTL'))
+
+
+def render_candidate_search(group, name_prefix, after):
+    page_size = current_app.config.get('CANDIDATE_SEARCH_PAGE_SIZE')
+    # one extra row tells if there is a next page
+    candidates = Candidate.candidate_search(group, name_prefix, after, page_size + 1).all()
+    next_page = None
+    if len(candidates) > page_size:
+        candidates = candidates[:page_size]
+        last_candidate, last_classgrp, last_office, _ = candidates[-1]
+        next_page = {'after_sortkey': last_office.sortkey, 'after_id': last_candidate.id_candidate}
+    return render_template('candidate_search_results.html', candidates=candidates, group=group,
+                           name_prefix=name_prefix, first_page=after is None, next_page=next_page)
 
 
 @candidate.route('/deletecandidate/<int:xid>')
@@ -266,11 +312,15 @@ def deletecandidate(xid):
 
     candidate_to_delete = Candidate.query.get_or_404(xid)
 
+    # the row is gone after the commit
+    id_classgrp = candidate_to_delete.id_classgrp
+    name = f'{candidate_to_delete.firstname} {candidate_to_delete.lastname or ""}'.strip()
     try:
-        db.session.delete(candidate_to_delete)
+        votes = Candidate.delete_with_votes(xid)
         db.session.commit()
+        refdata.invalidate_candidates(id_classgrp)
         flash('successfully deleted record', category='danger')
-        logger.info('user ' + str(current_user.user_so_name) + " has deleted " + candidate_to_delete.firstname + ' ' + candidate_to_delete.lastname)
+        logger.info('user %s has deleted %s with %s votes', current_user.user_so_name, name, votes)
         return redirect('/candidate')
     except SQLAlchemyError as e:
         db.session.rollback()
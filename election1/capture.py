@@ -0,0 +1,86 @@
+"""
+Anonymized traffic capture, the input of benchmarks/replay.py.
+
+With TRAFFIC_CAPTURE set to a file path every request adds one JSON line to that file
+(through the logging queue of logsetup.py, so the request does not wait on the write):
+
+    {"t": 1760873000.123, "voter": "3f9c0a1b7d2e4a55", "endpoint": "vote.cast",
+     "route": "/cast/<grp_list>/<token>", "method": "POST", "form": "VoteForOne",
+     "groups": 1, "offices": 6, "status": 200, "ms": 12.4}
+
+Nothing in it leads back to a voter: no token, group or candidate names, no addresses.
+`voter` is a hash of the voting token with a key drawn when the process starts, it
+only ties the requests of one ballot together.  `groups` and `offices` are the size
+of the ballot, `t` gives the inter-arrival times.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+from flask import g, request, session
+
+from election1.logsetup import TRAFFIC
+
+traffic = logging.getLogger(TRAFFIC)
+
+# not worth replaying
+SKIPPED_ENDPOINTS = ('static', 'metrics')
+
+_key = os.urandom(16)
+
+
+def init_capture(app):
+    if not app.config.get('TRAFFIC_CAPTURE'):
+        return
+    app.before_request(_start_request)
+    app.after_request(_capture_request)
+
+
+def voter_key(token):
+    """
+    :return: the anonymous key of a voting token, stable within this process.
+    """
+    return hashlib.blake2b(token.encode(), key=_key, digest_size=8).hexdigest() if token else None
+
+
+def _ballot_shape():
+    # post_ballot clears the session, so this runs before the view and again after it
+    view_args = request.view_args or {}
+    token = view_args.get('token') or session.get('token_list_record', {}).get('token')
+    grp_list = view_args.get('grp_list') or session.get('grp_list')
+    office_dict = session.get('office_dict') or {}
+    return {
+        'voter': voter_key(token),
+        'groups': len(grp_list.split('$')) if grp_list else 0,
+        'offices': sum(len(offices) for offices in office_dict.values()),
+    }
+
+
+def _start_request():
+    g.capture_start = time.time()
+    g.capture_shape = _ballot_shape()
+
+
+def _capture_request(response):
+    start = g.pop('capture_start', None)
+    if start is None or request.endpoint in SKIPPED_ENDPOINTS:
+        return response
+
+    shape = g.pop('capture_shape')
+    after = _ballot_shape()
+    record = {
+        't': round(start, 3),
+        'voter': shape['voter'] or after['voter'],
+        'endpoint': request.endpoint,
+        'route': request.url_rule.rule if request.url_rule else None,
+        'method': request.method,
+        'form': request.form.get('form_name') if request.method == 'POST' else None,
+        'groups': max(shape['groups'], after['groups']),
+        'offices': max(shape['offices'], after['offices']),
+        'status': response.status_code,
+        'ms': round((time.time() - start) * 1000, 1),
+    }
+    traffic.info(json.dumps(record))
+    return response
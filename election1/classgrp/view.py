@@ -3,11 +3,12 @@ from flask import (render_template, url_for, flash,
 from election1.classgrp.form import ClassgrpForm
 from election1.models import Classgrp, Candidate, Dates
 from election1.extensions import db
+from election1 import refdata
+from election1.conditional import conditional
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from flask_login import current_user
 from election1.utils import session_check
-from datetime import datetime
 
 
 classgrp = Blueprint('classgrp', __name__)
@@ -24,6 +25,7 @@ def check_session_timeout():
     return None  # Explicitly return None when no redirection or rendering is needed
 
 @classgrp.route('/classgrp', methods=['POST', 'GET'])
+@conditional('classgrp', 'dates')
 def classgrp_view():
     logger.info('user ' + str(current_user.user_so_name) + " has entered classgrp page")
 
@@ -31,11 +33,11 @@ def classgrp_view():
     #     print('user not authenticated')
     #     return redirect(url_for('admins.login'))
 
-    if check_dates() is False:
+    if Dates.check_dates() is False:
         flash('Please set the Election Dates before adding a class or group', category='danger')
         return redirect(url_for('mains.homepage'))
 
-    if after_start_date():
+    if Dates.after_start_date():
         flash('You cannot add or delete a class or a group after the voting start time or Election Dates are empty ',
               category='danger')
         return redirect(url_for('mains.homepage'))
@@ -48,6 +50,7 @@ def classgrp_view():
         new_classgrp = Classgrp(name=classgrp_name, sortkey=sortkey)
         db.session.add(new_classgrp)
         db.session.commit()
+        refdata.invalidate_classgrps()
         logger.info('user ' + str(current_user.user_so_name) + " has created class group " + str(classgrp_name))
         flash('successfully added record', category='success')
         # classgrps = Classgrp.query.order_by(Classgrp.sortkey)
@@ -83,12 +86,15 @@ def deleteclass(xid):
     form = ClassgrpForm()
 
     if request.method == 'POST':
+        # the row is gone after the commit
+        name = classgrp_to_delete.name
         try:
-            db.session.delete(classgrp_to_delete)
+            deleted = Classgrp.delete_with_dependents(xid)
             db.session.commit()
-            logger.info(
-                'user ' + str(
-                    current_user.user_so_name) + ' has deleted the classgrp titled ' + classgrp_to_delete.name)
+            refdata.invalidate_classgrps()
+            refdata.invalidate_candidates(xid)
+            logger.info('user %s has deleted the classgrp titled %s with %s', current_user.user_so_name, name,
+                        deleted)
             flash('successfully deleted record', category='danger')
             return redirect('/classgrp')
         except SQLAlchemyError as e:
@@ -96,8 +102,8 @@ def deleteclass(xid):
             flash('There was a problem deleting record' + str(e))
             return redirect('/classgrp')
     else:
-        candidates = Candidate.get_candidates_by_classgrp(xid)
-        return render_template('classgrp_candidate_delete.html', form=form, candidates=candidates,
+        counts = Candidate.count_dependents(id_classgrp=xid)
+        return render_template('classgrp_candidate_delete.html', form=form, counts=counts,
                                classgrp_to_delete=classgrp_to_delete)
 
 
@@ -107,11 +113,11 @@ def updateclass(xid):
     # if not is_user_authenticated():
     #     return redirect(url_for('admins.login'))
 
-    if check_dates() is False:  # Check if the dates are set
+    if Dates.check_dates() is False:  # Check if the dates are set
         flash('Please set the Election Dates before updating a class or group', category='danger')
         return redirect(url_for('mains.homepage'))
 
-    if after_start_date():
+    if Dates.after_start_date():
         flash('You cannot edit a class or group after the voting start time or Election Dates are empty ',
               category='danger')
         return redirect(url_for('mains.homepage'))
@@ -123,10 +129,12 @@ def updateclass(xid):
         classgrp_to_update.sortkey = request.form['sortkey']
         try:
             db.session.commit()
+            refdata.invalidate_classgrps()
+            refdata.invalidate_candidates(xid)
             flash('successfully updates record', category='success')
             classgrp_form.name.data = ''
             classgrp_form.sortkey.data = None
-            print('classgrp_form.name.data', classgrp_form.name.data)
+            logger.debug('classgrp_form.name.data %s', classgrp_form.name.data)
             classgrps = Classgrp.query.order_by(Classgrp.sortkey)
             logger.info('user ' + str(current_user.user_so_name) + " has edit classgrp " + str(classgrp_to_update.name))
             # return render_template('classgrp.html', form=classgrp_form, classgrps=classgrps)
@@ -141,32 +149,8 @@ def updateclass(xid):
             classgrps = Classgrp.query.order_by(Classgrp.sortkey)
             return render_template('classgrp.html', form=classgrp_form, classgrps=classgrps)
     else:
-        print()
         classgrp_form.name.data = ''
         classgrp_form.sortkey.data = ''
         return render_template('update_classgrp.html', form=classgrp_form,
                                classgrp_to_update=classgrp_to_update)
 
-
-def after_start_date():
-    from election1.models import Dates  # Local import to avoid circular import
-    date = Dates.query.first()
-    start_date_time = datetime.fromtimestamp(date.start_date_time)
-
-    # Get the current date time
-    current_date_time = datetime.now()
-
-    # Check if current date time is less than start date time
-    if current_date_time > start_date_time:
-        return True
-    else:
-        return False
-
-
-def check_dates():
-    from election1.models import Dates  # Local import to avoid circular import
-    date = Dates.query.first()
-    if date is None:
-        return False
-    else:
-        return True
@@ -0,0 +1,191 @@
+"""
+Flask cli commands, run them with `flask --app run <command>`.
+"""
+import sqlite3
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from election1.extensions import db
+
+
+def register_commands(app):
+    app.cli.add_command(init_db)
+    app.cli.add_command(copy_replica)
+    app.cli.add_command(db_upgrade)
+    app.cli.add_command(db_version)
+    app.cli.add_command(explain_check)
+    app.cli.add_command(compile_templates)
+    app.cli.add_command(generate_election)
+    app.cli.add_command(generate_votes)
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db():
+    """
+    Create and seed the election database if it is new and apply the pending migrations.
+    """
+    from election1.bootstrap import bootstrap_database
+    if bootstrap_database():
+        click.echo('created and seeded a new database')
+    click.echo('database is up to date')
+
+
+@click.command('copy-replica')
+@with_appcontext
+def copy_replica():
+    """
+    Copy the primary sqlite database over the replica sqlite database.
+    Lets the read replica routing be tried locally with a second sqlite file.
+    """
+    if 'replica' not in current_app.config.get('SQLALCHEMY_BINDS', {}):
+        raise click.ClickException('REPLICA_DATABASE_URI is not set')
+    primary = db.engine
+    replica = db.engines['replica']
+    if primary.url.get_backend_name() != 'sqlite' or replica.url.get_backend_name() != 'sqlite':
+        raise click.ClickException('copy-replica only copies sqlite databases, use the database replication')
+
+    source = sqlite3.connect(primary.url.database)
+    target = sqlite3.connect(replica.url.database)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    click.echo(f'copied {primary.url.database} to {replica.url.database}')
+
+
+@click.command('db-upgrade')
+@click.option('--target', type=int, default=None, help='Stop at this version instead of the newest.')
+@with_appcontext
+def db_upgrade(target):
+    """
+    Apply the pending schema migrations to the primary database.
+    """
+    from election1 import migrations
+    applied = migrations.upgrade(db.engine, target)
+    if applied:
+        click.echo(f'applied migrations {", ".join(str(number) for number in applied)}')
+    click.echo(f'database is at version {migrations.current_version(db.engine)} of {migrations.HEAD}')
+
+
+@click.command('db-version')
+@with_appcontext
+def db_version():
+    """
+    Show the schema version of the primary database and the pending migrations.
+    """
+    from election1 import migrations
+    version = migrations.current_version(db.engine)
+    click.echo(f'database is at version {version} of {migrations.HEAD}')
+    for number, description, _ in migrations.MIGRATIONS:
+        if number > version:
+            click.echo(f'  pending {number}: {description}')
+
+
+@click.command('explain-check')
+@click.option('--verbose', is_flag=True, help='Print the plan of every query.')
+@with_appcontext
+def explain_check(verbose):
+    """
+    Check with EXPLAIN that the hot queries of models.py use their indexes.
+    """
+    from election1.explain import check_hot_queries
+    missing = 0
+    for name, indexes, used, plan in check_hot_queries():
+        click.echo(f'{"ok  " if used else "MISS"} {name} ({" or ".join(sorted(indexes))})')
+        if verbose or not used:
+            for line in plan:
+                click.echo(f'       {line}')
+        missing += not used
+    if missing:
+        raise click.ClickException(f'{missing} hot queries do not use their index, run flask db-upgrade')
+
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates():
+    """
+    Compile every template into TEMPLATE_CACHE_DIR, run it at deploy time.
+    """
+    from election1.templatecache import load_templates
+    if not current_app.config.get('TEMPLATE_CACHE_DIR'):
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not set')
+    loaded = load_templates(current_app)
+    click.echo(f"compiled {loaded} templates into {current_app.config['TEMPLATE_CACHE_DIR']}")
+
+def _turnout_options(command):
+    command = click.option('--turnout', type=float, default=0.6, show_default=True,
+                           help='Share of the unused tokens that vote.')(command)
+    command = click.option('--curve', type=click.Choice(['flat', 'morning', 'late', 'bell']), default='bell',
+                           show_default=True, help='When in the voting window the ballots are cast.')(command)
+    command = click.option('--partial', type=float, default=0.1, show_default=True,
+                           help='Share of the ballots that skip some offices.')(command)
+    command = click.option('--writein-share', type=float, default=0.05, show_default=True,
+                           help='Share of the votes for offices with a write-in entry that are write-ins.')(command)
+    command = click.option('--register-writeins', type=float, default=0.0, show_default=True,
+                           help='Share of the names written in that are registered as write-in candidates.')(command)
+    return command
+
+
+def _cast(election, turnout, curve, partial, writein_share, register_writeins, seed):
+    from election1.synthetic import cast_ballots
+    start = time.perf_counter()
+    votes = cast_ballots(election, int(len(election.unused_tokens) * turnout), seed, curve, partial, writein_share,
+                         register_writeins=register_writeins)
+    click.echo(f'cast {votes} votes in {time.perf_counter() - start:.2f}s')
+
+
+@click.command('generate-election')
+@click.option('--groups', type=int, default=8, show_default=True)
+@click.option('--offices', type=int, default=10, show_default=True)
+@click.option('--candidates', type=int, default=4, show_default=True, help='Candidates per group and office.')
+@click.option('--tokens', type=int, default=10000, show_default=True)
+@click.option('--multi-group', type=float, default=0.1, show_default=True,
+              help='Share of the tokens that vote for two groups.')
+@click.option('--writeins', type=float, default=0.3, show_default=True,
+              help='Share of the group and office pairs with a write-in entry.')
+@_turnout_options
+@click.option('--seed', type=int, default=1, show_default=True)
+@click.option('--reset', is_flag=True, help='Delete the existing groups, offices, candidates, tokens and votes first.')
+@with_appcontext
+def generate_election(groups, offices, candidates, tokens, multi_group, writeins, turnout, curve, partial,
+                      writein_share, register_writeins, seed, reset):
+    """
+    Fill the database with a synthetic election for capacity tests, the same options
+    always give the same election.
+    """
+    from election1.synthetic import reset_election, build_election, election_size, tables_in_the_way
+    if reset:
+        reset_election()
+    else:
+        in_the_way = tables_in_the_way()
+        if in_the_way:
+            raise click.ClickException(f'the database already has rows in {", ".join(in_the_way)},'
+                                       f' use --reset to replace them')
+
+    start = time.perf_counter()
+    election = build_election(groups, offices, candidates, tokens, seed, multi_group, writeins)
+    click.echo(f'built {groups} groups, {offices} offices and {tokens} tokens in {time.perf_counter() - start:.2f}s')
+    if turnout:
+        _cast(election, turnout, curve, partial, writein_share, register_writeins, seed)
+    click.echo(', '.join(f'{table} {rows}' for table, rows in election_size().items()))
+
+
+@click.command('generate-votes')
+@_turnout_options
+@click.option('--seed', type=int, default=2, show_default=True)
+@with_appcontext
+def generate_votes(turnout, curve, partial, writein_share, register_writeins, seed):
+    """
+    Let a share of the unused tokens of the current election vote.
+    """
+    from election1.synthetic import load_election, election_size
+    election = load_election()
+    if not election.unused_tokens:
+        raise click.ClickException('there are no unused tokens')
+    _cast(election, turnout, curve, partial, writein_share, register_writeins, seed)
+    click.echo(', '.join(f'{table} {rows}' for table, rows in election_size().items()))
@@ -0,0 +1,67 @@
+"""
+Response compression.
+
+HTML pages, HTMX fragments and the other text responses larger than
+COMPRESS_MIN_SIZE bytes are sent brotli (when the brotli package is installed) or gzip
+encoded, whichever the browser accepts.  A ballot step is then a few kilobytes on the
+school Wi-Fi instead of tens.  Files sent by send_file / static are left alone.
+"""
+import gzip
+
+from flask import current_app, request
+
+try:
+    import brotli  # optional, gzip is used without it
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+                'application/json', 'image/svg+xml')
+
+
+def init_compression(app):
+    """
+    Must be registered before the other after_request handlers (metrics, the sql
+    profiler footer), Flask runs them in reverse so this one sees the final body.
+    """
+    if not app.config.get('COMPRESS_ENABLED', True):
+        return
+    app.after_request(_compress_response)
+
+
+def choose_encoding(accept_encodings):
+    """
+    :return: 'br', 'gzip' or None for the Accept-Encoding of a request.
+    """
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return response
+    # the body depends on Accept-Encoding even when it is sent uncompressed
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or response.content_length is None \
+            or response.content_length < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+        return response
+
+    data = response.get_data()
+    if encoding == 'br':
+        data = brotli.compress(data, quality=current_app.config.get('COMPRESS_BROTLI_QUALITY', 4))
+    else:
+        data = gzip.compress(data, compresslevel=current_app.config.get('COMPRESS_LEVEL', 6), mtime=0)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # the encoded bytes differ from the ones the strong validator was made for
+        response.set_etag(etag, weak=True)
+    return response
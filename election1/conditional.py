@@ -0,0 +1,111 @@
+"""
+Conditional GET for the read-mostly pages.
+
+The validators of a page come from cheap counters instead of its content: the
+ChangeVersion rows of the tables it shows (one small query), the newest vote id for
+the results (Votes.tally_version, read from the primary key index), the election
+phase, the logged in admin and the CSRF token of the session the forms carry.  A
+request whose If-None-Match or If-Modified-Since still matches gets a 304 before the
+view renders or queries anything.
+
+    @classgrp.route('/classgrp', methods=['POST', 'GET'])
+    @conditional('classgrp')
+    def classgrp_view(): ...
+
+Views that check the session first call conditional_response(render, ...) themselves.
+Requests with flashed messages waiting are always rendered.  CONDITIONAL_GET turns it
+off.
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified, http_date
+from election1 import phase
+from election1.models import ChangeVersion, Votes
+
+_release = None
+
+
+def _release_key():
+    """
+    Changes when a template changes, so a deploy does not serve old pages as fresh.
+    """
+    global _release
+    if _release is None:
+        digest = hashlib.sha1()
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        for name in sorted(os.listdir(folder)):
+            stat = os.stat(os.path.join(folder, name))
+            digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        _release = digest.hexdigest()[:12]
+    return _release
+
+
+def _csrf_period():
+    # a page reused past the CSRF time limit would post an expired token
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    return int(time.time() // max(60, limit // 2))
+
+
+def page_validators(tables=(), tally=False):
+    """
+    :param tables: ChangeVersion table names the page shows.
+    :param tally: the page shows vote counts.
+    :return: (etag, last_modified) of the current request's page, last_modified may be None.
+    """
+    versions = ChangeVersion.get_versions() if tables else {}
+    # the admin pages redirect or lock their forms once voting starts
+    parts = [request.endpoint, request.query_string.decode(), _release_key(), phase.current_phase(),
+             session.get('csrf_token', ''), _csrf_period()]
+    if current_user.is_authenticated:
+        parts.append((current_user.get_id(), current_user.id_admin_role))
+    parts.extend((table, versions.get(table, (0, 0))[0]) for table in tables)
+    if tally:
+        parts.append(('votes', Votes.tally_version()))
+    etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+    # the results change with every vote, their ETag is all the validation they get
+    changed = [versions[table][1] for table in tables if table in versions]
+    last_modified = datetime.fromtimestamp(int(max(changed)), timezone.utc) if changed and not tally else None
+    return etag, last_modified
+
+
+def conditional_response(render, tables=(), tally=False):
+    """
+    Answer 304 when the browser's copy of the page is current, otherwise render() it
+    with an ETag (and Last-Modified).
+    """
+    if request.method != 'GET' or not current_app.config.get('CONDITIONAL_GET', True) \
+            or session.get('_flashes'):
+        return render()
+
+    etag, last_modified = page_validators(tables, tally)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    # the browser keeps the page but asks every time, and never shares it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def conditional(*tables, tally=False):
+    """
+    Decorator for a view whose GET page only changes with tables (and the tally).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return conditional_response(lambda: view(*args, **kwargs), tables, tally)
+        return wrapper
+    return decorator
@@ -1,8 +1,9 @@
 from flask import (render_template, url_for, flash,
                    redirect, request, Blueprint, current_app)
 from election1.dates.form import ( DatesForm)
-from election1.models import  Dates
+from election1.models import  Dates, ElectionTransition
 from election1.extensions import db
+from election1 import phase, scheduler
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from flask_login import current_user
@@ -32,7 +33,7 @@ def dates_view():
 
     if request.method == 'POST' and form.validate():
         if form.validate_on_submit():
-            print("form validated")
+            logger.debug("form validated")
 
             datetime_str = request.form.get('start_date_time').replace("T", " ")
             datetime_etr = request.form.get('end_date_time').replace("T", " ")
@@ -45,18 +46,24 @@ def dates_view():
 
             new_dates = Dates(start_date_time=epoch_start_time, end_date_time=epoch_end_time)
             db.session.add(new_dates)
+            scheduler.reset_window(epoch_start_time, epoch_end_time)
             db.session.commit()
+            phase.invalidate_election_window()
+            scheduler.wake()
 
             logger.info('user ' + str(current_user.user_so_name) + " has added the following dates:")
-            logger.info(f'Start date: {datetime_object_start}, End date: {datetime_object_end}')
+            logger.info('Start date: %s, End date: %s', datetime_object_start, datetime_object_end)
 
             return redirect(url_for('mains.homepage'))
         else:
-            print("form did not validate")
+            logger.debug("form did not validate")
             for field, errors in form.errors.items():
                 for error in errors:
                     flash(f"Error in {getattr(form, field).label.text}: {error}", 'danger')
 
+    window = phase.election_window()
+    transitions = ElectionTransition.for_window(window.start, window.end) if window.configured else {}
+
     edate_dict = {}
     edates = Dates.query.all()
     if edates is not None:
@@ -68,7 +75,9 @@ def dates_view():
             }
             edate_dict.update(new_edate_dict)
 
-    return render_template('dates.html', form=form, edate_dict=edate_dict)
+    return render_template('dates.html', form=form, edate_dict=edate_dict,
+                           election_phase=phase.current_phase(),
+                           seconds_to_next=phase.seconds_to_next_transition(), transitions=transitions)
 
 
 @dates.route('/deletedates/')
@@ -85,6 +94,8 @@ def deletedates():
     try:
         db.session.delete(date_to_delete)
         db.session.commit()
+        phase.invalidate_election_window()
+        scheduler.wake()
         flash('successfully deleted record')
         return redirect('/dates')
     except SQLAlchemyError as e:
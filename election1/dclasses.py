@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from flask_login import UserMixin
 
 
 @dataclass
@@ -97,3 +98,17 @@ class CandidateDataClass:
     def write_in_allowed(self, value):
         self._write_in_allowed = value
 
+
+@dataclass(frozen=True)
+class AdminIdentity(UserMixin):
+    """
+    The parts of a User that the admin pages read from current_user, kept in user_cache so
+    the Flask-Login user_loader does not query the User table on every request.
+    """
+    id_user: int
+    user_so_name: str
+    id_admin_role: int
+    user_status: int
+
+    def get_id(self):
+        return self.id_user
@@ -0,0 +1,64 @@
+"""
+EXPLAIN check for the hot queries of models.py.
+
+Each entry of HOT_QUERIES builds the statement the views run (with placeholder values)
+and names the indexes its plan should use.  check_hot_queries() asks the database for
+the plan and reports the queries that do not use one of them, `flask explain-check`
+prints the report.  Only sqlite (EXPLAIN QUERY PLAN) and mysql (EXPLAIN) are known.
+"""
+from election1.extensions import db
+
+
+def _hot_queries():
+    from election1.models import Candidate, Votes, Tokenlist  # Local import to avoid circular import
+    return [
+        ('results summary', Candidate.summary_results_query().statement,
+         {'ix_votes_id_candidate'}),
+        ('candidates for an office of a group',
+         Candidate.get_candidates_for_specific_office_by_classgrp(1, 1).statement,
+         {'ix_candidate_classgrp_office'}),
+        ('write-in candidate check',
+         Candidate.query.filter_by(firstname='Writein', id_classgrp=1, id_office=1).statement,
+         {'ix_candidate_classgrp_office', 'ix_candidate_name_classgrp'}),
+        ('duplicate candidate check',
+         Candidate.query.filter_by(firstname='a', lastname='b', id_classgrp=1).statement,
+         {'ix_candidate_name_classgrp'}),
+        ('votes of a token', Votes.query.filter_by(votes_token='x').statement,
+         {'ix_votes_votes_token'}),
+        ('tokens of a group list', Tokenlist.query.filter_by(grp_list='x').statement,
+         {'ix_tokenlist_grp_list'}),
+    ]
+
+
+def explain(statement, engine=None):
+    """
+    :return: the plan of statement as a list of strings, one per plan row.
+    """
+    engine = db.engine if engine is None else engine
+    backend = engine.url.get_backend_name()
+    if backend == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif backend == 'mysql':
+        prefix = 'EXPLAIN '
+    else:
+        raise ValueError(f'no EXPLAIN support for {backend}')
+    compiled = statement.compile(dialect=engine.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + str(compiled), params).all()
+    return [' '.join(str(value) for value in row if value is not None) for row in rows]
+
+
+def check_hot_queries(engine=None):
+    """
+    :return: a list of (name, expected indexes, used, plan) for every hot query.
+    """
+    report = []
+    for name, statement, indexes in _hot_queries():
+        plan = explain(statement, engine)
+        used = any(index in line for line in plan for index in indexes)
+        report.append((name, indexes, used, plan))
+    return report
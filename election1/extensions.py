@@ -2,16 +2,21 @@ from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 from flask_bootstrap import Bootstrap5
 from flask_wtf import CSRFProtect
+from election1.ratelimit import RateLimiter
+from election1.routing import RoutingSession
 
 
 # A bootstrap5 class for styling client side.
 bootstrap = Bootstrap5()
 
-# database for managing user data.
-db = SQLAlchemy()
+# database for managing user data, report queries can be routed to a read replica.
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # login manager for managing user authentication.
 login_manager = LoginManager()
 
 # csrf protection for form submission.
 csrf = CSRFProtect()
+
+# admission control for the voting and login endpoints.
+limiter = RateLimiter()
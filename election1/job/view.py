@@ -0,0 +1,54 @@
+from flask import render_template, Blueprint, abort, send_from_directory
+from flask_login import current_user
+from election1.job.form import CancelJobForm
+from election1 import jobrunner
+from election1.utils import session_check
+import logging
+
+job = Blueprint('job', __name__)
+logger = logging.getLogger(__name__)
+
+
+@job.before_request
+def check_session_timeout():
+    # these are HTMX fragments, a redirect to the login page would be swapped into the admin page,
+    # and 286 stops the polling
+    if not current_user.is_authenticated or not session_check():
+        return '<span class="text-warning">log in again to follow this job</span>', 286
+    return None
+
+
+@job.route('/jobs/<kind>')
+def recent_jobs(kind):
+    """
+    The recent jobs of a kind, loaded by the admin page that starts them.
+    """
+    return render_template('job_list.html', jobs=jobrunner.recent_jobs(kind), cancel_form=CancelJobForm())
+
+
+@job.route('/job/<int:id_job>')
+def job_status(id_job):
+    """
+    The status fragment of a job, it polls itself until the job is finished.
+    """
+    job_record = jobrunner.get_job(id_job)
+    if job_record is None:
+        abort(404)
+    return render_template('job_status.html', job=job_record, cancel_form=CancelJobForm())
+
+
+@job.route('/job/<int:id_job>/cancel', methods=['POST'])
+def cancel_job(id_job):
+    form = CancelJobForm()
+    if form.validate_on_submit():
+        jobrunner.cancel(id_job)
+        logger.info('user %s cancelled job %s', current_user.user_so_name, id_job)
+    return job_status(id_job)
+
+
+@job.route('/job/<int:id_job>/download')
+def download(id_job):
+    job_record = jobrunner.get_job(id_job)
+    if job_record is None or job_record.status != 'done' or not job_record.result_file:
+        abort(404)
+    return send_from_directory(jobrunner.job_dir(), job_record.result_file, as_attachment=True)
@@ -0,0 +1,197 @@
+"""
+Background jobs for the long admin operations.
+
+Issuing a class worth of tokens, drawing their QR codes or exporting the results would
+hold a worker thread for as long as it takes, past the proxy timeout and
+WTF_CSRF_TIME_LIMIT.  The admin page starts them with submit() instead and returns at
+once with the job status fragment, which polls /job/<id_job> (job/view.py) every second.
+
+    id_job = jobrunner.submit('issue_tokens', issue_tokens, current_user.user_so_name,
+                              id_selector=3, count=500)
+
+    def issue_tokens(job, id_selector, count):
+        for ...:
+            ...
+            db.session.commit()
+            job.progress(issued, count)  # raises JobCancelled once a cancel is asked for
+        return 'tokens-12.csv'           # a file in job_dir() offered for download, or None
+
+Each worker process runs up to JOB_WORKERS jobs at a time on a thread pool, the others
+wait in its queue.  The status lives in the job table so any worker answers the polls.
+The job rows are always read from the primary database, a replica may not have them yet.
+Progress is written at most every JOB_PROGRESS_INTERVAL seconds and doubles as the
+heartbeat: a job that stops beating for JOB_STALE_SECONDS (its worker was recycled or
+stopped) is marked failed the next time somebody looks at it.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, update
+from election1.extensions import db
+from election1.models import Job
+from election1.routing import primary
+from election1.sqlite_profile import retry_locked
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """
+    Raised by JobContext.progress in the job thread when the job was cancelled.
+    """
+
+
+class JobContext:
+    """
+    What a job function gets to report its progress.
+    """
+
+    def __init__(self, id_job, interval):
+        self.id_job = id_job
+        self.interval = interval
+        self._written = 0.0
+
+    def progress(self, done, total=None, message=None, force=False):
+        """
+        Record how far the job is, at most every JOB_PROGRESS_INTERVAL seconds unless forced.
+        Commits the session, call it between units of work.
+        :raises JobCancelled: when a cancel was asked for.
+        """
+        now = time.monotonic()
+        if not force and now - self._written < self.interval:
+            return
+        self._written = now
+        values = {'done': done, 'heartbeat': time.time()}
+        if total is not None:
+            values['total'] = total
+        if message is not None:
+            values['message'] = message[:255]
+        if _write_progress(self.id_job, values):
+            raise JobCancelled()
+
+
+@retry_locked
+def _write_progress(id_job, values):
+    db.session.execute(update(Job).where(Job.id_job == id_job).values(**values))
+    cancel_requested = db.session.execute(select(Job.cancel_requested).where(Job.id_job == id_job)).scalar()
+    db.session.commit()
+    return cancel_requested
+
+
+@retry_locked
+def _set_status(id_job, status, message=None, result_file=None):
+    values = {'status': status, 'heartbeat': time.time()}
+    if message is not None:
+        values['message'] = message[:255]
+    if status in Job.FINISHED:
+        values['finished_datetime'] = datetime.now()
+        values['result_file'] = result_file
+    db.session.execute(update(Job).where(Job.id_job == id_job).values(**values))
+    db.session.commit()
+
+
+def job_dir():
+    """
+    :return: the directory of the job result files, created when missing.
+    """
+    directory = current_app.config.get('JOB_DIR') or os.path.join(current_app.instance_path, 'jobs')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _pool():
+    global _executor, _executor_pid
+    with _lock:
+        # a pool made in the gunicorn master before the fork has no threads in this worker
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=current_app.config.get('JOB_WORKERS', 2),
+                                           thread_name_prefix='job')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def submit(kind, function, created_by=None, **params):
+    """
+    Add a job row and queue function(JobContext, **params) on the pool of this worker.
+    :param kind: what the job does, the admin pages list their recent jobs by kind.
+    :param function: the job, it returns the name of a file in job_dir() or None.
+    :param created_by: the so_name of the admin who started it.
+    :return: the id_job.
+    """
+    job = Job(kind=kind, created_by=created_by, heartbeat=time.time())
+    db.session.add(job)
+    # the id before the commit expires the job, a reload could go to the replica (routing.py)
+    db.session.flush()
+    id_job = job.id_job
+    db.session.commit()
+    _pool().submit(_run, current_app._get_current_object(), id_job, function, params)
+    logger.info('job %s %s queued by %s', id_job, kind, created_by)
+    return id_job
+
+
+def _run(app, id_job, function, params):
+    with app.app_context():
+        job = db.session.get(Job, id_job)
+        # a job that waited longer than JOB_STALE_SECONDS was marked failed meanwhile
+        if job is None or job.status != 'queued':
+            return
+        if job.cancel_requested:
+            _set_status(id_job, 'cancelled', 'cancelled before it started')
+            return
+        _set_status(id_job, 'running')
+        context = JobContext(id_job, app.config.get('JOB_PROGRESS_INTERVAL', 0.5))
+        start = time.perf_counter()
+        try:
+            result_file = function(context, **params)
+        except JobCancelled:
+            db.session.rollback()
+            _set_status(id_job, 'cancelled', 'cancelled')
+            logger.info('job %s cancelled', id_job)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('job %s %s failed', id_job, job.kind)
+            _set_status(id_job, 'failed', f'{type(e).__name__}: {e}')
+        else:
+            _set_status(id_job, 'done', result_file=result_file)
+            logger.info('job %s done in %.1fs', id_job, time.perf_counter() - start)
+
+
+def _fail_stale():
+    if Job.fail_stale(current_app.config.get('JOB_STALE_SECONDS', 300)):
+        db.session.commit()
+
+
+def get_job(id_job):
+    """
+    :return: the Job with its current status, None if there is no such job.
+    """
+    with primary():
+        _fail_stale()
+        return db.session.get(Job, id_job)
+
+
+def recent_jobs(kind):
+    """
+    :return: the newest jobs of kind with their current status.
+    """
+    with primary():
+        _fail_stale()
+        return Job.recent(kind)
+
+
+def cancel(id_job):
+    """
+    Ask a job to stop, it does at its next progress report.
+    """
+    db.session.execute(update(Job).where(Job.id_job == id_job, Job.status.in_(('queued', 'running')))
+                       .values(cancel_requested=True))
+    db.session.commit()
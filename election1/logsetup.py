@@ -0,0 +1,123 @@
+"""
+Application logging.
+
+Every record goes through a QueueHandler on the root logger; a QueueListener thread
+does the writing to stdout (and to VOTE_EVENT_LOG), so the request threads never wait on
+I/O.  The message is still merged with its arguments on the request thread, by
+QueueHandler.prepare(), so an expensive argument costs the request all the same.
+LOG_PROFILE picks the levels:
+
+    development  everything at DEBUG, the voter trace goes to VOTE_EVENT_LOG
+    production   INFO and up, the voter trace only for its warnings and errors
+
+With TRAFFIC_CAPTURE set the request records of capture.py go, one JSON line each, to
+that file and nowhere else.
+
+The views log with lazy %-formatting (logger.debug('office_dict %s', office_dict)) so a
+disabled DEBUG record is dropped before its arguments are turned into text.
+LOG_CONFIG can point to a logging fileConfig file to replace all of this.
+"""
+import atexit
+import logging
+import logging.config
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+VOTE_EVENTS = 'election1.vote.events'
+TRAFFIC = 'election1.traffic'
+
+PROFILES = {
+    'development': {'level': 'DEBUG', 'loggers': {VOTE_EVENTS: 'DEBUG'}},
+    'production': {'level': 'INFO', 'loggers': {VOTE_EVENTS: 'WARNING'}},
+}
+
+_listener = None
+_listener_pid = None
+_settings = None
+
+
+class _ExcludeLogger(logging.Filter):
+    """
+    Drop the records of one logger (and its children) from a handler.
+    """
+
+    def filter(self, record):
+        return not super().filter(record)
+
+
+def configure_logging(profile='development', level=None, vote_event_log=None, config_file=None, traffic_log=None):
+    """
+    Set up the root logger for profile.
+    :param level: overrides the root level of the profile, for example 'WARNING'.
+    :param vote_event_log: file for the voter trace, it then stays out of stdout.
+    :param config_file: a logging fileConfig file used instead of the profile.
+    :param traffic_log: file for the captured requests (capture.py).
+    """
+    global _listener, _listener_pid, _settings
+    _settings = dict(profile=profile, level=level, vote_event_log=vote_event_log, config_file=config_file,
+                     traffic_log=traffic_log)
+    stop_logging()
+
+    if config_file:
+        logging.config.fileConfig(config_file, disable_existing_loggers=False)
+        return
+
+    settings = PROFILES.get(profile, PROFILES['development'])
+    formatter = logging.Formatter(LOG_FORMAT)
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(formatter)
+    handlers = [console]
+    if vote_event_log:
+        console.addFilter(_ExcludeLogger(VOTE_EVENTS))
+        vote_file = logging.FileHandler(vote_event_log)
+        vote_file.setFormatter(formatter)
+        vote_file.addFilter(logging.Filter(VOTE_EVENTS))
+        handlers.append(vote_file)
+    # the captured requests only go to their own file, and are kept whatever the level
+    console.addFilter(_ExcludeLogger(TRAFFIC))
+    traffic = logging.getLogger(TRAFFIC)
+    traffic.setLevel(logging.INFO)
+    if traffic_log:
+        traffic_file = logging.FileHandler(traffic_log)
+        traffic_file.setFormatter(logging.Formatter('%(message)s'))
+        traffic_file.addFilter(logging.Filter(TRAFFIC))
+        handlers.append(traffic_file)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level or settings['level'])
+    for name, logger_level in settings['loggers'].items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+def stop_logging():
+    """
+    Write out the queued records and stop the listener thread.
+    """
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+    _listener = None
+
+
+def restart_after_fork():
+    """
+    A forked process (a gunicorn worker) has no listener thread, start its own.
+    """
+    if _settings is not None and _listener_pid != os.getpid():
+        configure_logging(**_settings)
+
+
+atexit.register(stop_logging)
@@ -6,12 +6,14 @@ from election1 import logger, User
 from election1.mains.form import LoginForm
 from flask_login import login_user, logout_user, login_required, current_user
 from election1.utils import session_check
+from election1.extensions import limiter
+from election1.conditional import conditional_response
 
 mains = Blueprint('mains', __name__)
 
 @mains.route('/', methods=['GET'])
 def index():
-    print("Entered index")
+    logger.debug("Entered index")
     """
     Redirect to homepage.
     """
@@ -32,10 +34,11 @@ def homepage():
         return render_template('session_timeout.html', error=error, home=home)
 
     logger.info("Entered homepage")
-    return render_template('homepage.html')
+    return conditional_response(lambda: render_template('homepage.html'))
 
 
 @mains.route('/login', methods=['GET', 'POST'])
+@limiter.limit('login', repost=False, methods=('POST',))
 def login():
     """
     Handle user login.
@@ -43,7 +46,7 @@ def login():
     logger.info("Entered Login")
     form = LoginForm()
     if current_user.is_authenticated:
-        print("User is already authenticated")
+        logger.debug("User is already authenticated")
         return redirect(url_for('mains.homepage'))
 
     if form.validate_on_submit():
@@ -53,12 +56,12 @@ def login():
 
         if user and verify_password(user.user_salt, user.user_pass, login_pass):
             login_user(user)
-            logger.info(f'User {current_user.user_so_name} has logged on')
+            logger.info('User %s has logged on', current_user.user_so_name)
 
             # Generate and set a new CSRF token
             new_csrf_token = generate_csrf()
             session['csrf_token'] = new_csrf_token
-            print(f'New CSRF token: {new_csrf_token}')
+            logger.debug('New CSRF token: %s', new_csrf_token)
 
             current_date_time = datetime.now()
             session['last_activity'] = current_date_time.strftime("%Y-%m-%d %H:%M:%S")
@@ -77,6 +80,6 @@ def logout():
     """
     Handle user logout.
     """
-    logger.info(f'User {current_user.user_so_name} has logged out')
+    logger.info('User %s has logged out', current_user.user_so_name)
     logout_user()
     return redirect(url_for('mains.homepage'))
@@ -0,0 +1,123 @@
+"""
+Prometheus metrics for the app, served at /metrics in the text exposition format.
+
+Every request is counted and timed per endpoint, together with the number of database
+queries it ran and the time they took (the cursor events of queryevents.py).  The vote and misc
+views also count ballot commits, token validations by outcome and QR code renders.
+
+Under gunicorn each worker keeps its own values.  Set PROMETHEUS_MULTIPROC_DIR to an
+empty directory before the app starts so the workers write them there and /metrics
+adds them up across the workers (gunicorn.conf.py cleans up after a worker exits).
+
+/metrics is served on the public app, so only a scraper with METRICS_TOKEN or a client
+address in METRICS_ALLOWED_NETWORKS (by default the loopback) reads it.  A request that
+came through a proxy is only trusted by its address when PROXY_FIX_X_FOR resolved it.
+"""
+import hmac
+import ipaddress
+import os
+import time
+
+from flask import abort, current_app, g, request, has_request_context, Response
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+from election1 import queryevents
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+REQUESTS = Counter('election_requests_total', 'HTTP requests',
+                   ['endpoint', 'method', 'status'])
+REQUEST_LATENCY = Histogram('election_request_duration_seconds', 'HTTP request latency',
+                            ['endpoint'], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge('election_requests_in_flight', 'HTTP requests being served',
+                  multiprocess_mode='livesum')
+DB_QUERIES = Histogram('election_db_queries_per_request', 'Database queries run by a request',
+                       ['endpoint'], buckets=QUERY_COUNT_BUCKETS)
+DB_TIME = Histogram('election_db_seconds_per_request', 'Time a request spent in database queries',
+                    ['endpoint'], buckets=LATENCY_BUCKETS)
+BALLOT_COMMITS = Counter('election_ballot_commits_total', 'Ballots written, by outcome',
+                         ['outcome'])
+TOKEN_VALIDATIONS = Counter('election_token_validations_total', 'Voting tokens checked on the cast page, by outcome',
+                            ['outcome'])
+QR_RENDERS = Counter('election_qr_renders_total', 'QR codes drawn')
+
+
+def init_metrics(app):
+    """
+    Time every request of app and add the /metrics endpoint, unless METRICS_ENABLED is off.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    queryevents.subscribe(_count_query)
+
+
+def _endpoint():
+    # the url rule, not the path, so /cast/<grp_list>/<token> is one label value
+    return request.endpoint or 'unmatched'
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_time = 0.0
+    g.metrics_in_flight = True
+    IN_FLIGHT.inc()
+
+
+def _record_request(response):
+    # also runs for the 500 page of an unhandled error
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        endpoint = _endpoint()
+        REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+        REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+        DB_QUERIES.labels(endpoint).observe(g.get('metrics_queries', 0))
+        DB_TIME.labels(endpoint).observe(g.get('metrics_query_time', 0.0))
+    return response
+
+
+def _end_request(error=None):
+    if g.pop('metrics_in_flight', False):
+        IN_FLIGHT.dec()
+
+
+def _count_query(statement, elapsed):
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        g.metrics_query_time += elapsed
+
+
+def metrics_allowed():
+    """
+    :return: True when the current request may read /metrics.
+    """
+    config = current_app.config
+    token = config.get('METRICS_TOKEN')
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(given.strip().encode(), token.encode()):
+        return True
+    # without ProxyFix the address of a proxied request is the proxy's, likely the loopback
+    if 'X-Forwarded-For' in request.headers and not config.get('PROXY_FIX_X_FOR'):
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in config.get('METRICS_ALLOWED_NETWORKS', ()))
+
+
+def metrics_view():
+    if not metrics_allowed():
+        abort(404)
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
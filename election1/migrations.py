@@ -0,0 +1,319 @@
+"""
+Versioned schema migrations for existing election databases.
+
+The schema_version table holds the number of the last migration applied, in its one
+row.  upgrade() runs every migration above it in order, each one in its own transaction
+that is serialized with those of other processes upgrading at the same time, and updates
+the version after each.  New databases are still built with db.create_all() and then
+upgraded, so every step has to be safe to run against a schema that already has its
+change (check with the inspector or use checkfirst).
+
+To change the schema add the column/index to models.py and append a function to
+MIGRATIONS that makes the same change on an existing database.  The migrations build
+their tables from the frozen copies below, never from models.py.
+"""
+import logging
+
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table,
+                        UniqueConstraint, func, inspect, select, text, update)
+
+logger = logging.getLogger(__name__)
+
+version_metadata = MetaData()
+schema_version = Table('schema_version', version_metadata, Column('version', Integer, nullable=False))
+
+
+# Frozen copies of the tables as the migrations create them.  A migration must build the
+# same schema whenever it runs, so it never uses the live models of models.py, which keep
+# changing; a later change to a table is a new migration, not an edit here.
+frozen_metadata = MetaData()
+
+_BASELINE = (
+    Table('admin_roles', frozen_metadata,
+          Column('id_admin_role', Integer, primary_key=True),
+          Column('admin_role_name', String(45), nullable=False, unique=True),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('ballot_measure', frozen_metadata,
+          Column('id_ballot_measure', Integer, primary_key=True),
+          Column('ballot_measure_title', String(45), nullable=False, unique=True),
+          Column('ballot_measure_description', String(255), nullable=False),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('ballot_type', frozen_metadata,
+          Column('id_ballot_type', Integer, primary_key=True),
+          Column('ballot_type_name', String(45), nullable=False, unique=True),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('classgrp', frozen_metadata,
+          Column('id_classgrp', Integer, primary_key=True),
+          Column('name', String(45), nullable=False, unique=True),
+          Column('sortkey', Integer, nullable=False, unique=True),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('dates', frozen_metadata,
+          Column('iddates', Integer, primary_key=True),
+          Column('start_date_time', Integer, nullable=False),
+          Column('end_date_time', Integer, nullable=False),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('party', frozen_metadata,
+          Column('id_party', Integer, primary_key=True),
+          Column('party_name', String(45), nullable=False, unique=True),
+          Column('party_abbreviation', String(1), nullable=False, unique=True),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('tokenlist', frozen_metadata,
+          Column('id_tokenlist', Integer, primary_key=True),
+          Column('grp_list', String(45), nullable=False),
+          Column('token', String(138), nullable=False, unique=True),
+          Column('vote_submitted_date_time', DateTime, nullable=True),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('tokenlistselectors', frozen_metadata,
+          Column('id_tokenListSelector', Integer, primary_key=True),
+          Column('primary_grp', String(45), nullable=False),
+          Column('secondary_grp', String(45)),
+          Column('tertiary_grp', String(45)),
+          Column('quarternary_grp', String(45)),
+          Column('creation_datetime', DateTime, nullable=False)),
+    Table('office', frozen_metadata,
+          Column('id_office', Integer, primary_key=True),
+          Column('office_title', String(45), nullable=False, unique=True),
+          Column('office_vote_for', Integer, nullable=False),
+          Column('sortkey', Integer, nullable=False, unique=True),
+          Column('creation_datetime', DateTime, nullable=False),
+          Column('id_ballot_type', Integer, ForeignKey('ballot_type.id_ballot_type'), nullable=False),
+          Column('id_ballot_measure', Integer, ForeignKey('ballot_measure.id_ballot_measure'), nullable=True)),
+    Table('user', frozen_metadata,
+          Column('id_user', Integer, primary_key=True),
+          Column('user_firstname', String(45), nullable=False),
+          Column('user_lastname', String(45), nullable=False),
+          Column('user_so_name', String(30), nullable=False, unique=True),
+          Column('user_pass', String(256)),
+          Column('user_salt', String(64), nullable=False),
+          Column('user_email', String(45), unique=True),
+          Column('user_status', Integer, nullable=False),
+          Column('user_pw_change', String(1)),
+          Column('user_security', String(138)),
+          Column('user_created', DateTime),
+          Column('user_sec_send', DateTime),
+          Column('user_creation_datetime', DateTime, nullable=False),
+          Column('id_admin_role', Integer, ForeignKey('admin_roles.id_admin_role'))),
+    Table('candidate', frozen_metadata,
+          Column('id_candidate', Integer, primary_key=True),
+          Column('firstname', String(45), nullable=False),
+          Column('lastname', String(45), nullable=True),
+          Column('creation_datetime', DateTime, nullable=False),
+          Column('id_classgrp', Integer, ForeignKey('classgrp.id_classgrp'), nullable=False),
+          Column('id_office', Integer, ForeignKey('office.id_office'), nullable=False),
+          Column('id_party', Integer, ForeignKey('party.id_party'), nullable=True)),
+    Table('writein_candidate', frozen_metadata,
+          Column('id_writein_candidate', Integer, primary_key=True),
+          Column('writein_candidate_name', String(45), nullable=False),
+          Column('creation_datetime', DateTime, nullable=False),
+          Column('id_office', Integer, ForeignKey('office.id_office')),
+          Column('id_classgrp', Integer, ForeignKey('classgrp.id_classgrp'))),
+    Table('votes', frozen_metadata,
+          Column('id_votes', Integer, primary_key=True),
+          Column('votes_token', String(138), nullable=False),
+          Column('votes_writein_name', String(45), nullable=True),
+          Column('creation_datetime', DateTime, nullable=False),
+          Column('id_candidate', Integer, ForeignKey('candidate.id_candidate'))),
+)
+
+_tables = frozen_metadata.tables
+
+_HOT_QUERY_INDEXES = (
+    Index('ix_votes_id_candidate', _tables['votes'].c.id_candidate),
+    Index('ix_votes_votes_token', _tables['votes'].c.votes_token),
+    Index('ix_candidate_classgrp_office', _tables['candidate'].c.id_classgrp, _tables['candidate'].c.id_office),
+    Index('ix_candidate_name_classgrp', _tables['candidate'].c.firstname, _tables['candidate'].c.lastname,
+          _tables['candidate'].c.id_classgrp),
+    Index('ix_tokenlist_grp_list', _tables['tokenlist'].c.grp_list),
+)
+
+_change_version = Table('change_version', frozen_metadata,
+                        Column('table_name', String(45), primary_key=True),
+                        Column('version', Integer, nullable=False),
+                        Column('changed_at', Float, nullable=False))
+_CHANGE_VERSION_TABLES = ('classgrp', 'office', 'candidate', 'party', 'ballot_type', 'dates', 'tokenlistselectors')
+
+_job = Table('job', frozen_metadata,
+             Column('id_job', Integer, primary_key=True),
+             Column('kind', String(45), nullable=False),
+             Column('status', String(16), nullable=False),
+             Column('done', Integer, nullable=False),
+             Column('total', Integer, nullable=True),
+             Column('message', String(255), nullable=True),
+             Column('result_file', String(255), nullable=True),
+             Column('cancel_requested', Boolean, nullable=False),
+             Column('created_by', String(30), nullable=True),
+             Column('creation_datetime', DateTime, nullable=False),
+             Column('finished_datetime', DateTime, nullable=True),
+             Column('heartbeat', Float, nullable=False))
+
+_election_transition = Table('election_transition', frozen_metadata,
+                             Column('id_election_transition', Integer, primary_key=True),
+                             Column('name', String(16), nullable=False),
+                             Column('start_date_time', Integer, nullable=False),
+                             Column('end_date_time', Integer, nullable=False),
+                             Column('status', String(16), nullable=False),
+                             Column('attempts', Integer, nullable=False),
+                             Column('claimed_by', String(64), nullable=False),
+                             Column('heartbeat', Float, nullable=False),
+                             Column('message', String(255), nullable=True),
+                             Column('creation_datetime', DateTime, nullable=False),
+                             Column('finished_datetime', DateTime, nullable=True),
+                             UniqueConstraint('name', 'start_date_time', 'end_date_time',
+                                              name='uq_election_transition_window'))
+
+_final_tally = Table('final_tally', frozen_metadata,
+                     Column('id_final_tally', Integer, primary_key=True),
+                     Column('start_date_time', Integer, nullable=False),
+                     Column('end_date_time', Integer, nullable=False),
+                     Column('classgrp_name', String(45), nullable=False),
+                     Column('office_title', String(45), nullable=False),
+                     Column('vote_for', Integer, nullable=False),
+                     Column('id_candidate', Integer, nullable=False),
+                     Column('firstname', String(45), nullable=False),
+                     Column('lastname', String(45), nullable=False),
+                     Column('votes', Integer, nullable=False),
+                     Column('winner', Boolean, nullable=False),
+                     Column('creation_datetime', DateTime, nullable=False),
+                     Index('ix_final_tally_window', 'start_date_time', 'end_date_time'))
+
+
+def _baseline(connection):
+    """
+    The tables of the election as they were when the migrations were introduced,
+    including tokenlistselectors which setup_tokens used to create on the fly.
+    """
+    for table in _BASELINE:
+        table.create(connection, checkfirst=True)
+
+
+def _hot_query_indexes(connection):
+    """
+    Indexes for the results, ballot and duplicate check queries, see explain.py.
+    """
+    for index in _HOT_QUERY_INDEXES:
+        index.create(connection, checkfirst=True)
+
+
+def _change_versions(connection):
+    """
+    The change_version counters of conditional.py, one row per tracked table.
+    """
+    import time
+    _change_version.create(connection, checkfirst=True)
+    present = set(connection.execute(select(_change_version.c.table_name)).scalars())
+    now = time.time()
+    for table_name in _CHANGE_VERSION_TABLES:
+        if table_name not in present:
+            connection.execute(_change_version.insert().values(table_name=table_name, version=0, changed_at=now))
+
+
+def _jobs(connection):
+    """
+    The job table of jobrunner.py.
+    """
+    _job.create(connection, checkfirst=True)
+
+
+def _election_transitions(connection):
+    """
+    The election_transition lock rows and final_tally of scheduler.py, and the expiry
+    time of the tokens left unused when voting closed.
+    """
+    _election_transition.create(connection, checkfirst=True)
+    _final_tally.create(connection, checkfirst=True)
+    if 'expired_date_time' not in {column['name'] for column in inspect(connection).get_columns('tokenlist')}:
+        connection.execute(text('ALTER TABLE tokenlist ADD COLUMN expired_date_time DATETIME'))
+
+
+# (version, description, function), in order, never renumber or remove an entry
+MIGRATIONS = [
+    (1, 'baseline tables', _baseline),
+    (2, 'hot query indexes', _hot_query_indexes),
+    (3, 'change version counters', _change_versions),
+    (4, 'background jobs', _jobs),
+    (5, 'scheduled election transitions', _election_transitions),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version(engine):
+    """
+    :return: the version of the database, 0 when it has never been migrated.
+    """
+    if not inspect(engine).has_table(schema_version.name):
+        return 0
+    with engine.connect() as connection:
+        return _read_version(connection)
+
+
+def _read_version(connection):
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def _version_row(connection):
+    """
+    Create schema_version with its one row, version 0, on a database never migrated.
+    """
+    schema_version.create(connection, checkfirst=True)
+    if connection.execute(select(func.count()).select_from(schema_version)).scalar() == 0:
+        connection.execute(schema_version.insert().values(version=0))
+
+
+def _set_version(connection, version):
+    connection.execute(update(schema_version).values(version=version))
+
+
+def _lock_transaction(connection):
+    """
+    Serialize the migration transactions of concurrent upgrades, e.g. the workers of a
+    new release starting together: the first statement of the transaction waits for the
+    others to commit.  mysql commits DDL on its own, its lock is taken for the whole
+    upgrade in upgrade() instead.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        # pysqlite has not begun the transaction yet, this takes the write lock up front
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    elif dialect == 'postgresql':
+        connection.execute(select(func.pg_advisory_xact_lock(_LOCK_ID)))
+
+
+_LOCK_NAME = 'election_schema_upgrade'
+_LOCK_ID = 7310  # pg advisory lock key of the schema upgrade
+_LOCK_TIMEOUT = 300
+
+
+def upgrade(engine, target=None):
+    """
+    Apply the pending migrations up to target.  Each one runs in a locked transaction
+    that reads the version again first, so one applied by a concurrent upgrade is skipped.
+    :param engine: the engine of the primary database.
+    :param target: the version to stop at, defaults to the newest.
+    :return: the list of versions applied.
+    """
+    target = HEAD if target is None else target
+    applied = []
+    with engine.connect() as connection:
+        mysql = connection.dialect.name == 'mysql'
+        if mysql and not connection.execute(select(func.get_lock(_LOCK_NAME, _LOCK_TIMEOUT))).scalar():
+            raise RuntimeError(f'schema upgrade lock not taken within {_LOCK_TIMEOUT}s')
+        connection.commit()
+        try:
+            for number, description, migrate in MIGRATIONS:
+                if number > target:
+                    break
+                with connection.begin():
+                    _lock_transaction(connection)
+                    _version_row(connection)
+                    if number <= _read_version(connection):
+                        continue
+                    logger.info('applying migration %s: %s', number, description)
+                    migrate(connection)
+                    _set_version(connection, number)
+                applied.append(number)
+        finally:
+            if mysql:
+                connection.execute(select(func.release_lock(_LOCK_NAME)))
+                connection.commit()
+    return applied
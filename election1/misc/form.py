@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, IntegerField, DateTimeLocalField, SelectField
-from wtforms.validators import Length, DataRequired, ValidationError, InputRequired
+from wtforms import StringField, SubmitField, IntegerField, DateTimeLocalField, SelectField, BooleanField
+from wtforms.validators import Length, DataRequired, ValidationError, InputRequired, NumberRange
 from election1.models import Classgrp, Office
 from wtforms_alchemy.fields import QuerySelectField
 
@@ -17,3 +17,8 @@ class BuildTokensForm(FlaskForm):
     quarternary_grp = QuerySelectField(label='class or group', query_factory=classgrp_query, get_label='quarternary_grp')
     submit = SubmitField(label='submit')
 
+
+class IssueTokensForm(FlaskForm):
+    count = IntegerField(label='tokens', validators=[InputRequired(), NumberRange(min=1)])
+    qr = BooleanField(label='with QR codes')
+    submit = SubmitField(label='issue')
@@ -0,0 +1,113 @@
+"""
+Voter tokens in bulk.
+
+issue_tokens is the background job (jobrunner.py) of the token builder and genQR pages:
+it adds count tokens for the groups of a token selector in batches and writes their
+voter links to a CSV file, or with qr=True a zip with a QR code PNG per token and the
+same CSV.  single_token uses voter_url and qr_png for its one code.
+"""
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert
+from election1.extensions import db
+from election1.jobrunner import job_dir
+from election1.metrics import QR_RENDERS
+from election1.models import Tokenlist, Tokenlistselectors
+from election1.utils import get_token
+
+# tokens per insert and progress report, drawing a QR code takes a few milliseconds
+BATCH_SIZE = 500
+QR_BATCH_SIZE = 50
+
+
+def selector_grp_list(id_selector):
+    """
+    :return: the grp_list of a token selector, its groups joined with $, None if there is no such selector.
+    """
+    selector = Tokenlistselectors.get_tokenlistselector_by_id_as_dict(id_selector)
+    if selector is None:
+        return None
+    return '$'.join(filter(None, (selector['primary_grp'], selector['secondary_grp'],
+                                  selector['tertiary_grp'], selector['quarternary_grp'])))
+
+
+def voter_url(grp_list, token):
+    return ("http://" + current_app.config['URL_HOST'] + ":" + current_app.config['URL_PORT'] + "/cast/"
+            + grp_list + '/' + token)
+
+
+def qr_png(data):
+    """
+    :return: the PNG bytes of a QR code of data.
+    """
+    import qrcode  # qrcode pulls in Pillow, only load it when a code is drawn
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=5,
+        border=4
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color='black', back_color='white')
+    QR_RENDERS.inc()
+    img_io = io.BytesIO()
+    img.save(img_io, 'PNG')
+    return img_io.getvalue()
+
+
+def issue_tokens(job, id_selector, count, qr=False):
+    """
+    Issue count tokens for a token selector.
+    :param job: the JobContext.
+    :param qr: draw a QR code per token and return a zip instead of a CSV file.
+    :return: the name of the result file in job_dir().
+    """
+    grp_list = selector_grp_list(id_selector)
+    if grp_list is None:
+        raise ValueError(f'token selector {id_selector} does not exist')
+
+    name = f"tokens-{job.id_job}-{grp_list.replace('$', '_')}.{'zip' if qr else 'csv'}"
+    path = os.path.join(job_dir(), name)
+    batch_size = QR_BATCH_SIZE if qr else BATCH_SIZE
+    links = io.StringIO()
+    writer = csv.writer(links)
+    writer.writerow(('grp_list', 'token', 'url'))
+
+    issued = 0
+    archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) if qr else None
+    try:
+        job.progress(0, count, f'issuing {count} tokens for {grp_list}', force=True)
+        while issued < count:
+            now = datetime.now()
+            rows = [{'grp_list': grp_list, 'token': get_token(), 'vote_submitted_date_time': None,
+                     'creation_datetime': now} for _ in range(min(batch_size, count - issued))]
+            db.session.execute(insert(Tokenlist.__table__), rows)
+            db.session.commit()
+            for row in rows:
+                url = voter_url(grp_list, row['token'])
+                writer.writerow((grp_list, row['token'], url))
+                if archive is not None:
+                    archive.writestr(f"{issued + 1:05d}-{row['token'][:8]}.png", qr_png(url))
+                issued += 1
+            job.progress(issued, count, f'{issued} of {count} tokens issued for {grp_list}')
+        if archive is not None:
+            archive.writestr('tokens.csv', links.getvalue())
+    except Exception:
+        # the tokens issued so far stay, unprinted they are never used
+        if archive is not None:
+            archive.close()
+            os.remove(path)
+        raise
+    if archive is not None:
+        archive.close()
+    else:
+        with open(path, 'w', newline='') as file:
+            file.write(links.getvalue())
+    job.progress(issued, count, f'{issued} tokens issued for {grp_list}', force=True)
+    return name
@@ -1,17 +1,24 @@
 import base64
-from flask import url_for, flash, Blueprint, redirect, request, render_template, current_app, session
-from sqlalchemy import inspect
+from flask import url_for, flash, Blueprint, redirect, request, render_template, current_app, session, abort
 from sqlalchemy.exc import SQLAlchemyError
 from election1.models import Tokenlist, Classgrp, Tokenlistselectors
 from election1.utils import get_token
-from election1.misc.form import BuildTokensForm
+from election1.misc.form import BuildTokensForm, IssueTokensForm
 from election1.extensions import db
-import qrcode
-from io import BytesIO
+from election1 import refdata
+from election1.conditional import conditional
+from election1.misc import tokens
+from election1.misc.tokens import selector_grp_list, voter_url, qr_png
+from election1.job.form import CancelJobForm
+from election1 import jobrunner
+from election1.utils import is_user_authenticated, session_check
+from flask_login import current_user
+import logging
 
 
 
 misc = Blueprint('misc', __name__)
+logger = logging.getLogger(__name__)
 '''
 this is code to make the token list in an excel file
 
@@ -21,7 +28,7 @@ the excel file is created in the instance folder and is a url to the cast route
 def setup_tokens():
     form = BuildTokensForm()
     if request.method == 'POST':
-        print("setup_tokens post")
+        logger.debug("setup_tokens post")
 
         if not form.validate():  # This validates CSRF by default
             if 'csrf_token' in form.errors:
@@ -49,7 +56,7 @@ def setup_tokens():
         else:
             quarternary_grp = request.form.get('quarternary_grp')
 
-        print(primary_grp)
+        logger.debug('%s', primary_grp)
         new_selector = Tokenlistselectors(
             primary_grp=primary_grp,
             secondary_grp=secondary_grp,
@@ -59,6 +66,7 @@ def setup_tokens():
         try:
             db.session.add(new_selector)
             db.session.commit()
+            refdata.invalidate_tokenlistselectors()
             flash('Tokenlistselector item added successfully', category='success')
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -68,15 +76,9 @@ def setup_tokens():
 
         return redirect(url_for('misc.setup_tokens'))
     else:
-        print("setup_tokens")
+        logger.debug("setup_tokens")
 
-        inspector = inspect(db.engine)
-
-        if not inspector.has_table('tokenlistselectors'):
-            Tokenlistselectors.__table__.create(db.engine)
-
-
-        form.primary_grp.choices = Classgrp.classgrp_query()
+        form.primary_grp.choices = refdata.classgrp_choices()
         tokenlistselectors = Tokenlistselectors.query.all()
 
         return render_template("token_builder.html", form=form, tokenlistselectors=tokenlistselectors)
@@ -89,6 +91,7 @@ def delete_tokenlistselector(xid):
     try:
         db.session.delete(tokenlistselector)
         db.session.commit()
+        refdata.invalidate_tokenlistselectors()
         flash('Tokenlistselector item deleted successfully', category='success')
     except SQLAlchemyError as e:
         db.session.rollback()
@@ -99,6 +102,7 @@ def delete_tokenlistselector(xid):
 
 
 @misc.route('/genQR', methods=['GET', 'POST'])
+@conditional('tokenlistselectors')
 def genQR():
     form = BuildTokensForm()
     tokenlistselectors = Tokenlistselectors.query.all()
@@ -108,25 +112,13 @@ def genQR():
 
 @misc.route('/single_token/<int:xid>', methods=['GET','POST'])
 def single_token(xid):
-    print("single_tokens")
+    logger.debug("single_tokens")
 
     token = get_token()
 
-
-    qrtoken = Tokenlistselectors.get_tokenlistselector_by_id_as_dict(xid)
-
-    selector_values = [
-        qrtoken['primary_grp'],
-        qrtoken['secondary_grp'],
-        qrtoken['tertiary_grp'],
-        qrtoken['quarternary_grp']
-    ]
-
-
-
-    # Filter out None values and join the remaining values with $
-    selector_string = '$'.join(filter(None, selector_values))
-    print("selector string " + selector_string)
+    # the groups of the selector joined with $
+    selector_string = selector_grp_list(xid)
+    logger.debug("selector string %s", selector_string)
 
     try:
         new_tokenlist = Tokenlist(grp_list=selector_string,
@@ -136,34 +128,38 @@ def single_token(xid):
         db.session.commit()
     except SQLAlchemyError as e:
         db.session.rollback()
-        print("except " + str(e))
+        logger.error("except %s", e)
         return redirect("/homepage")
 
-    qr_data = "http://" + current_app.config['URL_HOST'] + ":" + current_app.config['URL_PORT'] + "/cast/" + selector_string + '/' + token
-    qr_data_URL = "http://" + qr_data
-
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=5,
-        border=4
-    )
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color='black', back_color='white')
-
-    img_io = BytesIO()
-    img.save(img_io, 'PNG')
-    img_io.seek(0)
+    qr_data = voter_url(selector_string, token)
+    png = qr_png(qr_data)
 
     # Clear the session
     session.clear()
 
     # Return the QR code and URL as HTML
-    qr_code_img = f'<img src="data:image/png;base64,{base64.b64encode(img_io.getvalue()).decode()}" alt="QR Code">'
+    qr_code_img = f'<img src="data:image/png;base64,{base64.b64encode(png).decode()}" alt="QR Code">'
     qr_code_url = f'<br><br><p><a href="{qr_data}" target="_blank">{qr_data}</a></p>'
     return qr_code_img + qr_code_url
     # return send_file(img_io, mimetype='image/png', as_attachment=False, download_name='qrcode.png')
 
 
-
+@misc.route('/issue_tokens/<int:xid>', methods=['POST'])
+def issue_tokens(xid):
+    """
+    Start a background job that issues a batch of tokens for a token selector, as a CSV
+    of voter links or (qr=1) a zip of QR codes.  Answers at once with the job status fragment.
+    """
+    if not is_user_authenticated() or not session_check():
+        return '<span class="text-warning">log in again to issue tokens</span>'
+    form = IssueTokensForm()
+    max_tokens = current_app.config['JOB_MAX_TOKENS']
+    if not form.validate_on_submit() or form.count.data > max_tokens:
+        # htmx only swaps in 2xx answers
+        return f'<span class="text-warning">enter from 1 to {max_tokens} tokens</span>'
+    if selector_grp_list(xid) is None:
+        abort(404)
+
+    id_job = jobrunner.submit('qr_sheet' if form.qr.data else 'issue_tokens', tokens.issue_tokens,
+                              current_user.user_so_name, id_selector=xid, count=form.count.data, qr=form.qr.data)
+    return render_template('job_status.html', job=jobrunner.get_job(id_job), cancel_form=CancelJobForm())
@@ -3,8 +3,9 @@ from sqlalchemy.orm import joinedload
 from election1.extensions import db
 from flask_login import UserMixin
 from datetime import datetime
+import time
 from election1.utils import unique_security_token
-from sqlalchemy import func
+from sqlalchemy import func, or_, and_, update, delete, select
 from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 class BallotType(db.Model):
@@ -59,6 +60,19 @@ class Classgrp(db.Model):
     def classgrp_query(cls):
         return [(c.id_classgrp, c.name) for c in cls.query.order_by(cls.sortkey).all()]
 
+    @classmethod
+    def delete_with_dependents(cls, id_classgrp):
+        """
+        Delete a class group with its candidates, their votes and its write-in candidates,
+        set based and in dependency order.  The caller commits.
+        :return: the dependent rows deleted, see Candidate.count_dependents.
+        """
+        deleted = Candidate.delete_dependents(id_classgrp=id_classgrp)
+        db.session.execute(delete(cls).where(cls.id_classgrp == id_classgrp),
+                           execution_options={'synchronize_session': False})
+        return deleted
+
+
 class BallotMeasure(db.Model):
     """
     Represents a ballot measure in the election.
@@ -115,6 +129,18 @@ class Office(db.Model):
         return cls.query.filter_by(office_title=office_title).first() is not None
 
 
+    @classmethod
+    def delete_with_dependents(cls, id_office):
+        """
+        Delete an office with its candidates, their votes and its write-in candidates,
+        set based and in dependency order.  The caller commits.
+        :return: the dependent rows deleted, see Candidate.count_dependents.
+        """
+        deleted = Candidate.delete_dependents(id_office=id_office)
+        db.session.execute(delete(cls).where(cls.id_office == id_office),
+                           execution_options={'synchronize_session': False})
+        return deleted
+
     @classmethod
     def get_ballot_type_name(cls, id_office):
         """
@@ -155,6 +181,11 @@ class Candidate(db.Model):
     id_office = db.Column(db.Integer, db.ForeignKey('office.id_office'), nullable=False)
     id_party = db.Column(db.Integer, db.ForeignKey('party.id_party'), nullable=True)
     votes = db.relationship('Votes', backref='candidate')
+    # existing databases get these from migrations.py
+    __table_args__ = (
+        db.Index('ix_candidate_classgrp_office', 'id_classgrp', 'id_office'),
+        db.Index('ix_candidate_name_classgrp', 'firstname', 'lastname', 'id_classgrp'),
+    )
 
     @classmethod
     def get_candidates_for_specific_office_by_classgrp(cls, choices_classgrp, choices_office):
@@ -168,16 +199,35 @@ class Candidate(db.Model):
 
 
     @classmethod
-    def candidate_search(cls, group):
-        return db.session.query(
+    def candidate_search(cls, group, name_prefix=None, after=None, limit=None):
+        """
+        Candidates of a group ordered by office sortkey then id, one keyset page at a time.
+        :param group: the id_classgrp to search.
+        :param name_prefix: only candidates whose first or last name starts with this text.
+        :param after: the (office sortkey, id_candidate) of the last row of the previous page.
+        :param limit: the page size, None for every row.
+        """
+        query = db.session.query(
             cls,
             Classgrp,
             Office,
             Party.party_abbreviation.label('party_abbreviation')
         ).select_from(cls).join(Classgrp).join(Office).outerjoin(Party).order_by(
-            Classgrp.sortkey, Office.sortkey
+            Classgrp.sortkey, Office.sortkey, cls.id_candidate
         ).where(Classgrp.id_classgrp == group)
 
+        if name_prefix:
+            pattern = name_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            query = query.where(or_(cls.firstname.ilike(pattern, escape='\\'),
+                                    cls.lastname.ilike(pattern, escape='\\')))
+        if after is not None:
+            office_sortkey, id_candidate = after
+            query = query.where(or_(Office.sortkey > office_sortkey,
+                                    and_(Office.sortkey == office_sortkey, cls.id_candidate > id_candidate)))
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
     @classmethod
     def check_and_insert_writein_candidate(cls, choices_classgrp, choices_office):
         existing_candidate = cls.query.filter_by(
@@ -205,13 +255,20 @@ class Candidate(db.Model):
         ).first() is not None
 
     @classmethod
-    def get_candidates_by_classgrp(cls, classgrp_id):
-        return db.session.query(
-            cls,
-            Classgrp.name.label('classgrp_name'),
-            Office.office_title.label('office_title')
-        ).join(Classgrp).join(Office).filter(cls.id_classgrp == classgrp_id).order_by(Classgrp.sortkey, Office.sortkey).all()
-
+    def known_names(cls, group, office):
+        """
+        The names a write-in for group and office may mean: its candidates, without the
+        Writein placeholder, and its registered write-in candidates.
+        :param group: the class group name.
+        :param office: the office title.
+        :return: a list of names.
+        """
+        candidates = db.session.query(cls.firstname, cls.lastname).join(Classgrp).join(Office).filter(
+            Classgrp.name == group, Office.office_title == office, cls.firstname != 'Writein')
+        writeins = db.session.query(WriteinCandidate.writein_candidate_name).join(Classgrp).join(Office).filter(
+            Classgrp.name == group, Office.office_title == office)
+        return ([' '.join(filter(None, (firstname, lastname))) for firstname, lastname in candidates]
+                + [name for name, in writeins])
 
     @classmethod
     def check_existing_candidate(cls, firstname, lastname, id_classgrp):
@@ -224,28 +281,68 @@ class Candidate(db.Model):
 
 
     @classmethod
-    def get_candidates_by_office(cls, office_id):
-        from sqlalchemy.orm import joinedload
+    def count_dependents(cls, **parent):
+        """
+        Count what deleting a class group or an office takes with it, in one query and
+        without loading a row.
+        :param parent: id_classgrp=... or id_office=...
+        :return: {'candidates': n, 'votes': n, 'writein_candidates': n}
+        """
+        candidates, writeins = cls._dependents_filters(parent)
+        candidate_ids = select(cls.id_candidate).where(candidates)
+        row = db.session.execute(select(
+            select(func.count()).select_from(cls).where(candidates).scalar_subquery(),
+            select(func.count()).select_from(Votes).where(Votes.id_candidate.in_(candidate_ids)).scalar_subquery(),
+            select(func.count()).select_from(WriteinCandidate).where(writeins).scalar_subquery(),
+        )).one()
+        return {'candidates': row[0], 'votes': row[1], 'writein_candidates': row[2]}
 
-        candidates = cls.query.options(
-            joinedload(cls.classgrp),  # Load related ClassGroup
-            joinedload(cls.office)  # Load related Office
-        ).filter_by(id_office=office_id).all()
+    @classmethod
+    def delete_dependents(cls, **parent):
+        """
+        Delete the votes, the write-in candidates and the candidates of a class group or an
+        office, one DELETE ... WHERE each, children first.  The ORM cascades would load
+        every candidate and leave its votes behind.  The caller commits.
+        :param parent: id_classgrp=... or id_office=...
+        :return: {'candidates': n, 'votes': n, 'writein_candidates': n} deleted.
+        """
+        candidates, writeins = cls._dependents_filters(parent)
+        options = {'synchronize_session': False}
+        votes = db.session.execute(
+            delete(Votes).where(Votes.id_candidate.in_(select(cls.id_candidate).where(candidates))),
+            execution_options=options).rowcount
+        writein_candidates = db.session.execute(delete(WriteinCandidate).where(writeins),
+                                                execution_options=options).rowcount
+        candidates = db.session.execute(delete(cls).where(candidates), execution_options=options).rowcount
+        return {'candidates': candidates, 'votes': votes, 'writein_candidates': writein_candidates}
+
+    @classmethod
+    def delete_with_votes(cls, id_candidate):
+        """
+        Delete a candidate and its votes, votes first, set based like delete_dependents.
+        The caller commits.
+        :return: the number of votes deleted.
+        """
+        options = {'synchronize_session': False}
+        votes = db.session.execute(delete(Votes).where(Votes.id_candidate == id_candidate),
+                                   execution_options=options).rowcount
+        db.session.execute(delete(cls).where(cls.id_candidate == id_candidate), execution_options=options)
+        return votes
+
+    @classmethod
+    def _dependents_filters(cls, parent):
+        (column, value), = parent.items()
+        return getattr(cls, column) == value, getattr(WriteinCandidate, column) == value
 
-        return [
-            {
-                "firstname": candidate.firstname,
-                "lastname": candidate.lastname,
-                "classgroup_name": candidate.classgrp.name if candidate.classgrp else "No Class Group",
-                "office_name": candidate.office.office_title if candidate.office else "No Office"
-            }
-            for candidate in candidates
-        ]
     @classmethod
     def get_summary_results(cls):
         """
         Retrieve summarized voting results grouped by class group and office.
         """
+        return cls.summary_results_query().all()
+
+    @classmethod
+    def summary_results_query(cls):
         return db.session.query(
             Classgrp.name.label('group_name'),  # record[0]
             Office.office_title.label('office_title'),  # record[1]
@@ -265,8 +362,7 @@ class Candidate(db.Model):
             Candidate.lastname,
             Candidate.id_candidate
         ) \
-            .order_by(Classgrp.sortkey, Office.sortkey, func.count(Votes.id_candidate).desc()) \
-            .all()
+            .order_by(Classgrp.sortkey, Office.sortkey, func.count(Votes.id_candidate).desc())
 
 class User(db.Model, UserMixin):
     """
@@ -323,17 +419,13 @@ class Dates(db.Model):
 
     @classmethod
     def after_start_date(cls):
-        date = cls.query.first()
-        if date:
-            start_date_time = datetime.fromtimestamp(date.start_date_time)
-            current_date_time = datetime.now()
-            return current_date_time > start_date_time
-        return False
+        from election1 import phase  # Local import to avoid circular import
+        return phase.after_start_date()
 
     @classmethod
     def check_dates(cls):
-        date = cls.query.first()
-        return date is not None
+        from election1 import phase  # Local import to avoid circular import
+        return phase.dates_are_set()
 
 
 class Votes(db.Model):
@@ -347,6 +439,18 @@ class Votes(db.Model):
     votes_writein_name = db.Column(db.String(45), nullable=True)
     creation_datetime = db.Column(db.DateTime, default=datetime.now, nullable=False)
     id_candidate = db.Column(db.Integer, db.ForeignKey('candidate.id_candidate'))
+    __table_args__ = (
+        db.Index('ix_votes_id_candidate', 'id_candidate'),
+        db.Index('ix_votes_votes_token', 'votes_token'),
+    )
+
+    @classmethod
+    def tally_version(cls):
+        """
+        The newest vote id, it changes with every ballot and is read from the primary key index.
+        :return: the largest id_votes, 0 when nobody voted.
+        """
+        return db.session.query(func.max(cls.id_votes)).scalar() or 0
 
 
 class WriteinCandidate(db.Model):
@@ -382,9 +486,11 @@ class Tokenlist(db.Model):
     grp_list = db.Column(db.String(45), nullable=False)
     token = db.Column(db.String(138), nullable=False,unique=True)
     vote_submitted_date_time = db.Column(db.DateTime, nullable=True)
+    expired_date_time = db.Column(db.DateTime, nullable=True)  # unused when voting closed, see scheduler.py
     creation_datetime = db.Column(db.DateTime, default=datetime.now, nullable=False)
-
-
+    __table_args__ = (
+        db.Index('ix_tokenlist_grp_list', 'grp_list'),
+    )
 
     def to_dict(self):
         """
@@ -412,8 +518,57 @@ class Tokenlist(db.Model):
         if token_record.vote_submitted_date_time is not None:
             # Token exists but vote has been submitted
             return {'error': 'Token has already been used'}
+        if token_record.expired_date_time is not None:
+            # Token was not used before voting closed
+            return {'error': 'Token has expired, voting is closed'}
         return token_record.to_dict()
 
+    @classmethod
+    def mark_submitted(cls, token):
+        """
+        Mark a token used, if it exists and is neither used nor expired.  The conditional
+        update locks the token row until the caller commits, so two submissions with one
+        token, or a submission and expire_unused, cannot both get it.
+        :return: True when the token was marked.
+        """
+        return db.session.execute(
+            update(cls).where(cls.token == token, cls.vote_submitted_date_time.is_(None),
+                              cls.expired_date_time.is_(None))
+            .values(vote_submitted_date_time=datetime.now()),
+            execution_options={'synchronize_session': False}).rowcount == 1
+
+    @classmethod
+    def refusal(cls, token):
+        """
+        :return: why mark_submitted did not take a token: 'missing_token', 'used' or 'expired'.
+        """
+        row = db.session.execute(select(cls.vote_submitted_date_time, cls.expired_date_time)
+                                 .where(cls.token == token)).first()
+        if row is None:
+            return 'missing_token'
+        return 'used' if row.vote_submitted_date_time is not None else 'expired'
+
+    @classmethod
+    def clear_expiry(cls):
+        """
+        Make the tokens an earlier close expired usable again.  The caller commits.
+        :return: the number of tokens.
+        """
+        return db.session.execute(
+            update(cls).where(cls.expired_date_time.isnot(None)).values(expired_date_time=None),
+            execution_options={'synchronize_session': False}).rowcount
+
+    @classmethod
+    def expire_unused(cls):
+        """
+        Mark every token not used yet as expired.  The caller commits.
+        :return: the number of tokens expired.
+        """
+        return db.session.execute(
+            update(cls).where(cls.vote_submitted_date_time.is_(None), cls.expired_date_time.is_(None))
+            .values(expired_date_time=datetime.now()),
+            execution_options={'synchronize_session': False}).rowcount
+
 class Tokenlistselectors(db.Model):
 
     id_tokenListSelector = db.Column(db.Integer, primary_key=True)
@@ -458,3 +613,229 @@ class Tokenlistselectors(db.Model):
             }
         return None
 
+
+
+class ChangeVersion(db.Model):
+    """
+    A change counter per table.  The admin write views bump it through the
+    refdata/phase invalidate functions, the ETag and Last-Modified of the conditional
+    pages are built from it (conditional.py).
+    """
+    __tablename__ = 'change_version'
+    table_name = db.Column(db.String(45), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    changed_at = db.Column(db.Float, nullable=False)  # epoch seconds of the last bump
+
+    TABLES = ('classgrp', 'office', 'candidate', 'party', 'ballot_type', 'dates', 'tokenlistselectors')
+
+    @classmethod
+    def bump(cls, *table_names):
+        """
+        Add one to the counters of table_names and commit.
+        """
+        now = time.time()
+        for table_name in table_names:
+            updated = db.session.execute(update(cls).where(cls.table_name == table_name)
+                                         .values(version=cls.version + 1, changed_at=now)).rowcount
+            if not updated:
+                db.session.add(cls(table_name=table_name, version=1, changed_at=now))
+        db.session.commit()
+
+    @classmethod
+    def get_versions(cls):
+        """
+        :return: {table_name: (version, changed_at)} of every table, in one query.
+        """
+        return {row.table_name: (row.version, row.changed_at)
+                for row in db.session.query(cls.table_name, cls.version, cls.changed_at)}
+
+
+class Job(db.Model):
+    """
+    A background job of jobrunner.py.  The row is its durable status: the admin pages
+    poll it, the job writes its progress to it and reads cancel_requested from it.
+    """
+    __tablename__ = 'job'
+    id_job = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(45), nullable=False)
+    status = db.Column(db.String(16), default='queued', nullable=False)
+    done = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.String(255), nullable=True)
+    result_file = db.Column(db.String(255), nullable=True)  # in JOB_DIR, offered for download
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    created_by = db.Column(db.String(30), nullable=True)
+    creation_datetime = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    finished_datetime = db.Column(db.DateTime, nullable=True)
+    heartbeat = db.Column(db.Float, nullable=False)  # epoch seconds of the last status write
+
+    FINISHED = ('done', 'failed', 'cancelled')
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED
+
+    @property
+    def percent(self):
+        if self.status == 'done':
+            return 100
+        if not self.total:
+            return 0
+        return min(100, int(self.done * 100 / self.total))
+
+    @classmethod
+    def recent(cls, kind, limit=5):
+        """
+        :return: the newest jobs of kind, newest first.
+        """
+        return cls.query.filter_by(kind=kind).order_by(cls.id_job.desc()).limit(limit).all()
+
+    @classmethod
+    def fail_stale(cls, stale_seconds):
+        """
+        Mark the unfinished jobs whose heartbeat stopped as failed, their worker was
+        replaced or stopped while they were queued or running.  The caller commits.
+        :return: the number of jobs marked.
+        """
+        return db.session.execute(
+            update(cls).where(cls.status.in_(('queued', 'running')), cls.heartbeat < time.time() - stale_seconds)
+            .values(status='failed', message='interrupted, the worker running it stopped',
+                    finished_datetime=datetime.now()),
+            execution_options={'synchronize_session': False}).rowcount
+
+
+class ElectionTransition(db.Model):
+    """
+    The lock row of a scheduled election transition (scheduler.py), one per transition
+    and election window.  The worker whose insert succeeds runs the transition, the
+    others read its status.
+    """
+    __tablename__ = 'election_transition'
+    id_election_transition = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(16), nullable=False)  # 'open' or 'close'
+    start_date_time = db.Column(db.Integer, nullable=False)  # the Dates window it is for
+    end_date_time = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), default='running', nullable=False)
+    attempts = db.Column(db.Integer, default=1, nullable=False)
+    claimed_by = db.Column(db.String(64), nullable=False)  # host:pid of the worker running it
+    heartbeat = db.Column(db.Float, nullable=False)  # epoch seconds of the last status write
+    message = db.Column(db.String(255), nullable=True)
+    creation_datetime = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    finished_datetime = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.UniqueConstraint('name', 'start_date_time', 'end_date_time', name='uq_election_transition_window'),
+    )
+
+    @classmethod
+    def _window_filter(cls, name, start, end):
+        return and_(cls.name == name, cls.start_date_time == start, cls.end_date_time == end)
+
+    @classmethod
+    def claim(cls, name, start, end, worker, stale_seconds, max_attempts):
+        """
+        Take the lock row of a transition: insert it, or take over a failed run or one
+        whose worker stopped beating for stale_seconds, up to max_attempts runs.  Commits.
+        :return: True when worker is to run the transition.
+        """
+        now = time.time()
+        db.session.add(cls(name=name, start_date_time=start, end_date_time=end, claimed_by=worker,
+                           heartbeat=now))
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+        taken = db.session.execute(
+            update(cls).where(cls._window_filter(name, start, end), cls.attempts < max_attempts,
+                              or_(cls.status == 'failed',
+                                  and_(cls.status == 'running', cls.heartbeat < now - stale_seconds)))
+            .values(status='running', attempts=cls.attempts + 1, claimed_by=worker, heartbeat=now,
+                    message=None, finished_datetime=None),
+            execution_options={'synchronize_session': False}).rowcount
+        db.session.commit()
+        return taken == 1
+
+    @classmethod
+    def get(cls, name, start, end):
+        return cls.query.filter(cls._window_filter(name, start, end)).first()
+
+    @classmethod
+    def for_window(cls, start, end):
+        """
+        :return: the transitions run for an election window, by name.
+        """
+        return {row.name: row for row in
+                cls.query.filter(cls.start_date_time == start, cls.end_date_time == end).all()}
+
+    @classmethod
+    def delete_window(cls, start, end):
+        """
+        Forget the transitions run for an election window, they run again.  The caller commits.
+        """
+        db.session.execute(delete(cls).where(cls.start_date_time == start, cls.end_date_time == end),
+                           execution_options={'synchronize_session': False})
+
+    @classmethod
+    def finish(cls, name, start, end, status, message=None):
+        """
+        Record the outcome of a transition.  The caller commits.
+        """
+        db.session.execute(
+            update(cls).where(cls._window_filter(name, start, end))
+            .values(status=status, message=message[:255] if message else None, heartbeat=time.time(),
+                    finished_datetime=datetime.now()),
+            execution_options={'synchronize_session': False})
+
+
+class FinalTally(db.Model):
+    """
+    The votes of each candidate as counted once when voting closed (scheduler.py), with
+    the winners marked.  The results pages read it instead of counting again.
+    """
+    __tablename__ = 'final_tally'
+    id_final_tally = db.Column(db.Integer, primary_key=True)
+    start_date_time = db.Column(db.Integer, nullable=False)  # the Dates window it is for
+    end_date_time = db.Column(db.Integer, nullable=False)
+    classgrp_name = db.Column(db.String(45), nullable=False)
+    office_title = db.Column(db.String(45), nullable=False)
+    vote_for = db.Column(db.Integer, nullable=False)
+    id_candidate = db.Column(db.Integer, nullable=False)
+    firstname = db.Column(db.String(45), nullable=False)
+    lastname = db.Column(db.String(45), nullable=False)
+    votes = db.Column(db.Integer, nullable=False)
+    winner = db.Column(db.Boolean, default=False, nullable=False)
+    creation_datetime = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    __table_args__ = (
+        db.Index('ix_final_tally_window', 'start_date_time', 'end_date_time'),
+    )
+
+    @classmethod
+    def record(cls, start, end, candidates):
+        """
+        Replace the tally of an election window.  The caller commits.
+        :param candidates: CandidateDataClass objects in results order, with winner set.
+        """
+        cls.delete_window(start, end)
+        now = datetime.now()
+        rows = [{'start_date_time': start, 'end_date_time': end, 'classgrp_name': c.classgrp_name,
+                 'office_title': c.office_title, 'vote_for': c.vote_for, 'id_candidate': c.id_candidate,
+                 'firstname': c.firstname, 'lastname': c.lastname, 'votes': c.nbr_of_votes,
+                 'winner': bool(c.winner), 'creation_datetime': now} for c in candidates]
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def delete_window(cls, start, end):
+        """
+        Delete the tally of an election window.  The caller commits.
+        """
+        db.session.execute(delete(cls).where(cls.start_date_time == start, cls.end_date_time == end),
+                           execution_options={'synchronize_session': False})
+
+    @classmethod
+    def for_window(cls, start, end):
+        """
+        :return: the tally rows of an election window in results order, empty when it was not counted.
+        """
+        return cls.query.filter_by(start_date_time=start, end_date_time=end) \
+            .order_by(cls.id_final_tally).all()
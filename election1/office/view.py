@@ -2,6 +2,8 @@ from flask import (render_template, url_for, flash, redirect, request, Blueprint
 from election1.office.form import (OfficeForm)
 from election1.models import Office, Candidate, Dates, BallotType
 from election1.extensions import db
+from election1 import refdata
+from election1.conditional import conditional
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from election1.utils import is_user_authenticated, session_check
@@ -25,6 +27,7 @@ def check_session_timeout():
 
 
 @office.route('/office', methods=['POST', 'GET'])
+@conditional('office', 'ballot_type', 'dates')
 def office_view():
     logger.info('user ' + str(current_user.user_so_name) + " has entered office page")
 
@@ -48,7 +51,7 @@ def office_view():
                 flash('CSRF validation failed', category='danger')
                 # office_form, offices = prepare_office_form()
                 offices = Office.query.order_by(Office.sortkey)
-                office_form.ballot_type.choices = BallotType.get_all_ballot_types_sorted_by_name()
+                office_form.ballot_type.choices = refdata.ballot_type_choices()
                 return render_template('office.html', form=office_form, offices=offices)
 
         office_title = request.form['office_title']
@@ -66,6 +69,7 @@ def office_view():
         try:
             db.session.add(new_office)
             db.session.commit()
+            refdata.invalidate_offices()
             logger.info(
                 'user ' + str(current_user.user_so_name) + ' has created the office titled ' + office_title)
             flash('successfully inserted record', category='success')
@@ -86,7 +90,7 @@ def office_view():
             logger.info('There is an error ' + str(e) + ' while creating the office titled ' + office_title)
             # office_form, offices = prepare_office_form()
             offices = Office.query.order_by(Office.sortkey)
-            office_form.ballot_type.choices = BallotType.get_all_ballot_types_sorted_by_name()
+            office_form.ballot_type.choices = refdata.ballot_type_choices()
             return render_template('office.html', form=office_form, offices=offices)
 
     office_form, offices = prepare_office_form()
@@ -99,7 +103,7 @@ def prepare_office_form():
     office_form.office_title.data = None
     office_form.office_vote_for.data = None
     office_form.sortkey.data = None
-    office_form.ballot_type.choices = BallotType.get_all_ballot_types_sorted_by_name()
+    office_form.ballot_type.choices = refdata.ballot_type_choices()
     # Query offices with their related BallotType records
     offices = Office.query.options(joinedload(Office.ballot_type)).order_by(Office.sortkey).all()
 
@@ -120,7 +124,7 @@ def deleteoffice(xid):
         flash('You cannot delete an office after the voting start time or Election Dates are empty ', category='danger')
         return redirect(url_for('mains.homepage'))
 
-    office_to_delete = Office.query.get(xid)
+    office_to_delete = Office.query.get_or_404(xid)
     form = OfficeForm()
 
     if request.method == 'POST':
@@ -129,14 +133,17 @@ def deleteoffice(xid):
                 flash('CSRF validation failed', category='danger')
                 # office_form, offices = prepare_office_form()
                 offices = Office.query.order_by(Office.sortkey)
-                form.ballot_type.choices = BallotType.get_all_ballot_types_sorted_by_name()
+                form.ballot_type.choices = refdata.ballot_type_choices()
                 return render_template('office.html', form=form, offices=offices)
+        # the row is gone after the commit
+        office_title = office_to_delete.office_title
         try:
-            db.session.delete(office_to_delete)
+            deleted = Office.delete_with_dependents(xid)
             db.session.commit()
-            logger.info(
-                'user ' + str(
-                    current_user.user_so_name) + ' has deleted the office titled ' + office_to_delete.office_title)
+            refdata.invalidate_offices()
+            refdata.invalidate_candidates()
+            logger.info('user %s has deleted the office titled %s with %s', current_user.user_so_name,
+                        office_title, deleted)
             flash('successfully deleted record', category='success')
             return redirect('/office')
         except SQLAlchemyError as e:
@@ -144,8 +151,8 @@ def deleteoffice(xid):
             flash('There was a problem deleting record' + str(e))
             return redirect('/office')
     else:
-        candidates = Candidate.get_candidates_by_office(xid)
-        return render_template('office_candidate_delete.html', form=form, candidates=candidates,
+        counts = Candidate.count_dependents(id_office=xid)
+        return render_template('office_candidate_delete.html', form=form, counts=counts,
                                office_to_delete=office_to_delete)
 
 
@@ -172,7 +179,7 @@ def updateoffice(xid):
                 flash('CSRF validation failed', category='danger')
                 # office_form, offices = prepare_office_form()
                 offices = Office.query.order_by(Office.sortkey)
-                office_form.ballot_type.choices = BallotType.get_all_ballot_types_sorted_by_name()
+                office_form.ballot_type.choices = refdata.ballot_type_choices()
                 return render_template('office.html', form=office_form, offices=offices)
         office_to_update.office_title = request.form['office_title']
         office_to_update.sortkey = request.form['sortkey']
@@ -181,6 +188,8 @@ def updateoffice(xid):
 
         try:
             db.session.commit()
+            refdata.invalidate_offices()
+            refdata.invalidate_candidates()
             logger.info(
                 'user ' + str(
                     current_user.user_so_name) + ' has edited the office titled ' + office_to_update.office_title)
@@ -197,13 +206,13 @@ def updateoffice(xid):
                 flash('you must select a Ballot Type.', category='danger')
             else:
                 flash(f'An error occurred: copy and send to admin \r\n{e}', category='danger')
-            office_form.ballot_type.choices = BallotType.get_all_ballot_types_sorted_by_name()
+            office_form.ballot_type.choices = refdata.ballot_type_choices()
             return render_template('update_office.html', form=office_form,
                                    office_to_update=office_to_update, )
 
 
 
     else:
-        office_form.ballot_type.choices = BallotType.get_all_ballot_types_sorted_by_name()
+        office_form.ballot_type.choices = refdata.ballot_type_choices()
         return render_template('update_office.html', form=office_form,
                                office_to_update=office_to_update,)
@@ -0,0 +1,111 @@
+"""
+The election phase, worked out from the single Dates row.
+
+The Dates row is read once and kept in reference_cache, so the admin views and the vote
+path can check the election window without a query.  dates_view and deletedates call
+invalidate_election_window() after they change the row, the scheduler of each worker
+runs the open and close transitions at the window's edges (scheduler.py).
+
+    not configured  no Dates row
+    setup           before start_date_time, groups/offices/candidates can be edited
+    voting          between start_date_time and end_date_time
+    closed          after end_date_time
+"""
+import time
+from dataclasses import dataclass
+
+from flask import current_app
+from election1.cache import reference_cache
+
+NOT_CONFIGURED = 'not configured'
+SETUP = 'setup'
+VOTING = 'voting'
+CLOSED = 'closed'
+
+
+@dataclass(frozen=True)
+class ElectionWindow:
+    start: int = None  # epoch seconds, as stored in Dates
+    end: int = None
+
+    @property
+    def configured(self):
+        return self.start is not None
+
+
+def _load_window():
+    from election1.models import Dates  # Local import to avoid circular import
+    date = Dates.query.first()
+    if date is None:
+        return ElectionWindow()
+    return ElectionWindow(date.start_date_time, date.end_date_time)
+
+
+def election_window():
+    """
+    :return: the cached ElectionWindow, unconfigured when there is no Dates row.
+    """
+    return reference_cache.get_or_load(('dates',), _load_window, current_app.config.get('REFERENCE_CACHE_TTL'))
+
+
+def refresh_election_window():
+    """
+    Read the Dates row again and cache it, for the scheduler (scheduler.py) which must not
+    wait REFERENCE_CACHE_TTL to see a change made on another worker.
+    :return: the current ElectionWindow.
+    """
+    window = _load_window()
+    reference_cache.set(('dates',), window, current_app.config.get('REFERENCE_CACHE_TTL'))
+    return window
+
+
+def invalidate_election_window():
+    from election1.refdata import bump_versions  # Local import to avoid circular import
+    reference_cache.invalidate('dates')
+    bump_versions('dates')
+
+
+def current_phase(now=None):
+    """
+    :param now: epoch seconds, defaults to the current time.
+    :return: one of NOT_CONFIGURED, SETUP, VOTING or CLOSED.
+    """
+    window = election_window()
+    if not window.configured:
+        return NOT_CONFIGURED
+    now = time.time() if now is None else now
+    if now <= window.start:
+        return SETUP
+    if now < window.end:
+        return VOTING
+    return CLOSED
+
+
+def seconds_to_next_transition(now=None):
+    """
+    :return: seconds until voting opens or closes, None when not configured or already closed.
+    """
+    window = election_window()
+    now = time.time() if now is None else now
+    phase = current_phase(now)
+    if phase == SETUP:
+        return window.start - now
+    if phase == VOTING:
+        return window.end - now
+    return None
+
+
+def dates_are_set():
+    return election_window().configured
+
+
+def after_start_date():
+    return current_phase() in (VOTING, CLOSED)
+
+
+def voting_open():
+    return current_phase() == VOTING
+
+
+def voting_closed():
+    return current_phase() == CLOSED
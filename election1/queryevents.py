@@ -0,0 +1,54 @@
+"""
+One timing hook on the SQLAlchemy cursor events, shared by the request metrics
+(metrics.py) and the development SQL profiler (sqlprofiler.py).
+
+The engine wide listeners are registered once, time every statement once and call each
+subscriber with the statement and its duration:
+
+    def _count_query(statement, elapsed):
+        ...
+
+    queryevents.subscribe(_count_query)
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def subscribe(callback):
+    """
+    Call callback(statement, elapsed seconds) after every statement on any engine, once
+    per callback however often it is subscribed.
+    """
+    with _lock:
+        if not _subscribers:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    for callback in _subscribers:
+        callback(statement, elapsed)
+
+
+def _handle_error(context):
+    # a failed statement gets no after_cursor_execute, drop its start time
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
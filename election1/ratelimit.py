@@ -0,0 +1,206 @@
+"""
+Admission control for the voting and login endpoints.
+
+Every limited request takes one token from each bucket its scope has in RATELIMIT_RULES:
+per voting token on the vote pages (per client IP only with RATELIMIT_VOTE_IP, a class
+behind one school NAT shares an address) and per client IP for the login posts.  A
+bucket holds up to `burst` tokens and refills at `rate` tokens a second, so a class
+scanning QR codes at once gets through while a client stuck in a retry loop is slowed
+down.  The ballot write path is also
+capped to BALLOT_WRITE_SLOTS_PER_WORKER requests at a time per worker process so SQLite
+is not swamped by writers; the cap is per process, the server as a whole writes up to
+that many times its number of workers.
+
+Rejected voters get please_wait.html (HTTP 429) which retries the same request by
+itself after a short delay instead of timing out.
+
+Behind a reverse proxy set PROXY_FIX_X_FOR to the number of trusted proxies, otherwise
+every voter has the proxy's address and shares one ip bucket (the login's, and the
+vote pages' with RATELIMIT_VOTE_IP).
+
+Buckets live in process memory.  Set RATELIMIT_STORAGE_URI to a redis:// url to share
+them between worker processes (needs the redis package), the ballot write slots always
+stay per process.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request, session, render_template, make_response
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in a dict, the least recently used keys are dropped past max_keys.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """
+        Take one token from the bucket of key.
+        :return: 0 if the request may go ahead, otherwise the seconds until a token is available.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBucketStore:
+    """
+    The same token buckets kept in redis so every worker process shares them.
+    """
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+    local tokens = tonumber(bucket[1]) or burst
+    local last = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis  # only needed when the limiter state is shared
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        return float(self._take(keys=['ratelimit:' + key], args=[rate, burst, now]))
+
+
+class RateLimiter:
+    """
+    Flask extension holding the bucket store and the ballot write semaphore.
+    """
+
+    def __init__(self, app=None):
+        self.store = None
+        self._ballot_slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        uri = app.config.get('RATELIMIT_STORAGE_URI', 'memory://')
+        if uri.startswith('redis://') or uri.startswith('rediss://'):
+            self.store = RedisBucketStore(uri)
+        else:
+            self.store = MemoryBucketStore()
+        self._ballot_slots = threading.BoundedSemaphore(app.config.get('BALLOT_WRITE_SLOTS_PER_WORKER', 4))
+        app.extensions['ratelimit'] = self
+
+    def check(self, scope):
+        """
+        Take a token from each bucket of the current request for scope.
+        :return: 0 if the request is admitted, otherwise the seconds to wait.
+        """
+        rules = current_app.config['RATELIMIT_RULES'].get(scope, {})
+        wait = 0
+        for key_name, (rate, burst) in rules.items():
+            key = _request_key(key_name)
+            if key is None:
+                continue
+            try:
+                wait = max(wait, self.store.take(f'{scope}:{key_name}:{key}', rate, burst))
+            except Exception as e:
+                # a broken shared store must not stop the election
+                logger.error('rate limit store failed, request admitted: %s', e)
+        return wait
+
+    @contextmanager
+    def ballot_slot(self):
+        """
+        Hold one of this process's BALLOT_WRITE_SLOTS_PER_WORKER slots, yields False if none freed up in time.
+        """
+        acquired = self._ballot_slots.acquire(timeout=current_app.config.get('BALLOT_WRITE_WAIT', 2))
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._ballot_slots.release()
+
+    def limit(self, scope, repost=True, methods=None):
+        """
+        Decorator that answers with the please wait page when scope is over its limit.
+        :param scope: a key of the RATELIMIT_RULES setting.
+        :param repost: if the please wait page may post the same form again (not for the login).
+        :param methods: the request methods that are charged, default all.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if current_app.config.get('RATELIMIT_ENABLED', True) \
+                        and (methods is None or request.method in methods):
+                    wait = self.check(scope)
+                    if wait > 0:
+                        logger.info('rate limit %s hit by %s, retry in %.1fs', scope, request.remote_addr, wait)
+                        return please_wait(wait, repost)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def ballot_writer(self, view):
+        """
+        Decorator that lets BALLOT_WRITE_SLOTS_PER_WORKER requests of this process into view at a time.
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get('RATELIMIT_ENABLED', True):
+                return view(*args, **kwargs)
+            with self.ballot_slot() as acquired:
+                if not acquired:
+                    logger.info('ballot write slots busy, %s asked to retry', request.remote_addr)
+                    return please_wait(current_app.config.get('BALLOT_WRITE_WAIT', 2), True)
+                return view(*args, **kwargs)
+        return wrapper
+
+
+def _request_key(key_name):
+    if key_name == 'ip':
+        return request.remote_addr
+    if key_name == 'token':
+        # the token is in the cast url, later pages find it in the session
+        token = (request.view_args or {}).get('token')
+        if token is None:
+            token = session.get('token_list_record', {}).get('token')
+        return token
+    return None
+
+
+def please_wait(retry_after, repost):
+    retry_after = max(1, int(retry_after + 0.999))
+    fields = list(request.form.items(multi=True)) if repost and request.method == 'POST' else []
+    response = make_response(render_template('please_wait.html', retry_after=retry_after,
+                                             repost=repost and request.method == 'POST',
+                                             fields=fields, url=request.url), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,166 @@
+"""
+Cached access to the reference data used to build the admin select lists.
+
+The admin views read class groups, offices, parties and ballot types on almost every
+render.  The values are kept in reference_cache and the create/update/delete views call
+the invalidate_* functions after a successful commit so the next render reloads them.
+The REFERENCE_CACHE_TTL setting bounds how stale another worker process can be.
+invalidate_candidates drops the cached candidate search pages kept in fragment_cache,
+it and the class group, office and ballot type invalidations drop the ballot candidate
+lists of vote.view.ballot_choices and the office lists of vote.view.ballot_offices.
+Candidate, class group and office changes also drop the write-in name indexes of
+suggest.py, a write-in registration only adds its name.
+Every invalidate_* also bumps the ChangeVersion counter of its table, which the other
+workers and the browsers see through the ETags of conditional.py.
+"""
+import logging
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from election1 import suggest
+from election1.cache import reference_cache, fragment_cache
+from election1.extensions import db
+from election1.models import Classgrp, Office, Party, BallotType, ChangeVersion
+
+logger = logging.getLogger(__name__)
+
+
+def _ttl():
+    return current_app.config.get('REFERENCE_CACHE_TTL')
+
+
+def classgrp_choices():
+    """
+    :return: a list of (id_classgrp, name) ordered by sortkey.
+    """
+    return reference_cache.get_or_load(('classgrp',), Classgrp.classgrp_query, _ttl())
+
+
+def office_choices():
+    """
+    :return: a list of (id_office, office_title, ballot_type_name) ordered by sortkey.
+    """
+    return reference_cache.get_or_load(('office',), Office.office_query, _ttl())
+
+
+def party_choices():
+    """
+    :return: a tuple of (id_party, party_name) ordered by party_name.
+    """
+    return reference_cache.get_or_load(('party',), Party.get_all_parties_ordered_by_name, _ttl())
+
+
+def ballot_type_choices():
+    """
+    :return: a tuple of (id_ballot_type, ballot_type_name) ordered by id.
+    """
+    return reference_cache.get_or_load(('ballot_type',), BallotType.get_all_ballot_types_sorted_by_name, _ttl())
+
+
+def classgrp_name(id_classgrp):
+    """
+    :param id_classgrp: the class group id, as an int or the string posted by a form.
+    :return: the class group name if found, otherwise None.
+    """
+    for classgrp_id, name in classgrp_choices():
+        if str(classgrp_id) == str(id_classgrp):
+            return name
+    return None
+
+
+def office_title(id_office):
+    """
+    :param id_office: the office id, as an int or the string posted by a form.
+    :return: the office title if found, otherwise None.
+    """
+    for office_id, title, ballot_type_name in office_choices():
+        if str(office_id) == str(id_office):
+            return title
+    return None
+
+
+def office_ballot_type_name(id_office):
+    """
+    Look up the ballot_type_name of an office from office_choices instead of the database.
+    :param id_office: the office id, as an int or the string posted by a form.
+    :return: The ballot_type_name if found, otherwise None.
+    """
+    for office_id, office_title, ballot_type_name in office_choices():
+        if str(office_id) == str(id_office):
+            return ballot_type_name
+    return None
+
+
+def bump_versions(*table_names):
+    """
+    Bump the ChangeVersion counters, a failure is logged and does not undo the change it follows.
+    """
+    try:
+        ChangeVersion.bump(*table_names)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error('could not bump the change versions of %s: %s', table_names, e)
+
+
+def invalidate_ballots():
+    # keyed by group name and office title, a change of either leaves stale keys behind
+    fragment_cache.invalidate('ballot')
+    reference_cache.invalidate('ballot_offices')
+
+
+def invalidate_classgrps():
+    reference_cache.invalidate('classgrp')
+    invalidate_ballots()
+    suggest.invalidate()
+    bump_versions('classgrp')
+
+
+def invalidate_offices():
+    reference_cache.invalidate('office')
+    invalidate_ballots()
+    suggest.invalidate()
+    bump_versions('office')
+
+
+def invalidate_parties():
+    reference_cache.invalidate('party')
+    bump_versions('party')
+
+
+def invalidate_ballot_types():
+    # office_choices carries the ballot type name so it goes stale as well
+    reference_cache.invalidate('ballot_type')
+    reference_cache.invalidate('office')
+    invalidate_ballots()
+    bump_versions('ballot_type', 'office')
+
+
+def invalidate_tokenlistselectors():
+    bump_versions('tokenlistselectors')
+
+
+def invalidate_candidates(id_classgrp=None):
+    """
+    Drop the cached candidate search pages of a group, or of every group when id_classgrp is None,
+    the ballot candidate lists and the write-in name indexes.
+    """
+    _invalidate_candidate_pages(id_classgrp)
+    suggest.invalidate()
+
+
+def add_writein_candidate(id_classgrp, id_office, name):
+    """
+    After a write-in registration: the candidate pages go as with invalidate_candidates,
+    the write-in name index of the group and office gains the name instead of being rebuilt.
+    """
+    _invalidate_candidate_pages(id_classgrp)
+    suggest.add_name(classgrp_name(id_classgrp), office_title(id_office), name)
+
+
+def _invalidate_candidate_pages(id_classgrp):
+    bump_versions('candidate')
+    invalidate_ballots()
+    if id_classgrp is None:
+        fragment_cache.invalidate('candidate_search')
+    else:
+        fragment_cache.invalidate('candidate_search', int(id_classgrp))
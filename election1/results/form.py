@@ -4,7 +4,14 @@ from wtforms import SubmitField
 from election1.models import Classgrp
 
 
+def classgrp_query():
+    return Classgrp.query.order_by(Classgrp.sortkey)
+
+
 class  VoteResults(FlaskForm):
-    choices_classgrp = QuerySelectField(label='class or group', query_factory=Classgrp.classgrp_query, get_label='name')
+    choices_classgrp = QuerySelectField(label='class or group', query_factory=classgrp_query, get_label='name')
     submit = SubmitField(label='submit')
 
+
+class ExportResults(FlaskForm):
+    submit = SubmitField(label='export the results')
@@ -1,11 +1,21 @@
+import csv
+import os
 from datetime import datetime
 from flask import Blueprint, request, render_template
-from election1.models import Classgrp, Office, Candidate, Tokenlist, Votes, Dates
-from election1.vote.form import  VoteResults
+from flask_login import current_user
+from election1.models import Classgrp, Office, Candidate, Tokenlist, Votes, Dates, FinalTally, ChangeVersion
+from election1.results.form import VoteResults, ExportResults
+from election1.job.form import CancelJobForm
+from election1 import jobrunner
+from election1.utils import is_user_authenticated, session_check
 from election1.dclasses import CandidateDataClass
+from election1 import refdata, phase
+from election1.conditional import conditional
 from collections import defaultdict
+import logging
 
 results = Blueprint('results', __name__)
+logger = logging.getLogger(__name__)
 
 class CandidateDataClassSingleton:
     _instance = None
@@ -21,16 +31,81 @@ class CandidateDataClassSingleton:
             cls._instance = object.__new__(cls)  # Use `object.__new__` to avoid recursion
         return cls._instance
 
-    def set_candidates(self, candidates: list[CandidateDataClass]):
+    _tally_key = None
+
+    def set_candidates(self, candidates: list[CandidateDataClass], tally_key=None):
         self._candidates = candidates
-        print('CandidateDataClassSingleton set_candidates')
+        self._tally_key = tally_key
+        logger.debug('CandidateDataClassSingleton set_candidates')
 
     def get_candidates(self) -> list[CandidateDataClass]:
-        print('CandidateDataClassSingleton get_candidates')
+        logger.debug('CandidateDataClassSingleton get_candidates')
         return self._candidates
 
+    def is_current(self, tally_key):
+        return self._tally_key is not None and self._tally_key == tally_key
+
+
+# the tables whose changes the tally shows besides the votes
+TALLY_TABLES = ('classgrp', 'office', 'candidate')
+
+
+def tally_key():
+    """
+    :return: what the tally depends on: the newest vote id and the ChangeVersion of the
+    groups, offices and candidates, which also covers a candidate deleted with its votes.
+    """
+    versions = ChangeVersion.get_versions()
+    return (Votes.tally_version(),) + tuple(versions.get(table, (0, 0))[0] for table in TALLY_TABLES)
+
+
+def load_candidates():
+    """
+    Tally the votes into the singleton, together with the tally key they are for.
+    Once voting closed the final tally the scheduler recorded is read instead.
+    """
+    key = tally_key()
+    candidates = final_tally() if phase.voting_closed() else []
+    if not candidates:
+        candidates = count_votes()
+
+    # Set the candidates in the singleton
+    CandidateDataClassSingleton().set_candidates(candidates, key)
+    return candidates
+
+
+def count_votes():
+    """
+    :return: the vote total of every candidate with votes, in results order, winners marked.
+    """
+    summary_results = Candidate.get_summary_results()
+    logger.debug('summary_results %s', summary_results)
+
+    candidates = [create_candidate_dataclass(item) for item in summary_results]
+    logger.debug('candidates %s', candidates)
+    mark_winner(candidates)
+    return candidates
+
+
+def final_tally():
+    """
+    :return: the candidates of the final tally of the current election window, empty when
+    it has not been recorded (see scheduler.py).
+    """
+    window = phase.election_window()
+    candidates = []
+    for row in FinalTally.for_window(window.start, window.end):
+        candidate = CandidateDataClass(id_candidate=row.id_candidate, firstname=row.firstname,
+                                       lastname=row.lastname, classgrp_name=row.classgrp_name,
+                                       office_title=row.office_title, vote_for=row.vote_for,
+                                       nbr_of_votes=row.votes)
+        candidate.winner = row.winner
+        candidates.append(candidate)
+    return candidates
+
 
 @results.route('/vote_results', methods=['GET'])
+@conditional('classgrp', 'office', 'candidate', tally=True)
 def vote_results():
 
     # if not date_after():
@@ -39,18 +114,9 @@ def vote_results():
     #     return redirect(url_for('mains.homepage'))
 
     form = VoteResults()
-    form.choices_classgrp.choices = Classgrp.classgrp_query()
-    print('form.choices_classgrp.choices ' + str(form.choices_classgrp.choices))
-    summary_results = Candidate.get_summary_results()
-    print('summary_results ' + str(summary_results))
-
-    candidates = [create_candidate_dataclass(item) for item in summary_results]
-    print('candidates ' + str(candidates))
-    mark_winner(candidates)
-
-    # Set the candidates in the singleton
-    candidate_singleton = CandidateDataClassSingleton()
-    candidate_singleton.set_candidates(candidates)
+    form.choices_classgrp.choices = refdata.classgrp_choices()
+    logger.debug('form.choices_classgrp.choices %s', form.choices_classgrp.choices)
+    load_candidates()
 
 
 
@@ -59,8 +125,8 @@ def vote_results():
 
 
 def create_candidate_dataclass(record):
-    print('create_candidate_dataclass record ' + str(record))
-    print('IN CCD')
+    logger.debug('create_candidate_dataclass record %s', record)
+    logger.debug('IN CCD')
     return CandidateDataClass(
         id_candidate=record[5],
         firstname=record[3],
@@ -100,48 +166,63 @@ def mark_winner(candidates: list[CandidateDataClass]) -> list[CandidateDataClass
 
 
 @results.route('/vote_results/search', methods=['GET'])
+@conditional('classgrp', 'office', 'candidate', tally=True)
 def vote_results_search():
     group = request.args.get('choices_classgrp', type=str)
 
-    # Get the candidates from the singleton
+    # Get the candidates from the singleton, this worker may not have rendered
+    # vote_results (a 304, another worker) or votes came in since
     candidate_singleton = CandidateDataClassSingleton()
-    candidates = candidate_singleton.get_candidates()
+    if candidate_singleton.is_current(tally_key()):
+        candidates = candidate_singleton.get_candidates()
+    else:
+        candidates = load_candidates()
 
     results = filter_candidates_by_classgrp(candidates, group)
 
     return render_template('vote_classgrp_results.html', results=results)
 
+@results.route('/vote_results/export', methods=['POST'])
+def vote_results_export():
+    """
+    Start the results_export job, answers at once with the job status fragment.
+    """
+    if not is_user_authenticated() or not session_check():
+        return '<span class="text-warning">log in again to export the results</span>'
+    form = ExportResults()
+    if not form.validate_on_submit():
+        return '<span class="text-warning">the page expired, reload it</span>'
+    id_job = jobrunner.submit('results_export', export_results, current_user.user_so_name)
+    return render_template('job_status.html', job=jobrunner.get_job(id_job), cancel_form=CancelJobForm())
+
+
+def export_results(job):
+    """
+    The results_export job: count the votes again and write every candidate's total and
+    whether they won to a CSV file.
+    :return: the name of the result file in jobrunner.job_dir().
+    """
+    job.progress(0, message='counting the votes', force=True)
+    candidates = load_candidates()
+    name = f'results-{job.id_job}.csv'
+    with open(os.path.join(jobrunner.job_dir(), name), 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('group', 'office', 'vote_for', 'firstname', 'lastname', 'votes', 'winner'))
+        for n, candidate in enumerate(candidates, start=1):
+            writer.writerow((candidate.classgrp_name, candidate.office_title, candidate.vote_for,
+                             candidate.firstname, candidate.lastname, candidate.nbr_of_votes,
+                             'yes' if candidate.winner else ''))
+            job.progress(n, len(candidates))
+    job.progress(len(candidates), len(candidates), f'{len(candidates)} candidates written', force=True)
+    return name
+
+
 def filter_candidates_by_classgrp(candidates: list[CandidateDataClass], classgrp_name: str) -> list[CandidateDataClass]:
     return [candidate for candidate in candidates if candidate.classgrp_name == classgrp_name]
 
 def date_between():
-    date = Dates.query.first()
-    # Convert the epoch time to a datetime object
-    start_date_time = datetime.fromtimestamp(date.start_date_time)
-    end_date_time = datetime.fromtimestamp(date.end_date_time)
-
-    # Get the current date time
-    current_date_time = datetime.now()
-
-    # Check if current date time is between start date time and end date time
-    if start_date_time < current_date_time < end_date_time:
-        return True
-    else:
-        return False
+    return phase.voting_open()
 
 
 def date_after():
-    date = Dates.query.first()
-    # Convert the epoch time to a datetime object
-    start_date_time = datetime.fromtimestamp(date.start_date_time)
-    end_date_time = datetime.fromtimestamp(date.end_date_time)
-
-    # Get the current date time
-    current_date_time = datetime.now()
-
-    # Check if current date time is between start date time and end date time
-    if current_date_time > end_date_time:
-        return True
-    else:
-        return False
-
+    return phase.voting_closed()
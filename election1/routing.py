@@ -0,0 +1,73 @@
+"""
+Read replica routing for the results and report queries.
+
+When REPLICA_DATABASE_URI is set a 'replica' bind is configured next to the primary
+database.  RoutingSession sends SELECT statements to it when the current request is
+served by one of REPLICA_BLUEPRINTS or REPLICA_ENDPOINTS, or runs inside a
+`with reporting():` block, unless it runs inside a `with primary():` block.  Everything else - writes, flushes, reads in a session
+with pending changes and every other page - stays on the primary, so ballot writes
+never wait behind report queries and nothing reads its own writes from the replica.
+"""
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _route_to_replica(self, clause):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _route_to_replica(session, clause):
+    if clause is None or not getattr(clause, 'is_select', False):
+        return False
+    if session.new or session.dirty or session.deleted:
+        return False
+    if not has_app_context():
+        return False
+    # reporting() or primary() decide for the statements run in their block
+    use_replica = g.get('use_replica')
+    if use_replica is not None:
+        return use_replica
+    if has_request_context():
+        config = current_app.config
+        return (request.blueprint in config.get('REPLICA_BLUEPRINTS', ())
+                or request.endpoint in config.get('REPLICA_ENDPOINTS', ()))
+    return False
+
+
+@contextmanager
+def reporting():
+    """
+    Send the SELECT statements run inside the block to the replica, if there is one.
+    """
+    with _routed(True):
+        yield
+
+
+@contextmanager
+def primary():
+    """
+    Keep the SELECT statements run inside the block on the primary database, also on a
+    replica routed page, for rows the request or another worker has just written.
+    """
+    with _routed(False):
+        yield
+
+
+@contextmanager
+def _routed(use_replica):
+    previous = g.get('use_replica')
+    g.use_replica = use_replica
+    try:
+        yield
+    finally:
+        g.use_replica = previous
@@ -0,0 +1,262 @@
+"""
+Scheduled election transitions.
+
+The election window of the Dates row used to be looked at only by the requests that
+happened to come along.  Each worker now runs a scheduler thread that sleeps until the
+window's next edge (phase.seconds_to_next_transition) and then runs the transition due:
+
+    open    voting starts: the ballot is frozen (the admin pages lock their forms), its
+            size is checked and recorded, and every worker loads the office and candidate
+            lists of each group's ballot into its caches for the rest of the window
+    close   voting ends: the unused tokens are expired, which stops the ballots and
+            drains the ones in flight, the votes are counted once into final_tally, and
+            every worker drops its ballot caches
+
+The shared part of a transition runs once per election window across the workers: the
+worker whose insert of the election_transition row succeeds runs it, the others wait for
+the row to say done and then do their own part.  A run that failed, or whose worker
+stopped beating for SCHEDULER_STALE_SECONDS, is taken over by the next worker to look, up
+to SCHEDULER_ATTEMPTS runs.  A worker started after an edge runs the overdue transition
+at once, so a server that was down when voting closed still closes it.
+
+gunicorn's post_fork starts the thread of a worker, any other server starts it with the
+first request.  ELECTION_SCHEDULER turns it on, by default with ENFORCE_VOTING_WINDOW.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+from flask import current_app
+from election1 import phase, refdata, suggest
+from election1.cache import fragment_cache, reference_cache
+from election1.extensions import db
+from election1.models import Candidate, Classgrp, ElectionTransition, FinalTally, Office, Tokenlist
+from election1.sqlite_profile import retry_locked
+
+logger = logging.getLogger(__name__)
+
+OPEN = 'open'
+CLOSE = 'close'
+
+_thread_pid = None
+_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def init_scheduler(app):
+    """
+    Start the scheduler of a worker process with its first request.
+    """
+    if not app.config.get('ELECTION_SCHEDULER'):
+        return
+
+    @app.before_request
+    def start_scheduler():
+        start(app)
+
+
+def start(app):
+    """
+    Start the scheduler thread of this process, once.  A thread started in the gunicorn
+    master before the fork does not exist in the workers, so it is one per pid.
+    """
+    global _thread_pid
+    if not app.config.get('ELECTION_SCHEDULER') or _thread_pid == os.getpid():
+        return
+    with _lock:
+        if _thread_pid != os.getpid():
+            threading.Thread(target=_loop, args=(app,), name='election-scheduler', daemon=True).start()
+            _thread_pid = os.getpid()
+            logger.info('election scheduler started')
+
+
+def reset_window(start, end):
+    """
+    A new election window is saved: the tokens an earlier close expired can vote again,
+    and the transitions and final tally of an earlier window with the same times are
+    forgotten, so open and close run for it.  The caller commits.
+    """
+    Tokenlist.clear_expiry()
+    ElectionTransition.delete_window(start, end)
+    FinalTally.delete_window(start, end)
+
+
+def wake():
+    """
+    Have this worker's scheduler read the Dates row again now, after it was changed.
+    The other workers see the change within SCHEDULER_POLL_INTERVAL.
+    """
+    _wake.set()
+
+
+def _loop(app):
+    handled = set()
+    while True:
+        # cleared first, a wake() while the tick runs makes the next one start at once
+        _wake.clear()
+        with app.app_context():
+            try:
+                delay = tick(handled)
+            except Exception:
+                logger.exception('election scheduler tick failed')
+                delay = app.config.get('SCHEDULER_POLL_INTERVAL', 30)
+            finally:
+                db.session.remove()
+        _wake.wait(delay)
+
+
+def due_transitions(window, now):
+    """
+    :return: the transitions due at now, the open of a window that is over is skipped.
+    """
+    if not window.configured or now <= window.start:
+        return []
+    if now < window.end:
+        return [OPEN]
+    return [CLOSE]
+
+
+def tick(handled):
+    """
+    Run the transitions that are due and that this worker has not finished yet.
+    :param handled: (name, start, end) of the transitions this worker is done with, updated.
+    :return: the seconds to sleep before the next tick.
+    """
+    poll = current_app.config.get('SCHEDULER_POLL_INTERVAL', 30)
+    window = phase.refresh_election_window()
+    now = time.time()
+    waiting = False
+    for name in due_transitions(window, now):
+        key = (name, window.start, window.end)
+        # unless the row was deleted since, by a new window with the same times or a reset election
+        if key in handled and ElectionTransition.get(name, window.start, window.end) is not None:
+            continue
+        if run_transition(name, window):
+            handled.add(key)
+        else:
+            waiting = True
+
+    delay = phase.seconds_to_next_transition(now)
+    # wake just after the edge, when current_phase has moved on
+    delay = poll if delay is None else min(poll, delay + 0.5)
+    if waiting:
+        delay = min(delay, current_app.config.get('SCHEDULER_RETRY_INTERVAL', 5))
+    return max(delay, 0.1)
+
+
+def run_transition(name, window):
+    """
+    Run the shared part of a transition if this worker claims it, then this worker's own part.
+    :return: False while the shared part is still to run, on this or another worker.
+    """
+    config = current_app.config
+    if _claim(name, window, f'{socket.gethostname()}:{os.getpid()}'[:64],
+              config.get('SCHEDULER_STALE_SECONDS', 300), config.get('SCHEDULER_ATTEMPTS', 3)):
+        _run_shared(name, window)
+
+    row = ElectionTransition.get(name, window.start, window.end)
+    db.session.commit()  # end the read, the next tick must see the other workers' writes
+    if row.status == 'running' or (row.status == 'failed' and row.attempts < config.get('SCHEDULER_ATTEMPTS', 3)):
+        return False
+    LOCAL_PARTS[name](window)
+    return True
+
+
+@retry_locked
+def _claim(name, window, worker, stale_seconds, max_attempts):
+    return ElectionTransition.claim(name, window.start, window.end, worker, stale_seconds, max_attempts)
+
+
+@retry_locked
+def _finish(name, window, status, message):
+    ElectionTransition.finish(name, window.start, window.end, status, message)
+    db.session.commit()
+
+
+def _run_shared(name, window):
+    start = time.perf_counter()
+    logger.info('election %s transition started', name)
+    try:
+        message = SHARED_PARTS[name](window)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('election %s transition failed', name)
+        _finish(name, window, 'failed', f'{type(e).__name__}: {e}')
+    else:
+        _finish(name, window, 'done', message)
+        logger.info('election %s transition done in %.1fs: %s', name, time.perf_counter() - start, message)
+
+
+def open_election(window):
+    """
+    The shared part of the open transition: check every group has a ballot.
+    :return: the summary kept in the transition row.
+    """
+    groups = offices = 0
+    for _, group in Classgrp.classgrp_query():
+        ballot = Office.query_offices_for_classgroup_with_details_as_list(group)
+        if not ballot:
+            logger.warning('voting opened but class group %s has no office with candidates', group)
+        groups += 1
+        offices += len(ballot)
+    candidates = Candidate.query.count()
+    db.session.commit()
+    return f'{groups} groups, {offices} ballot offices, {candidates} candidates'
+
+
+@retry_locked
+def _expire_tokens():
+    expired = Tokenlist.expire_unused()
+    db.session.commit()
+    return expired
+
+
+@retry_locked
+def _record_tally(window):
+    from election1.results.view import count_votes  # Local import, the results pages are not always served
+    candidates = count_votes()
+    FinalTally.record(window.start, window.end, candidates)
+    db.session.commit()
+    return len(candidates)
+
+
+def close_election(window):
+    """
+    The shared part of the close transition.  Expiring the unused tokens stops the
+    ballots: record_ballot takes its token with a conditional update, so a ballot in
+    flight either committed first and is counted, or finds its token expired and adds
+    nothing.  The expiry waits for the token rows those ballots hold, which drains them,
+    and the votes counted after it are final.
+    :return: the summary kept in the transition row.
+    """
+    expired = _expire_tokens()
+    tallied = _record_tally(window)
+    return f'{expired} unused tokens expired, {tallied} candidate totals recorded'
+
+
+def warm_worker(window):
+    """
+    This worker's part of the open transition: load the ballot and reference caches.
+    """
+    ttl = max(current_app.config.get('BALLOT_CACHE_TTL', 300), window.end - time.time())
+    refdata.classgrp_choices()
+    refdata.office_choices()
+    if 'vote' in current_app.blueprints:
+        from election1.vote.view import warm_ballots  # Local import, only a worker serving the vote pages has them
+        logger.info('%s ballot candidate lists loaded', warm_ballots(ttl))
+    db.session.commit()
+
+
+def drop_worker_ballots(window):
+    """
+    This worker's part of the close transition: the ballot caches are not needed any more.
+    """
+    fragment_cache.invalidate('ballot')
+    reference_cache.invalidate('ballot_offices')
+    suggest.invalidate()
+
+
+SHARED_PARTS = {OPEN: open_election, CLOSE: close_election}
+LOCAL_PARTS = {OPEN: warm_worker, CLOSE: drop_worker_ballots}
@@ -0,0 +1,114 @@
+"""
+Tuned SQLite settings for running several workers on one box.
+
+With SQLITE_TUNED set every new sqlite connection gets the SQLITE_PRAGMAS (WAL journal,
+synchronous=NORMAL, busy_timeout, mmap_size, cache_size), a daemon thread in each worker
+checkpoints the WAL every SQLITE_CHECKPOINT_INTERVAL seconds, and write paths wrapped in retry_locked
+are run again with a bounded backoff when SQLite still answers "database is locked".
+"""
+import logging
+import os
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from election1.extensions import db
+
+logger = logging.getLogger(__name__)
+
+_checkpoint_pid = None
+_checkpoint_lock = threading.Lock()
+
+
+def init_sqlite(app):
+    """
+    Apply the pragmas to the sqlite engines of the app, and start the WAL checkpoints of
+    a worker process with its first request.
+    """
+    if not app.config.get('SQLITE_TUNED'):
+        return
+    with app.app_context():
+        engines = [e for e in db.engines.values() if e.url.get_backend_name() == 'sqlite']
+    for engine in engines:
+        event.listen(engine, 'connect', _pragma_listener(app.config['SQLITE_PRAGMAS']))
+    if engines and app.config.get('SQLITE_CHECKPOINT_INTERVAL', 0):
+        @app.before_request
+        def start_sqlite_checkpoints():
+            start_checkpoints(app)
+
+
+def start_checkpoints(app):
+    """
+    Start the WAL checkpoint thread of this process, once.  A thread started in the
+    gunicorn master before the fork does not exist in the workers, so it is one per pid,
+    gunicorn's post_fork starts it.
+    """
+    global _checkpoint_pid
+    interval = app.config.get('SQLITE_CHECKPOINT_INTERVAL', 0)
+    if not app.config.get('SQLITE_TUNED') or not interval or _checkpoint_pid == os.getpid():
+        return
+    with _checkpoint_lock:
+        if _checkpoint_pid == os.getpid():
+            return
+        with app.app_context():
+            engine = next((e for e in db.engines.values() if e.url.get_backend_name() == 'sqlite'), None)
+        if engine is not None:
+            threading.Thread(target=_checkpoint_loop, args=(engine, interval),
+                             name='sqlite-wal-checkpoint', daemon=True).start()
+            logger.info('sqlite wal checkpoints started')
+        _checkpoint_pid = os.getpid()
+
+
+def _pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def _checkpoint_loop(engine, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            with engine.connect() as connection:
+                busy, wal_pages, moved = connection.execute(text('PRAGMA wal_checkpoint(PASSIVE)')).one()
+                logger.debug('wal checkpoint: %s of %s pages moved', moved, wal_pages)
+        except Exception as e:
+            logger.error('wal checkpoint failed: %s', e)
+
+
+def is_locked_error(error):
+    return isinstance(error, OperationalError) and 'database is locked' in str(error.orig)
+
+
+def retry_locked(write):
+    """
+    Decorator for a function that writes and commits.  When the commit fails because the
+    database is locked the session is rolled back and the whole function runs again, up
+    to SQLITE_LOCK_RETRIES more times with an exponential backoff and jitter.
+    """
+    @wraps(write)
+    def wrapper(*args, **kwargs):
+        retries = current_app.config.get('SQLITE_LOCK_RETRIES', 0) if has_app_context() else 0
+        delay = current_app.config.get('SQLITE_LOCK_BACKOFF', 0.05) if has_app_context() else 0
+        attempt = 0
+        while True:
+            try:
+                return write(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if not is_locked_error(e) or attempt >= retries:
+                    raise
+                attempt += 1
+                sleep = delay * (2 ** (attempt - 1)) * (1 + random.random())
+                logger.info('database is locked in %s, retry %s in %.3fs', write.__name__, attempt, sleep)
+                time.sleep(sleep)
+    return wrapper
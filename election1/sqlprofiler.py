@@ -0,0 +1,99 @@
+"""
+Per request SQL profiler for development.
+
+With SQL_PROFILER set (the default for the development DB_PROFILE) every statement a
+request runs is timed through the cursor events of queryevents.py and grouped by its
+normalized text (literals and IN lists folded to ?).  After the request one JSON line
+is logged with the totals; statements run SQL_PROFILER_REPEAT_THRESHOLD times or more
+are listed as N+1 candidates and the line is logged as a warning.  SQL_PROFILER_FOOTER
+also appends the totals to the bottom of full HTML pages.
+"""
+import json
+import logging
+import re
+import time
+
+from flask import current_app, g, request, has_request_context
+from markupsafe import escape
+from election1 import queryevents
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(statement):
+    """
+    Fold the literals, bound parameters and IN lists of statement so that queries that
+    only differ in their values group together.
+    """
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = re.sub(r'%\(\w+\)s|%s|:\w+', '?', statement)
+    statement = _PARAM_LIST.sub('(?)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+def init_sqlprofiler(app):
+    if not app.config.get('SQL_PROFILER'):
+        return
+    app.before_request(_start_request)
+    app.after_request(_report_request)
+    queryevents.subscribe(_profile_query)
+
+
+def _start_request():
+    g.sqlprofile_start = time.perf_counter()
+    g.sqlprofile = {}  # normalized statement -> [count, seconds]
+
+
+def _report_request(response):
+    profile = g.pop('sqlprofile', None)
+    if profile is None:
+        return response
+    threshold = current_app.config.get('SQL_PROFILER_REPEAT_THRESHOLD', 3)
+    queries = sum(count for count, _ in profile.values())
+    db_ms = sum(seconds for _, seconds in profile.values()) * 1000
+    repeated = [{'statement': statement, 'count': count, 'ms': round(seconds * 1000, 2)}
+                for statement, (count, seconds) in sorted(profile.items(), key=lambda item: -item[1][0])
+                if count >= threshold]
+    line = {
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'queries': queries,
+        'distinct': len(profile),
+        'db_ms': round(db_ms, 2),
+        'total_ms': round((time.perf_counter() - g.pop('sqlprofile_start')) * 1000, 2),
+        'repeated': repeated,
+    }
+    (logger.warning if repeated else logger.info)('sql profile %s', json.dumps(line))
+
+    if current_app.config.get('SQL_PROFILER_FOOTER') and response.mimetype == 'text/html' \
+            and not response.direct_passthrough:
+        _add_footer(response, line)
+    return response
+
+
+def _add_footer(response, line):
+    body = response.get_data(as_text=True)
+    if '</body>' not in body:
+        # HTMX fragments and partial pages have no body to add to
+        return
+    rows = ''.join(f"<li>{item['count']} &times; {item['ms']} ms: <code>{escape(item['statement'])}</code></li>"
+                   for item in line['repeated'])
+    footer = (f"<div class=\"container small text-muted border-top mt-3\">sql: {line['queries']} queries "
+              f"({line['distinct']} distinct) in {line['db_ms']} ms, request {line['total_ms']} ms"
+              f"{'<ul>' + rows + '</ul>' if rows else ''}</div>")
+    response.set_data(body.replace('</body>', footer + '</body>', 1))
+
+
+def _profile_query(statement, elapsed):
+    if has_request_context() and 'sqlprofile' in g:
+        entry = g.sqlprofile.setdefault(normalize(statement), [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
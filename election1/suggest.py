@@ -0,0 +1,107 @@
+"""
+Write-in name suggestions.
+
+Voters typing a write-in and admins registering one get the names already known for
+the (group, office): its candidates and its registered write-in candidates.  Each
+(group, office) has a NameIndex, a sorted array of (folded key, name) searched with
+bisect, so a keystroke costs a binary search instead of a LIKE scan.  Every word of a
+name is a key, 'smi' finds 'John Smith'.
+
+The indexes live in reference_cache under ('write_in_names', group, office), loaded on
+first use.  A write-in registration adds its name to the index in place (add_name),
+the other candidate, class group and office changes drop them (refdata).
+"""
+from bisect import bisect_left
+
+from flask import current_app
+
+from election1.cache import reference_cache
+from election1.models import Candidate
+
+
+def fold(text):
+    """
+    :return: text lower cased with its whitespace collapsed, the form names are compared in.
+    """
+    return ' '.join(text.split()).casefold()
+
+
+class NameIndex:
+    """
+    The names of one (group, office), immutable: add() returns a new index so readers
+    never see it change under them.
+    """
+
+    def __init__(self, names=(), _entries=None):
+        if _entries is None:
+            _entries = sorted({entry for name in names for entry in self._keys(name)})
+        self._entries = _entries
+
+    @staticmethod
+    def _keys(name):
+        name = ' '.join(name.split())
+        words = fold(name).split(' ')
+        return [(' '.join(words[i:]), name) for i in range(len(words)) if words[i]]
+
+    def __len__(self):
+        return len({name for key, name in self._entries})
+
+    def add(self, name):
+        """
+        :return: a new index with name added.
+        """
+        entries = sorted(set(self._entries).union(self._keys(name)))
+        return NameIndex(_entries=entries)
+
+    def lookup(self, prefix, limit=10):
+        """
+        :param prefix: what was typed so far, the start of any word of a name.
+        :param limit: the most names returned.
+        :return: the matching names, in order, without duplicates.
+        """
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        names = []
+        position = bisect_left(self._entries, (prefix,))
+        while position < len(self._entries) and len(names) < limit:
+            key, name = self._entries[position]
+            if not key.startswith(prefix):
+                break
+            if name not in names:
+                names.append(name)
+            position += 1
+        return names
+
+
+def _index(group, office):
+    return reference_cache.get_or_load(('write_in_names', group, office),
+                                       lambda: NameIndex(Candidate.known_names(group, office)),
+                                       current_app.config.get('REFERENCE_CACHE_TTL'))
+
+
+def suggestions(group, office, prefix):
+    """
+    :param group: the class group name.
+    :param office: the office title.
+    :param prefix: what was typed so far.
+    :return: up to WRITEIN_SUGGESTIONS names known for group and office.
+    """
+    if len(fold(prefix)) < current_app.config.get('WRITEIN_SUGGEST_MIN_CHARS', 2):
+        return []
+    return _index(group, office).lookup(prefix, current_app.config.get('WRITEIN_SUGGESTIONS', 10))
+
+
+def add_name(group, office, name):
+    """
+    Add a newly registered name to the index of group and office, if it is loaded.
+    Another worker sees it when its copy expires after REFERENCE_CACHE_TTL.
+    """
+    key = ('write_in_names', group, office)
+    index = reference_cache.get(key)
+    if index is not None:
+        reference_cache.set(key, index.add(name), current_app.config.get('REFERENCE_CACHE_TTL'))
+
+
+def invalidate():
+    reference_cache.invalidate('write_in_names')
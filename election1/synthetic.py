@@ -0,0 +1,293 @@
+"""
+Synthetic elections for benchmarks, capacity tests and election day rehearsals.
+
+build_election() bulk inserts class groups, offices (of every ballot type but Measure),
+candidates with optional write-in entries, Tokenlistselectors for single and combined
+groups and the voting tokens.  cast_ballots() then lets a share of the unused tokens
+vote, partly or completely, at times that follow a turnout curve over the election
+window; the names written in stay on the votes, an admin registering some of them as
+write-in candidates is a separate option.  Every name, token and choice comes from random.Random(seed), so the same
+arguments always build the same election.  `flask generate-election` and
+`flask generate-votes` (commands.py) run them from the command line.
+"""
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update, delete, bindparam, func
+from election1.extensions import db
+from election1.refdata import bump_versions
+from election1.models import (Classgrp, Office, Candidate, BallotType, Tokenlist, Tokenlistselectors,
+                              Votes, WriteinCandidate, Dates, ElectionTransition, FinalTally)
+
+FIRSTNAMES = ('Ava', 'Ben', 'Chloe', 'Dylan', 'Emma', 'Finn', 'Grace', 'Henry', 'Isla', 'Jack',
+              'Kai', 'Lily', 'Mason', 'Nora', 'Owen', 'Piper', 'Quinn', 'Ruby', 'Sam', 'Theo')
+LASTNAMES = ('Adams', 'Brown', 'Clark', 'Davis', 'Evans', 'Flores', 'Garcia', 'Hill', 'Ito', 'Jones',
+             'King', 'Lopez', 'Moore', 'Nguyen', 'Ortiz', 'Patel', 'Reed', 'Smith', 'Turner', 'Young')
+
+# the ballot types given to the offices in turn
+OFFICE_BALLOT_TYPES = ('Normal', 'Normal', 'Single Name', 'Normal', 'Rank Choice')
+
+# inverse cumulative turnout curves, map a uniform sample to a point of the voting window
+TURNOUT_CURVES = {
+    'flat': lambda rng: rng.random(),
+    'morning': lambda rng: 1 - (1 - rng.random()) ** 0.5,  # most voters early, tailing off
+    'late': lambda rng: rng.random() ** 0.5,  # a rush before closing
+    'bell': lambda rng: (rng.random() + rng.random() + rng.random()) / 3,  # a midday peak
+}
+
+# the ChangeVersion counters of the tables built here, see conditional.py
+SYNTHETIC_TABLES = ('classgrp', 'office', 'candidate', 'tokenlistselectors')
+
+# tables cleared by reset_election(), children first
+ELECTION_MODELS = (Votes, Tokenlist, Tokenlistselectors, WriteinCandidate, Candidate, Office, Classgrp,
+                   ElectionTransition, FinalTally)
+
+
+@dataclass
+class SyntheticElection:
+    """
+    An election as the benchmarks and the load test see it.
+    """
+    groups: list = field(default_factory=list)  # class group names
+    offices: dict = field(default_factory=dict)  # group name -> [(id_office, title, sortkey, vote_for)]
+    candidates: dict = field(default_factory=dict)  # (group name, id_office) -> [(id_candidate, name)]
+    writeins: dict = field(default_factory=dict)  # (group name, id_office) -> id_candidate of the write-in entry
+    voted_tokens: list = field(default_factory=list)  # (grp_list, token)
+    unused_tokens: list = field(default_factory=list)  # (grp_list, token)
+    votes: int = 0
+
+
+def _token(rng):
+    return '%064x' % rng.getrandbits(256)
+
+
+def _insert(model, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(model.__table__), rows[start:start + batch_size])
+
+
+def _ballot_type_ids():
+    ids = {}
+    for name in set(OFFICE_BALLOT_TYPES):
+        ballot_type = BallotType.query.filter_by(ballot_type_name=name).first()
+        if ballot_type is None:
+            ballot_type = BallotType(ballot_type_name=name)
+            db.session.add(ballot_type)
+            db.session.flush()
+        ids[name] = ballot_type.id_ballot_type
+    return ids
+
+
+def reset_election():
+    """
+    Delete the groups, offices, candidates, tokens and votes, and the election transitions
+    and final tally of scheduler.py so the new election closes again, keeping the admins,
+    parties, ballot types and dates.
+    """
+    for model in ELECTION_MODELS:
+        db.session.execute(delete(model))
+    db.session.commit()
+    bump_versions(*SYNTHETIC_TABLES)
+
+
+def build_election(groups=4, offices=6, candidates=4, tokens=1000, seed=1, multi_group=0.0,
+                   writeins=0.0, batch_size=5000):
+    """
+    Bulk insert the groups, offices, candidates and unused tokens of a synthetic election,
+    must run in an app context on a database without groups, offices, candidates, token
+    selectors or tokens (tables_in_the_way).
+    :param groups: number of class groups.
+    :param offices: number of offices, every group votes for every office.
+    :param candidates: candidates per group and office.
+    :param tokens: voting tokens, spread over the Tokenlistselectors.
+    :param seed: seed of the random choices.
+    :param multi_group: share of the tokens that vote for two groups (a 'Group-001$Group-002' selector).
+    :param writeins: share of the group and office pairs that get a write-in entry.
+    :return: a SyntheticElection without votes.
+    """
+    rng = random.Random(seed)
+    election = SyntheticElection()
+    now = datetime.now()
+    ballot_type_ids = _ballot_type_ids()
+
+    group_rows = [dict(id_classgrp=i, name=f'Group-{i:03d}', sortkey=i, creation_datetime=now)
+                  for i in range(1, groups + 1)]
+    office_rows = [dict(id_office=j, office_title=f'Office {j:03d}', sortkey=j,
+                        office_vote_for=2 if j % 5 == 0 and candidates > 2 else 1,
+                        id_ballot_type=ballot_type_ids[OFFICE_BALLOT_TYPES[(j - 1) % len(OFFICE_BALLOT_TYPES)]],
+                        creation_datetime=now)
+                   for j in range(1, offices + 1)]
+    single_name = {ballot_type_ids['Single Name']}
+
+    candidate_rows = []
+    for group in group_rows:
+        election.groups.append(group['name'])
+        election.offices[group['name']] = [(o['id_office'], o['office_title'], o['sortkey'], o['office_vote_for'])
+                                           for o in office_rows]
+        for office in office_rows:
+            key = (group['name'], office['id_office'])
+            entries = election.candidates.setdefault(key, [])
+            for _ in range(candidates):
+                firstname = rng.choice(FIRSTNAMES)
+                # the candidate form stores an empty last name for single name ballots
+                lastname = '' if office['id_ballot_type'] in single_name else rng.choice(LASTNAMES)
+                entries.append((len(candidate_rows) + 1, f'{firstname} {lastname}'))
+                candidate_rows.append(dict(id_candidate=len(candidate_rows) + 1, firstname=firstname,
+                                           lastname=lastname, id_classgrp=group['id_classgrp'],
+                                           id_office=office['id_office'], creation_datetime=now))
+            if rng.random() < writeins:
+                # the same entry Candidate.check_and_insert_writein_candidate adds
+                election.writeins[key] = len(candidate_rows) + 1
+                candidate_rows.append(dict(id_candidate=len(candidate_rows) + 1, firstname='Writein',
+                                           lastname='Candidate', id_classgrp=group['id_classgrp'],
+                                           id_office=office['id_office'], creation_datetime=now))
+
+    # one selector per group, then pairs of neighbouring groups for the multi group tokens
+    selectors = [name for name in election.groups]
+    pairs = ['$'.join(election.groups[i:i + 2]) for i in range(0, groups - 1)] if multi_group else []
+    selector_rows = [dict(id_tokenListSelector=i, primary_grp=grp_list.split('$')[0],
+                          secondary_grp=(grp_list.split('$') + [None])[1], creation_datetime=now)
+                     for i, grp_list in enumerate(selectors + pairs, start=1)]
+
+    token_rows = []
+    for n in range(tokens):
+        grp_list = rng.choice(pairs) if pairs and rng.random() < multi_group else selectors[n % groups]
+        token = _token(rng)
+        token_rows.append(dict(grp_list=grp_list, token=token, creation_datetime=now))
+        election.unused_tokens.append((grp_list, token))
+
+    for model, rows in ((Classgrp, group_rows), (Office, office_rows), (Candidate, candidate_rows),
+                        (Tokenlistselectors, selector_rows), (Tokenlist, token_rows)):
+        _insert(model, rows, batch_size)
+    db.session.commit()
+    bump_versions(*SYNTHETIC_TABLES)
+    return election
+
+
+def load_election():
+    """
+    Read an existing election into a SyntheticElection, so cast_ballots() can add votes to it.
+    """
+    election = SyntheticElection()
+    groups = {g.id_classgrp: g.name for g in Classgrp.query.order_by(Classgrp.sortkey)}
+    election.groups = list(groups.values())
+    pairs = db.session.query(Candidate.id_classgrp, Office.id_office, Office.office_title, Office.sortkey,
+                             Office.office_vote_for).join(Office).distinct().order_by(Office.sortkey).all()
+    for id_classgrp, id_office, title, sortkey, vote_for in pairs:
+        election.offices.setdefault(groups[id_classgrp], []).append((id_office, title, sortkey, vote_for))
+    for candidate in Candidate.query.order_by(Candidate.id_candidate):
+        key = (groups[candidate.id_classgrp], candidate.id_office)
+        if candidate.firstname == 'Writein':
+            election.writeins[key] = candidate.id_candidate
+        else:
+            name = f'{candidate.firstname} {candidate.lastname or ""}'.strip()
+            election.candidates.setdefault(key, []).append((candidate.id_candidate, name))
+    for grp_list, token, submitted in db.session.query(Tokenlist.grp_list, Tokenlist.token,
+                                                       Tokenlist.vote_submitted_date_time):
+        (election.unused_tokens if submitted is None else election.voted_tokens).append((grp_list, token))
+    return election
+
+
+def voting_window():
+    """
+    :return: (start, end) datetimes of the Dates row, or the last eight hours when there is none.
+    """
+    dates = Dates.query.first()
+    if dates is not None:
+        return datetime.fromtimestamp(dates.start_date_time), datetime.fromtimestamp(dates.end_date_time)
+    end = datetime.now()
+    return end - timedelta(hours=8), end
+
+
+def cast_ballots(election, ballots, seed=1, curve='flat', partial=0.0, writein_share=0.1, window=None,
+                 register_writeins=0.0, batch_size=5000):
+    """
+    Let ballots of the unused tokens vote.
+    :param ballots: how many tokens vote, at most the unused ones.
+    :param curve: a TURNOUT_CURVES name, when in the voting window the ballots are cast.
+    :param partial: share of the ballots that skip some offices.
+    :param writein_share: share of the votes for an office with a write-in entry that are write-ins.
+    :param window: (start, end) datetimes, defaults to voting_window().
+    :param register_writeins: share of the names written in that are registered as
+        WriteinCandidate rows, as an admin would, names already registered are skipped.
+    :return: the number of votes added.
+    """
+    rng = random.Random(seed)
+    turnout = TURNOUT_CURVES[curve]
+    start, end = window or voting_window()
+    span = (end - start).total_seconds()
+
+    voters = election.unused_tokens[:ballots]
+    del election.unused_tokens[:ballots]
+    vote_rows, token_rows, writein_names = [], [], set()
+    for grp_list, token in voters:
+        when = start + timedelta(seconds=turnout(rng) * span)
+        skip = rng.random() < partial
+        for group in grp_list.split('$'):
+            for id_office, _, _, vote_for in election.offices.get(group, ()):
+                if skip and rng.random() < 0.5:
+                    continue
+                choices = election.candidates.get((group, id_office), [])
+                writein = election.writeins.get((group, id_office))
+                for id_candidate, _ in rng.sample(choices, min(vote_for, len(choices))):
+                    name = None
+                    if writein is not None and rng.random() < writein_share:
+                        id_candidate = writein
+                        name = f'{rng.choice(FIRSTNAMES)} {rng.choice(LASTNAMES)}'
+                        writein_names.add((name, group, id_office))
+                    vote_rows.append(dict(id_candidate=id_candidate, votes_token=token,
+                                          votes_writein_name=name, creation_datetime=when))
+        token_rows.append(dict(b_token=token, b_when=when))
+        election.voted_tokens.append((grp_list, token))
+
+    _insert(Votes, vote_rows, batch_size)
+    mark_voted = (update(Tokenlist.__table__).where(Tokenlist.__table__.c.token == bindparam('b_token'))
+                  .values(vote_submitted_date_time=bindparam('b_when')))
+    for first in range(0, len(token_rows), batch_size):
+        db.session.connection().execute(mark_voted, token_rows[first:first + batch_size])
+
+    if register_writeins:
+        _register_writeins(rng, writein_names, register_writeins, batch_size)
+    db.session.commit()
+    election.votes += len(vote_rows)
+    return len(vote_rows)
+
+
+def _register_writeins(rng, writein_names, share, batch_size):
+    group_ids = {g.name: g.id_classgrp for g in Classgrp.query}
+    registered = set(db.session.query(WriteinCandidate.writein_candidate_name, WriteinCandidate.id_classgrp,
+                                      WriteinCandidate.id_office))
+    rows = []
+    for name, group, id_office in sorted(writein_names):
+        if rng.random() < share and (name, group_ids[group], id_office) not in registered:
+            rows.append(dict(writein_candidate_name=name, id_classgrp=group_ids[group], id_office=id_office,
+                             creation_datetime=datetime.now()))
+    _insert(WriteinCandidate, rows, batch_size)
+
+
+def seed_election(groups=4, offices=6, candidates=4, tokens=1000, ballots=500, seed=1, batch_size=5000):
+    """
+    build_election() and cast_ballots() in one go with single group tokens and no
+    write-ins, the election the benchmarks use.
+    """
+    election = build_election(groups, offices, candidates, tokens, seed, batch_size=batch_size)
+    cast_ballots(election, ballots, seed, batch_size=batch_size)
+    return election
+
+
+def tables_in_the_way():
+    """
+    :return: the names of the tables build_election inserts into that already have rows,
+    it gives the groups, offices, candidates and token selectors explicit ids.
+    """
+    return [model.__tablename__ for model in (Classgrp, Office, Candidate, Tokenlistselectors, Tokenlist)
+            if db.session.query(model).first() is not None]
+
+
+def election_size():
+    """
+    :return: the row counts of the election tables, for reports.
+    """
+    return {model.__tablename__: db.session.query(func.count()).select_from(model).scalar()
+            for model in (Classgrp, Office, Candidate, Tokenlist, Votes, WriteinCandidate)}
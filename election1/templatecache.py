@@ -0,0 +1,44 @@
+"""
+Compiled templates.
+
+With TEMPLATE_CACHE_DIR set Jinja keeps the compiled bytecode of every template in
+that directory, so a new worker loads the voter pages without parsing them again.
+`flask compile-templates` fills the directory at deploy time (the Dockerfile runs it
+during the build) and wsgi.py loads all templates in the gunicorn master, so the
+forked workers start with them in memory.  A template whose source changed gets new
+bytecode, the cache is keyed by the source checksum.
+"""
+import logging
+import os
+
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+
+logger = logging.getLogger(__name__)
+
+
+def init_template_cache(app):
+    """
+    Give the Jinja environment of app the bytecode cache, must run before anything
+    uses app.jinja_env (the extensions add their globals to it).
+    """
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(directory)}
+
+
+def load_templates(app):
+    """
+    Compile every template of app into the Jinja memory cache (and the bytecode cache).
+    :return: the number of templates loaded.
+    """
+    loaded = 0
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        try:
+            app.jinja_env.get_template(name)
+            loaded += 1
+        except TemplateSyntaxError as e:
+            # a broken admin page must not stop the voter pages from loading
+            logger.error('template %s does not compile: %s', name, e)
+    return loaded
@@ -0,0 +1,37 @@
+"""
+Per-process cache of the admin identities returned by the Flask-Login user_loader.
+
+user_admin and deleteuser call invalidate_user() so a deleted admin is logged out on
+the next request of this worker, USER_CACHE_TTL bounds how long other workers keep it.
+"""
+from flask import current_app
+from election1.cache import user_cache
+from election1.dclasses import AdminIdentity
+from election1.extensions import db
+
+
+def load_user(id_user):
+    """
+    :param id_user: the id stored in the session by Flask-Login.
+    :return: an AdminIdentity or None if the user does not exist.
+    """
+    identity = user_cache.get(('user', id_user))
+    if identity is None:
+        from election1.models import User  # Local import to avoid circular import
+        user = db.session.get(User, id_user)
+        if user is None:
+            return None
+        identity = AdminIdentity(id_user=user.id_user, user_so_name=user.user_so_name,
+                                 id_admin_role=user.id_admin_role, user_status=user.user_status)
+        user_cache.set(('user', id_user), identity, current_app.config.get('USER_CACHE_TTL'))
+    return identity
+
+
+def invalidate_user(id_user=None):
+    """
+    Drop one cached identity, or all of them when id_user is None.
+    """
+    if id_user is None:
+        user_cache.invalidate('user')
+    else:
+        user_cache.invalidate('user', int(id_user))
@@ -4,6 +4,10 @@ import hashlib
 from datetime import datetime
 from flask import session, current_app
 from flask_login import current_user
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 def hash_password(password):
     salt = secrets.token_hex(16)  # Generate a 16-byte random salt
@@ -40,7 +44,7 @@ def session_check():
     if 'last_activity' in session:
         now = datetime.now()
         last_activity = datetime.strptime(session['last_activity'], "%Y-%m-%d %H:%M:%S")
-        print('last activity is', last_activity)
+        logger.debug('last activity is %s', last_activity)
         time_difference = now - last_activity
         time_difference_in_seconds = time_difference.total_seconds()
         if time_difference_in_seconds > idle_timeout:
@@ -1,5 +1,4 @@
 from flask_wtf import FlaskForm
-from wtforms_alchemy import QuerySelectField
 
 from election1.models import Classgrp, Office, Candidate
 from wtforms import RadioField, SubmitField, BooleanField
@@ -7,9 +6,6 @@ from election1.extensions import db
 from wtforms.validators import InputRequired
 
 
-def classgrp_query():
-    return Classgrp.query.order_by(Classgrp.sortkey)
-
 class VoteForOne(FlaskForm):
     candidate = RadioField(label='candidate', choices=[], validators=[InputRequired()])
     submit = SubmitField(label='submit')
@@ -32,8 +28,3 @@ class ReviewVotes(FlaskForm):
 #     candidate = RadioField(label='candidate', choices=[], validators=[InputRequired()])
 #     submit = SubmitField(label='submit')
 
-
-class  VoteResults(FlaskForm):
-    choices_classgrp = QuerySelectField(label='class or group', query_factory=classgrp_query, get_label='name')
-    submit = SubmitField(label='submit')
-
@@ -1,44 +1,53 @@
-from datetime import datetime
 from flask import Blueprint, request, render_template, redirect, session, current_app, url_for
-from election1.extensions import db
+from markupsafe import Markup
+from election1.cache import fragment_cache, reference_cache
+from election1.extensions import db, limiter
+from election1 import phase, suggest
+from election1.metrics import BALLOT_COMMITS, TOKEN_VALIDATIONS
+from election1.sqlite_profile import retry_locked
 from election1.models import Classgrp, Office, Candidate, Tokenlist, Votes
 from election1.vote.form import VoteForOne, VoteForMany, ReviewVotes
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import and_
+import logging
 
 vote = Blueprint('vote', __name__)
+logger = logging.getLogger(__name__)
 
 
-def log_vote_event(message):
-    log_file = 'vote_view_log.txt'
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    with open(log_file, 'a') as file:
-        file.write(f"{timestamp} - {message}\n")
+# the step by step trace of a voter, written to VOTE_EVENT_LOG by the development logging profile
+vote_events = logging.getLogger('election1.vote.events')
+
+
+def log_vote_event(message, *args, level=logging.DEBUG):
+    """
+    Log a voting step with lazy %-formatting, the session dumps cost nothing when DEBUG is off.
+    """
+    vote_events.log(level, message, *args)
 
 
 @vote.route('/cast/<grp_list>/<token>', methods=['POST', 'GET'])
+@limiter.limit('vote')
 def cast(grp_list, token):
-    log_vote_event('+++ cast '
-                   f"grp_list: {grp_list}, token: {token}, ")
-
+    log_vote_event('+++ cast grp_list: %s, token: %s', grp_list, token)
 
-    # uncomment the following to check if the date time is valid for voting
 
-    # if not date_between():
-    #     home = current_app.config['HOME']
-    #     return render_template('bad_date.html', home=home)
+    # the election window is cached by election1.phase so this check costs no query
+    if current_app.config['ENFORCE_VOTING_WINDOW'] and not phase.voting_open():
+        home = current_app.config['HOME']
+        return render_template('bad_date.html', home=home)
 
 
     # Check if there is no session then check the validity of the token
     # when a voter comes to the cast page it votes in a single session
-    global next_office
+    # next_office stays local, a module global was shared by the threads of a worker
     if not session:
-        log_vote_event('new session' 
-                       f' for grp_list: {grp_list}, and token: {token}, ')
+        log_vote_event('new session for grp_list: %s, and token: %s', grp_list, token)
 
     # validate the groups are valid - the groups along with the token are in the url
         if not are_all_classgrps_valid(grp_list):
-            log_vote_event(f"Invalid class group: {grp_list}")
+            log_vote_event("Invalid class group: %s", grp_list, level=logging.INFO)
+            TOKEN_VALIDATIONS.labels('bad_group').inc()
             home = current_app.config['HOME']
             error = 'Invalid class group ' + grp_list
             return render_template('bad_token.html', error=error, home=home)
@@ -59,9 +68,10 @@ def cast(grp_list, token):
         home = current_app.config['HOME']  # setup the link when there is a problem
 
         if token_list_record.get('grp_list') != grp_list:
+            TOKEN_VALIDATIONS.labels('group_mismatch').inc()
             return render_template('bad_token.html', error="group error in URL ", home=home)
         else:
-            log_vote_event(f"grp_list matches the value in token_list_record: {grp_list} - Token: {token}")
+            log_vote_event("grp_list matches the value in token_list_record: %s - Token: %s", grp_list, token)
 
         """ 
         if the token is not in the database or the token has been used the classmethod returns a dictionary with the key
@@ -69,12 +79,14 @@ def cast(grp_list, token):
         """
 
         if 'error' in token_list_record:
-            log_vote_event(f"Token is bad: {token_list_record['error']} - Token: {token}")
+            log_vote_event("Token is bad: %s - Token: %s", token_list_record['error'], token, level=logging.INFO)
+            TOKEN_VALIDATIONS.labels('used' if 'used' in token_list_record['error'] else 'invalid').inc()
             return render_template('bad_token.html', error=token_list_record['error'], home=home)
 
         # the token seems good so log the event.   This does not mean that the voter has voted
-        log_vote_event(f"Token is good: {token}")
-        log_vote_event('token_list_record ' + str(token_list_record))
+        log_vote_event("Token is good: %s", token)
+        TOKEN_VALIDATIONS.labels('valid').inc()
+        log_vote_event('token_list_record %s', token_list_record)
 
 
         """
@@ -89,7 +101,7 @@ def cast(grp_list, token):
         """
 
         session['token_list_record'] = token_list_record
-        print('token_list_record ' + str(session.get('token_list_record')))
+        logger.debug('token_list_record %s', session.get('token_list_record'))
 
 
         '''
@@ -99,17 +111,17 @@ def cast(grp_list, token):
         '''
 
         session['grp_pointer'] = 0
-        print('session grp_pointer ' + str(session.get('grp_pointer')))
+        logger.debug('session grp_pointer %s', session.get('grp_pointer'))
 
         # the grp_list is the list of groups for the voter the list is in the url
         #
-        log_vote_event('grp_list ' + grp_list)
+        log_vote_event('grp_list %s', grp_list)
         session['grp_list'] = grp_list
-        print('grp_list ' + grp_list)
+        logger.debug('grp_list %s', grp_list)
 
         # nbr of groups are seperated by $ in the url
         session['grp_list_length'] = len(grp_list.split('$'))
-        print('grp_list_length ' + str(session['grp_list_length']))
+        logger.debug('grp_list_length %s', session['grp_list_length'])
 
         # since there could be more than 1 group for the voter the group
         # in session is the current group used to get the offices
@@ -118,31 +130,31 @@ def cast(grp_list, token):
         # using the session['grp_pointer'] to get the current group
         # the session['group'
         session['group'] = grp_list.split('$')[session.get('grp_pointer')]
-        print('session group ' + str(session.get('group')))
+        logger.debug('session group %s', session.get('group'))
 
         # grp is the current group
         grp = grp_list.split('$')[session.get('grp_pointer')]
-        print('grp  from list using grp_pointer as offset' + str(grp))
+        logger.debug('grp  from list using grp_pointer as offset %s', grp)
 
         # get the office_dict from the database for the group
         # office_dict = get_office_dict(grp_list.split('$'))
         office_dict = {}
 
         for group in (grp_list.split('$')):
-            offices = Office.query_offices_for_classgroup_with_details_as_list(group)
+            offices = ballot_offices(group)
             # Add the group and its associated offices to the dictionary
             # office_dict[group] =
             # office{0] is the name of the office
             # office[1] is the sortkey
             # office[2] is the number of votes allowed
             # [] is the list of candidates voted for
-            log_vote_event('offices ' + str(offices))
+            log_vote_event('offices %s', offices)
             office_dict[group] = [[office[0], office[1], office[2], [], []] for office in offices]
-            log_vote_event(' ++  office_dict ' + str(office_dict))
+            log_vote_event(' ++  office_dict %s', office_dict)
 
 
         session['office_dict'] = office_dict
-        print('office_dict ' + str(session.get('office_dict')))
+        logger.debug('office_dict %s', session.get('office_dict'))
         session['office_dict_length'] = len(session.get('office_dict'))
         session['current_office'] = 0
 
@@ -164,33 +176,19 @@ def cast(grp_list, token):
         if next_office[2] == 1:  # vote for one
 
             votes_form = VoteForOne()
-            candidate_choices = office_grp_query(grp, next_office[0])
-            print('candidate_choices a ' + str(candidate_choices))
-            writein_candidate_id = has_writein_candidate(candidate_choices)
-            print('writein_candidate_id ' + str(writein_candidate_id))
-            html_writein = 0
-            if writein_candidate_id is not None:
-                html_writein = writein_candidate_id
-                filtered_choices = remove_writein_candidate(candidate_choices, writein_candidate_id)
-                VoteForOne.candidate.choices = filtered_choices
-            else:
-
-                VoteForOne.candidate.choices = candidate_choices
-                print ('VoteForOne.candidate.choices ' + str(VoteForOne.candidate.choices))
-
-            return render_template('cast1.html', form=votes_form, office=next_office[0],
-                                   candidates=VoteForOne.candidate.choices, grp=grp, html_writein=html_writein)
+            return render_template('cast1.html', form=votes_form, office=next_office[0], grp=grp,
+                                   choices=ballot_choices(grp, next_office[0], 1))
 
         if next_office[2] > 1:  # vote for one or
             votes_form = VoteForMany()
-            candidate_choices = office_grp_query(grp, next_office[0])
-            return render_template('cast2.html', form=votes_form, office=next_office[0],
-                                   candidates=candidate_choices, grp=grp, max_votes=next_office[2])
+            return render_template('cast2.html', form=votes_form, office=next_office[0], grp=grp,
+                                   choices=ballot_choices(grp, next_office[0], next_office[2]),
+                                   max_votes=next_office[2])
 
 # this is the end of session
 
     log_vote_event('167 ')
-    log_vote_event('check request.method ' + request.method)
+    log_vote_event('check request.method %s', request.method)
     if request.method == 'POST' or session.get('review', False):
         session['review'] = False
         form_name = request.form.get('form_name')
@@ -204,7 +202,7 @@ def cast(grp_list, token):
                     if form_name == 'VoteForOne':
                         selected_candidate_id = request.form.get('candidate')
                         # Add the selected_candidate_id to the list of candidates voted for
-                        log_vote_event('log this non final ' + str(selected_candidate_id))
+                        log_vote_event('log this non final %s', selected_candidate_id)
                         candidate_values = str(selected_candidate_id).split('$')
 
                         if candidate_values[1] == "Write In":
@@ -213,7 +211,7 @@ def cast(grp_list, token):
                         else:
                             office_entry[3].append([candidate_values[0], candidate_values[1]])
                             office_entry[4].append(None)
-                        log_vote_event('log this final ' + str(office_entry))
+                        log_vote_event('log this final %s', office_entry)
                     elif form_name == 'VoteForMany':
                         selected_candidate_ids = request.form.getlist('candidates')
                         for candidate_id in selected_candidate_ids:
@@ -225,69 +223,115 @@ def cast(grp_list, token):
                         break
             # Update the session with the modified office_dict
             # session['office_dict'] = office_dict
-            log_vote_event('201 ' + group)
+            log_vote_event('201 %s', group)
             next_office = get_next_office_for_group(session.get('office_dict'), group)
-            log_vote_event('203 next_office ' + str(next_office))
+            log_vote_event('203 next_office %s', next_office)
             if next_office is None:
                 if session['grp_pointer'] + 1 < session['grp_list_length']:
                     session['grp_pointer'] += 1
-                    log_vote_event('session grp_pointer gggg' + str(session['grp_pointer']))
-                    log_vote_event ('session grp_list_length gggg' + str(session['grp_list_length']))
-                    log_vote_event('grp_list gggg' + str(grp_list))
+                    log_vote_event('session grp_pointer gggg %s', session['grp_pointer'])
+                    log_vote_event('session grp_list_length gggg %s', session['grp_list_length'])
+                    log_vote_event('grp_list gggg %s', grp_list)
                     # session['group'] = grp_list.split('$')[session.get('grp_pointer')]
-                    log_vote_event('211 ' + str(session.get((grp_list))))
-                    log_vote_event('Session grp_list: ' + str(session.get('grp_list', 'Not set')))
-                    log_vote_event('Session grp_pointer: ' + str(session.get('grp_pointer', 'Not set')))
+                    log_vote_event('211 %s', session.get((grp_list)))
+                    log_vote_event('Session grp_list: %s', session.get('grp_list', 'Not set'))
+                    log_vote_event('Session grp_pointer: %s', session.get('grp_pointer', 'Not set'))
                     session['group'] = session['grp_list'].split('$')[session['grp_pointer']]
-                    log_vote_event('215 ' + str(session.get('group')))
+                    log_vote_event('215 %s', session.get('group'))
 
                     next_office = get_next_office_for_group(session.get('office_dict'), session.get('group'))
                 else:
                     log_vote_event('no more offices a')
                     vote_form = ReviewVotes()
-                    print('office_dict ' + str(session.get('office_dict')))
+                    logger.debug('office_dict %s', session.get('office_dict'))
                     return render_template('cast3.html', form=vote_form, group=session.get('group'),
                                            office_dict=session.get('office_dict'))
-            log_vote_event('next_office ' + str(next_office))
+            log_vote_event('next_office %s', next_office)
             if next_office is not None:
                 session['office'] = next_office[0]
                 if next_office[2] == 1:  # vote for one
                     votes_form = VoteForOne()
                     grp = session.get('group', None)
-                    candidate_choices = office_grp_query(grp, next_office[0])
-
-                    print('candidate_choices p ' + str(candidate_choices))
-                    writein_candidate_id = has_writein_candidate(candidate_choices)
-                    html_writein = 0
-                    if writein_candidate_id is not None:
-                        html_writein = writein_candidate_id
-                        filtered_choices = remove_writein_candidate(candidate_choices, writein_candidate_id)
-                        VoteForOne.candidate.choices = filtered_choices
-                    else:
-                        # html_writein = 0
-                        VoteForOne.candidate.choices = candidate_choices
-
                     # session['office'] = next_office[0]
-                    print('VoteForOne.candidate.choices x ' + str(VoteForOne.candidate.choices))
-                    return render_template('cast1.html', form=votes_form, office=next_office[0],
-                                           candidates=VoteForOne.candidate.choices, grp=grp, html_writein=html_writein)
+                    return render_template('cast1.html', form=votes_form, office=next_office[0], grp=grp,
+                                           choices=ballot_choices(grp, next_office[0], 1))
 
             if next_office is not None:
                 if next_office[2] > 1:  # vote for one or more
                     votes_form = VoteForMany()
                     grp = session.get('group', None)
-                    candidate_choices = office_grp_query(grp, next_office[0])
-                    VoteForOne.candidate.choices = candidate_choices
-                    return render_template('cast2.html', form=votes_form, office=next_office[0],
-                                           candidates=candidate_choices, grp=grp, max_votes=next_office[2])
+                    return render_template('cast2.html', form=votes_form, office=next_office[0], grp=grp,
+                                           choices=ballot_choices(grp, next_office[0], next_office[2]),
+                                           max_votes=next_office[2])
     vote_form = ReviewVotes()
     log_vote_event('no more offices b')
-    print('office_dict ' + str(session.get('office_dict')))
+    logger.debug('office_dict %s', session.get('office_dict'))
     return render_template('cast3.html', form=vote_form,
                            office_dict=session.get('office_dict'))
     # return 'no more offices'
 
 
+def ballot_choices(grp, office, vote_for):
+    """
+    The candidate list of a ballot step is the same for every voter of the group, only
+    the page around it (CSRF token, group and office headings) is per request.  It is
+    rendered once and kept in fragment_cache per (group, office, vote_for) until refdata
+    drops it after a candidate, office or class group change or BALLOT_CACHE_TTL runs out.
+    :param vote_for: the number of votes allowed, 1 renders radio buttons and the write-in field.
+    :return: the HTML of the candidate list.
+    """
+    key = ('ballot', grp, office, vote_for)
+    return fragment_cache.get_or_load(key, lambda: render_ballot_choices(grp, office, vote_for),
+                                      current_app.config.get('BALLOT_CACHE_TTL'))
+
+
+def ballot_offices(grp):
+    """
+    :return: the offices on the ballot of a group, [office_title, sortkey, vote_for] in
+    ballot order, kept in reference_cache like the candidate lists of ballot_choices.
+    """
+    return reference_cache.get_or_load(('ballot_offices', grp),
+                                       lambda: Office.query_offices_for_classgroup_with_details_as_list(grp),
+                                       current_app.config.get('BALLOT_CACHE_TTL'))
+
+
+def warm_ballots(ttl):
+    """
+    Load the office lists and render the candidate lists of every group's ballot into
+    this worker's caches, called by the scheduler when voting opens (scheduler.py).
+    The ballot cannot change while voting is open, so they are kept for ttl seconds, the
+    rest of the voting window.  Needs an app context, not a request.
+    :return: the number of candidate lists rendered.
+    """
+    rendered = 0
+    # the candidate lists link to the write-in suggestions with url_for
+    with current_app.test_request_context():
+        for _, group in Classgrp.classgrp_query():
+            offices = Office.query_offices_for_classgroup_with_details_as_list(group)
+            reference_cache.set(('ballot_offices', group), offices, ttl)
+            for office in offices:
+                fragment_cache.set(('ballot', group, office[0], office[2]),
+                                   render_ballot_choices(group, office[0], office[2]), ttl)
+                rendered += 1
+    return rendered
+
+
+def render_ballot_choices(grp, office, vote_for):
+    candidate_choices = office_grp_query(grp, office)
+    logger.debug('candidate_choices %s', candidate_choices)
+    if vote_for > 1:
+        return Markup(render_template('cast2_choices.html', candidates=candidate_choices))
+
+    writein_candidate_id = has_writein_candidate(candidate_choices)
+    logger.debug('writein_candidate_id %s', writein_candidate_id)
+    html_writein = 0
+    if writein_candidate_id is not None:
+        html_writein = writein_candidate_id
+        candidate_choices = remove_writein_candidate(candidate_choices, writein_candidate_id)
+    return Markup(render_template('cast1_choices.html', candidates=candidate_choices, office=office,
+                                  html_writein=html_writein))
+
+
 def office_grp_query(grp, office):
     return_list = []
     candidates = db.session.query(Candidate, Classgrp, Office).select_from(Candidate).join(Classgrp).join(
@@ -297,20 +341,35 @@ def office_grp_query(grp, office):
     return return_list
 
 
+@vote.route('/cast/writein_names')
+@limiter.limit('suggest')
+def writein_names():
+    """
+    HTMX suggestions for the write-in field of the ballot step in progress, the group and
+    office come from the session so only a voter in the middle of a ballot gets any.
+    """
+    group = session.get('group')
+    office = session.get('office')
+    if not session.get('token_list_record') or group is None or office is None:
+        return ''
+    names = suggest.suggestions(group, office, request.args.get('writein_name', ''))
+    return render_template('writein_suggestions.html', names=names)
+
+
 @vote.route('/edit_choice/<office_id>/<group>', methods=['POST', 'GET'])
 def edit_choice(office_id, group):
-    log_vote_event("edit_choice office " + office_id)
-    log_vote_event("edit_choice group " + group)
-    log_vote_event('edit_choice Session grp_list: ' + str(session.get('grp_list', 'Not set')))
+    log_vote_event("edit_choice office %s", office_id)
+    log_vote_event("edit_choice group %s", group)
+    log_vote_event('edit_choice Session grp_list: %s', session.get('grp_list', 'Not set'))
     office_dict = session.get('office_dict', {})
 
     if group in office_dict:
         for office in office_dict[group]:
             if office[1] == int(office_id):
-                log_vote_event('office edit_choice' + str(office))
+                log_vote_event('office edit_choice %s', office)
                 office[3] = []  # Clear the list of candidates voted for
                 office[4] = []  # Clear the list of candidate names voted for
-                log_vote_event('office edit_choice' + str(office))
+                log_vote_event('office edit_choice %s', office)
                 break
 
     # Update the session with the modified office_dict
@@ -336,43 +395,41 @@ def update_session_grp_pointer_for_group(group_name):
     if position != -1:
         session['grp_pointer'] = position
         session['group'] = group_name
-        log_vote_event(session['grp_pointer'])
+        log_vote_event('%s', session['grp_pointer'])
     else:
-        log_vote_event(f"Group {group_name} not found in grp_list")
+        log_vote_event("Group %s not found in grp_list", group_name)
 
 
 @vote.route('/post_ballot', methods=['POST'])
+@limiter.limit('vote')
+@limiter.ballot_writer
 def post_ballot():
+    if current_app.config['ENFORCE_VOTING_WINDOW'] and not phase.voting_open():
+        session.clear()
+        home = current_app.config['HOME']
+        return render_template('bad_date.html', home=home)
+
     if request.method == 'POST':
         office_dict = session.get('office_dict', {})
         token = session.get('token_list_record', {}).get('token', '')
-        # Process the submitted ballot data
-        # (Add your logic here to handle the ballot submission)
-        for group in office_dict:
-            for office in office_dict[group]:
-                item_ctr = 0
-                for item in office[3]:
-                    if item[0] != 99:
-                        # new_vote = Votes(id_candidate=item[0], votes_token=token, votes_writein_name=office[4][item_ctr])
-                        new_vote = Votes(id_candidate=item[0], votes_token=token,
-                                         votes_writein_name=None)
-                        db.session.add(new_vote)
-                        log_vote_event(f"Vote submitted for candidate {item[0]} - {item[1]}")
-                        item_ctr += 1
-                    pass
         try:
-            token_record = Tokenlist.query.filter_by(token=token).first()
-            if token_record:
-                print('token_record ' + str(token_record))
-                token_record.vote_submitted_date_time = datetime.now()
-                db.session.commit()
-            else:
-                db.session.rollback()
-                log_vote_event("log the token does not exist")
+            outcome = record_ballot(office_dict, token)
+            BALLOT_COMMITS.labels(outcome).inc()
+            if outcome == 'expired':
+                # voting closed while the voter was on the ballot
+                log_vote_event("token expired before the ballot was posted: %s", token, level=logging.INFO)
+                session.clear()
+                return render_template('bad_date.html', home=current_app.config['HOME'])
+            if outcome == 'used':
+                log_vote_event("token already used: %s", token, level=logging.WARNING)
+                return "Error: Token has already been used", 400
+            if outcome != 'committed':
+                log_vote_event("log the token does not exist", level=logging.WARNING)
                 return "Error: Token record does not exist", 400
         except SQLAlchemyError as e:
             db.session.rollback()
-            log_vote_event(f"Database error: {e}")
+            BALLOT_COMMITS.labels('error').inc()
+            log_vote_event("Database error: %s", e, level=logging.ERROR)
 
         # Clear the session data related to the ballot
     session.clear()
@@ -381,6 +438,35 @@ def post_ballot():
     return render_template('thank_you.html', home=home)
 
 
+@retry_locked
+def record_ballot(office_dict, token):
+    """
+    Mark the token used and add the votes of the ballot in one transaction.
+    The token is taken first with a conditional update (Tokenlist.mark_submitted), so a
+    token used by another submission or expired when voting closed adds no votes.
+    Runs again from the start if sqlite reports the database is locked.
+    :return: 'committed', or why the ballot was refused: 'missing_token', 'used' or 'expired'.
+    """
+    if not Tokenlist.mark_submitted(token):
+        db.session.rollback()
+        return Tokenlist.refusal(token)
+    # Process the submitted ballot data
+    for group in office_dict:
+        for office in office_dict[group]:
+            item_ctr = 0
+            for item in office[3]:
+                if item[0] != 99:
+                    # new_vote = Votes(id_candidate=item[0], votes_token=token, votes_writein_name=office[4][item_ctr])
+                    new_vote = Votes(id_candidate=item[0], votes_token=token,
+                                     votes_writein_name=None)
+                    db.session.add(new_vote)
+                    log_vote_event("Vote submitted for candidate %s - %s", item[0], item[1])
+                    item_ctr += 1
+                pass
+    db.session.commit()
+    return 'committed'
+
+
 def get_next_office_for_group(office_dict, group_name):
     """
     Get the next office for a specific group or return None if there are no more offices.
@@ -390,8 +476,8 @@ def get_next_office_for_group(office_dict, group_name):
     :return: The next office for the group or None.
     """
     # Check if the group exists in the office_dict
-    log_vote_event('group_name gnofg' + group_name)
-    log_vote_event('office_dict gnofg' + str(office_dict))
+    log_vote_event('group_name gnofg %s', group_name)
+    log_vote_event('office_dict gnofg %s', office_dict)
     if group_name not in office_dict:
         return None
 
@@ -424,13 +510,13 @@ def has_writein_candidate(candidate_choices):
     for the display of the writein field
     """
     for candidate in candidate_choices:
-        print('candidate choices checking for writein ' + candidate[1])
+        logger.debug('candidate choices checking for writein %s', candidate[1])
         if 'writein' in candidate[1].lower():
             return candidate[0]
     return None
 
 def remove_writein_candidate(candidate_choices, writein_candidate_id):
-    print('writein_candidate_id ' + str(writein_candidate_id))
+    logger.debug('writein_candidate_id %s', writein_candidate_id)
     return [candidate for candidate in candidate_choices if candidate[0] != writein_candidate_id]
 
 
@@ -0,0 +1,64 @@
+"""
+gunicorn settings for wsgi:app, every value can be overridden from the environment.
+
+    GUNICORN_BIND            address to listen on, default 0.0.0.0:8000
+    WEB_CONCURRENCY          worker processes, default 2 * cores + 1
+    GUNICORN_THREADS         threads per worker, default 2
+    GUNICORN_TIMEOUT         seconds a request may take before its worker is restarted
+    GUNICORN_MAX_REQUESTS    requests a worker serves before it is replaced (0 is never)
+
+Graceful reload: `kill -HUP <master pid>` starts new workers with the new settings and
+lets the old ones finish their requests.  Because the app is preloaded in the master,
+new code needs `kill -USR2 <master pid>` (start a new master) followed by
+`kill -TERM <old master pid>`, or a container restart.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '2'))
+
+# build the app (and warm its caches) once in the master, the workers share it
+preload_app = True
+
+# requests, and workers that stop answering, are cut off after timeout seconds
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# replace workers now and then so a slow leak cannot grow without bound
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOGLEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """
+    Drop the database connections the master opened while preloading, a forked
+    worker must open its own, and start the worker's logging, scheduler and WAL
+    checkpoint threads.
+    """
+    from wsgi import app
+    from election1 import scheduler, sqlite_profile
+    from election1.extensions import db
+    from election1.logsetup import restart_after_fork
+    restart_after_fork()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    scheduler.start(app)
+    sqlite_profile.start_checkpoints(app)
+
+
+def child_exit(server, worker):
+    """
+    Stop adding up the live gauges of a worker that exited (PROMETHEUS_MULTIPROC_DIR).
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
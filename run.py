@@ -1,14 +1,9 @@
 import os
-from flask import Flask, redirect, url_for, current_app
-from flask_wtf.csrf import CSRFError
+from flask import Flask
 from election1 import create_app
 
+# development server, production runs wsgi.py under gunicorn (see gunicorn.conf.py)
 app: Flask = create_app()
-# test comment
-
-@app.errorhandler(CSRFError)
-def handle_csrf_error(e):
-    return redirect(url_for('mains.homepage'))  # Redirect to the login page
 
 
 if __name__ == '__main__':
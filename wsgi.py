@@ -0,0 +1,35 @@
+"""
+Production entry point, run it with `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+APP_PROFILE picks the app: 'voter' for the vote workers, 'admin' for the election
+office, 'full' (the default) serves both.  gunicorn preloads this module in the master
+process, so the app and the warm caches are built once and shared with the workers.
+"""
+import logging
+
+from flask import Flask
+from election1 import create_app
+
+logger = logging.getLogger(__name__)
+
+
+def warm_caches(app):
+    """
+    Load the election window, the reference data and the templates before the workers
+    fork, so the first voters after a (re)start do not all miss the caches at once.
+    """
+    from election1 import phase, refdata
+    from election1.templatecache import load_templates
+    load_templates(app)
+    with app.app_context():
+        try:
+            phase.election_window()
+            refdata.classgrp_choices()
+            refdata.office_choices()
+        except Exception as e:
+            # a database that is not set up yet must not stop the server
+            logger.error('could not warm the caches: %s', e)
+
+
+app: Flask = create_app()
+warm_caches(app)